@@ -20,7 +20,10 @@
 import copy
 import datetime
 import decimal
+import os
+import pickle
 import string
+import tempfile
 import time
 
 import unittest
@@ -124,6 +127,23 @@ class Type(_TypeCheck):
         s12 = s1.clone(s2)
         self.assertIsInstance(s12, pytis.data.RegexString)
         self.assertEqual(s12.maxlen(), 4)
+    def test_validation_cache(self):
+        def statistics(type_):
+            stats = type_._validation_cache.statistics()
+            return stats['hits'], stats['misses']
+        # Primitive types don't use the validation cache at all.
+        t = pytis.data.Integer()
+        hits, misses = statistics(t)
+        self.assertEqual(t.validate('12')[0].value(), 12)
+        self.assertIsNotNone(t.validate('x')[1])
+        self.assertEqual(statistics(t), (hits, misses))
+        # Other types share cached values regardless of transactions.
+        t = pytis.data.TimeInterval()
+        hits, misses = statistics(t)
+        for transaction in (None, object(), object()):
+            self.assertEqual(t.validate('1:02:03', transaction=transaction)[0].value(),
+                             datetime.timedelta(hours=1, minutes=2, seconds=3))
+        self.assertEqual(statistics(t), (hits + 2, misses + 1))
 tests.add(Type)
 
 
@@ -534,6 +554,42 @@ class DataEnumerator(unittest.TestCase):
         e = self.cb1.enumerator()
         r = e.row('2')
         self.assertEqual(r['y'].value(), 'b', ('Unexpected value', r['y'].value()))
+    def test_cache(self):
+        e = self.cb1.enumerator()
+        data = e._data
+        queries = []
+        select = data.select
+        def counting_select(*args, **kwargs):
+            queries.append(kwargs.get('condition'))
+            return select(*args, **kwargs)
+        data.select = counting_select
+        e.prefetch(('1', '2', '8', '2', None))
+        self.assertEqual(len(queries), 1)
+        self.assertEqual(e.row('2')['y'].value(), 'b')
+        self.assertTrue(e.check('1'))
+        self.assertFalse(e.check('8'))
+        self.assertEqual(len(queries), 1)
+        data.update(sval('2'), pytis.data.Row((('x', sval('2')), ('y', sval('B')),
+                                               ('z', bval(True)))))
+        self.assertEqual(e.row('2')['y'].value(), 'b')
+        data._call_on_change_callbacks()
+        self.assertEqual(e.row('2')['y'].value(), 'B')
+        self.assertEqual(e.row('2')['y'].value(), 'B')
+        self.assertEqual(len(queries), 2)
+        # Rows of data without change notifications expire.
+        import config
+        self.assertFalse(data.changes_notified())
+        self.assertEqual(e._row_cache._ttl, config.enumerator_cache_ttl)
+    def test_cache_disabled(self):
+        import config
+        ttl = config.enumerator_cache_ttl
+        config.enumerator_cache_ttl = 0
+        try:
+            e = pytis.data.DataEnumerator(self.cb1.enumerator()._data_factory)
+            e.row('2')
+            self.assertEqual(len(e._row_cache), 0)
+        finally:
+            config.enumerator_cache_ttl = ttl
 tests.add(DataEnumerator)
 
 class FixedEnumerator(unittest.TestCase):
@@ -632,6 +688,47 @@ class Row(unittest.TestCase):
 tests.add(Row)
 
 
+class CompactRow(unittest.TestCase):
+    def test_it(self):
+        columns = pytis.data.CompactRow.Columns(('x', 'y'))
+        r1 = pytis.data.CompactRow(columns, [ival(1), sval('a')])
+        r2 = pytis.data.CompactRow(columns, [ival(2), sval('b')])
+        self.assertEqual(len(r1), 2)
+        self.assertEqual(r1['y'].value(), 'a')
+        self.assertEqual(r2[0].value(), 2)
+        self.assertEqual(r2[-1].value(), 'b')
+        self.assertEqual(r1.keys(), ['x', 'y'])
+        self.assertEqual(r1.columns(('y', 'x')), (sval('a'), ival(1)))
+        self.assertIn('x', r1)
+        self.assertNotIn('z', r1)
+        self.assertRaises(KeyError, lambda: r1['z'])
+        self.assertRaises(IndexError, lambda: r1[2])
+        self.assertEqual(r1, pytis.data.Row((('x', ival(1)), ('y', sval('a')))))
+        self.assertNotEqual(r1, r2)
+    def test_modifications(self):
+        columns = pytis.data.CompactRow.Columns(('x', 'y'))
+        r1 = pytis.data.CompactRow(columns, [ival(1), ival(2)])
+        r2 = copy.copy(r1)
+        r2['x'] = ival(3)
+        self.assertEqual(r1['x'].value(), 1)
+        self.assertEqual(r2['x'].value(), 3)
+        r1.append('z', ival(5))
+        self.assertEqual(r1['z'].value(), 5)
+        self.assertEqual(columns.keys(), ('x', 'y'))
+        self.assertNotIn('z', r2)
+        r1.update({'y': ival(8), 'w': ival(9)})
+        self.assertEqual([v.value() for v in r1], [1, 8, 5])
+    def test_pickle(self):
+        columns = pytis.data.CompactRow.Columns(('x', 'y'))
+        row = pytis.data.CompactRow(columns, [ival(1), sval('a')])
+        for protocol in (0, 2):
+            unpickled = pickle.loads(pickle.dumps(row, protocol))
+            self.assertIsInstance(unpickled, pytis.data.CompactRow)
+            self.assertEqual(unpickled.keys(), ['x', 'y'])
+            self.assertEqual([v.value() for v in unpickled], [1, 'a'])
+tests.add(CompactRow)
+
+
 class Data(unittest.TestCase):
     def setUp(self):
         c1 = self._column1 = pytis.data.ColumnSpec('foo',
@@ -704,6 +801,56 @@ class MemData(unittest.TestCase):
         self.assertEqual(len(rows), 2)
         self.assertEqual(rows[0]['b'].value(), 'Will')
         self.assertEqual(rows[1]['b'].value(), 'Bill')
+    def test_extended_conditions(self):
+        self._check_condition(pytis.data.ANY_OF('b', sval('John'), sval('Joe')), 3)
+        self._check_condition(pytis.data.OR(pytis.data.EQ('x', ival(3)),
+                                            pytis.data.LT('y', ival(11))), 4)
+        self._check_condition(pytis.data.WM('b', pytis.data.WMValue(pytis.data.String(),
+                                                                    'j*')), 3)
+        self._check_condition(pytis.data.WM('b', pytis.data.WMValue(pytis.data.String(),
+                                                                    'B?ll'),
+                                            ignore_case=False), 1)
+        self._check_condition(pytis.data.IN('a', self._data, 'a', pytis.data.GT('x', ival(4))), 4)
+        self._check_condition(pytis.data.AND(pytis.data.EQ('x', ival(5)),
+                                             pytis.data.NOT(pytis.data.EQ('b', sval('John')))), 1)
+    def test_sort_and_aggregate(self):
+        d = self._data
+        self.assertEqual(d.select(sort=(('x', pytis.data.DESCENDANT), 'y'), limit=4), 4)
+        self.assertEqual([d.fetchone()['a'].value() for i in range(4)], ['gg', 'ee', 'bb', 'ff'])
+        self.assertEqual(d.search(pytis.data.EQ('b', sval('Will'))), 0)
+        d.rewind()
+        self.assertEqual(d.search(pytis.data.EQ('b', sval('Joe'))), 4)
+        d.close()
+        self.assertEqual(d.select_aggregate((d.AGG_SUM, 'x')).value(), 34)
+        self.assertEqual(d.select_aggregate((d.AGG_MAX, 'y'), pytis.data.EQ('x', ival(5))).value(),
+                         31)
+        self.assertEqual(d.select_aggregate((d.AGG_COUNT, 'a')).value(), 7)
+        self.assertEqual([v.value() for v in d.distinct('x')], [1, 3, 5, 12])
+        self.assertEqual([v.value() for v in d.distinct('b', prefix=2, sort=pytis.data.DESCENDANT)],
+                         ['Wi', 'Jo', 'Ed', 'Bo', 'Bi'])
+    def test_select_page(self):
+        d = self._data
+        rows, count = d.select_page(sort=('a',), offset=2, limit=3, columns=('a',))
+        self.assertEqual([r['a'].value() for r in rows], ['cc', 'dd', 'ee'])
+        self.assertEqual(count, 7)
+        rows, count = d.select_page(condition=pytis.data.EQ('x', ival(5)), offset=2,
+                                    with_count=False)
+        self.assertEqual([r['a'].value() for r in rows], ['ff'])
+        self.assertIsNone(count)
+    def test_modifications(self):
+        d = self._data
+        row = pytis.data.Row((('a', sval('cc')), ('b', sval('Wilma')), ('x', ival(3)),
+                              ('y', ival(4))))
+        self.assertTrue(d.update(sval('cc'), row)[1])
+        self.assertEqual(d.row(sval('cc'))['b'].value(), 'Wilma')
+        self.assertEqual(d.delete(sval('aa')), 1)
+        self.assertIsNone(d.row(sval('aa')))
+        self.assertEqual(d.row(sval('bb'))['b'].value(), 'John')
+        self.assertFalse(d.update(sval('bb'), row)[1])
+        self.assertTrue(d.insert(pytis.data.Row((('a', sval('hh')), ('b', sval('Hugo')))))[1])
+        self.assertEqual(d.row(sval('hh'))['x'].value(), None)
+        self._check_condition(pytis.data.EQ('x', ival(3)), 2)
+        self._check_condition(None, 7)
 tests.add(MemData)
 
 
@@ -793,6 +940,74 @@ class DBConnection(unittest.TestCase):
 tests.add(DBConnection)
 
 
+class DBConnectionPool(unittest.TestCase):
+    class _Connection(object):
+        def __init__(self, connection_spec):
+            self._info = {}
+            self.closed = False
+        def connection_info(self, key):
+            return self._info.get(key)
+        def set_connection_info(self, key, value):
+            self._info[key] = value
+    def setUp(self):
+        self._options = dict([(o, getattr(config, o)) for o in
+                              ('connection_limit', 'connection_wait_timeout',
+                               'connection_max_age', 'connection_max_idle')])
+        self._spec = pytis.data.DBConnection(database='db')
+        def close(c):
+            c.closed = True
+        self._pool = pytis.data.DBConnectionPool(self._Connection, close)
+    def tearDown(self):
+        for o, v in self._options.items():
+            setattr(config, o, v)
+    def test_reuse(self):
+        pool, spec = self._pool, self._spec
+        c1 = pool.get(spec)
+        c2 = pool.get(spec)
+        self.assertIsNot(c1, c2)
+        pool.put_back(spec, c1)
+        self.assertIs(pool.get(spec), c1)
+        pool.put_back(spec, c1)
+        c2.set_connection_info('broken', True)
+        pool.put_back(spec, c2)
+        self.assertTrue(c2.closed)
+        info = pool.statistics()
+        self.assertEqual(info['checkouts'], 3)
+        self.assertEqual(info['created'], 2)
+        self.assertEqual(info['broken'], 1)
+        self.assertEqual(info['allocated'], 1)
+        self.assertEqual(info['idle'], 1)
+        self.assertEqual(len(pool.info()), 1)
+    def test_expiration(self):
+        pool, spec = self._pool, self._spec
+        config.connection_max_idle = 0
+        c = pool.get(spec)
+        pool.put_back(spec, c)
+        time.sleep(0.01)
+        self.assertIsNot(pool.get(spec), c)
+        self.assertTrue(c.closed)
+        self.assertEqual(pool.statistics()['expired'], 1)
+    def test_limit(self):
+        import threading
+        pool, spec = self._pool, self._spec
+        config.connection_limit = 1
+        config.connection_wait_timeout = 0.1
+        c = pool.get(spec)
+        self.assertRaises(pytis.data.DBSystemException, pool.get, spec)
+        config.connection_wait_timeout = 10
+        result = []
+        thread = threading.Thread(target=lambda: result.append(pool.get(spec)))
+        thread.start()
+        time.sleep(0.1)
+        pool.put_back(spec, c)
+        thread.join()
+        self.assertEqual(result, [c])
+        info = pool.statistics()
+        self.assertEqual(info['waits'], 2)
+        self.assertEqual(info['wait_timeouts'], 1)
+tests.add(DBConnectionPool)
+
+
 class DBBinding(unittest.TestCase):
     def test_it(self):
         b = pytis.data.DBBinding('foo')
@@ -1284,6 +1499,15 @@ class DBDataDefault(_DBTest):
             xx = x[0]
             for i in range(len(r)):
                 self.assertEqual(r[i], xx[i].value(), ('invalid value', r[i], xx[i].value()))
+        self.assertEqual(len(result), 2)
+        fetch_size = self.data._pg_fetch_size
+        self.data._pg_fetch_size = 1
+        try:
+            result = self.data.select_map(lambda row: row['stat-nazev'].value(),
+                                          columns=('castka', 'stat-nazev',))
+        finally:
+            self.data._pg_fetch_size = fetch_size
+        self.assertEqual(result, [self.ROW1[3], self.ROW2[3]])
     def test_select_fetch_direction(self):
         self.data.select()
         F, B = pytis.data.FORWARD, pytis.data.BACKWARD
@@ -1428,6 +1652,54 @@ class DBDataDefault(_DBTest):
         self.assertEqual(result, 2)
         result = d.select_aggregate((d.AGG_SUM, 'castka')).value()
         self.assertEqual(result, 3000)
+    def test_select_aggregates(self):
+        d = self.data
+        result = d.select_aggregates(((d.AGG_MIN, 'castka'), (d.AGG_MAX, 'castka'),
+                                      (d.AGG_COUNT, 'castka')))
+        self.assertEqual([v.value() for v in result], [1000, 2000, 2])
+        condition = pytis.data.GT('castka', fval(1500.0))
+        result = d.select_aggregates(((d.AGG_SUM, 'castka'), (d.AGG_AVG, 'castka')),
+                                     condition=condition)
+        self.assertEqual([v.value() for v in result], [2000, 2000])
+        self.assertEqual(d.select_aggregates(()), [])
+    def test_copy_out(self):
+        import cStringIO
+        import pytis.presentation as pp
+        d = self.dstat
+        d.insert(pytis.data.Row((('stat', sval('xx')), ('nazev', sval('a\tb\\c\nd')),)))
+        f = cStringIO.StringIO()
+        self.assertEqual(d.copy_out(f, sort=('stat',), header=True), 3)
+        self.assertEqual(f.getvalue(), ('stat,nazev\ncz,Czech Republic\nus,U.S.A.\n'
+                                        'xx,"a\tb\\c\nd"\n'))
+        f = cStringIO.StringIO()
+        self.assertEqual(d.copy_out(f, condition=pytis.data.NE('stat', sval('us')),
+                                    sort=(('stat', pytis.data.DESCENDANT),), columns=('nazev',),
+                                    format='text', null=''), 2)
+        self.assertEqual(f.getvalue(), 'a\\tb\\\\c\\nd\nCzech Republic\n')
+        # CSV export through COPY gives the same output as formatting in Python.
+        row = pp.PresentedRow((pp.Field('stat', label='Stat'), pp.Field('nazev', label='Name')),
+                              d, None)
+        exporter = pp.CSVExporter(row, d, ('stat', 'nazev'))
+        outputs = []
+        for copy_possible in (True, False):
+            exporter._copy_possible = lambda: copy_possible
+            f = cStringIO.StringIO()
+            self.assertEqual(exporter.export(f, sort=('stat',)), 3)
+            outputs.append(f.getvalue())
+        self.assertEqual(outputs[0], ('Stat\tName\t\ncz\tCzech Republic\t\nus\tU.S.A.\t\n'
+                                      'xx\ta\tb\\c;d\t\n'))
+        self.assertEqual(outputs[1], outputs[0])
+        # Without export permissions the rows must be exported by other means.
+        B = pytis.data.DBColumnBinding
+        P = pytis.data.Permission
+        key = B('stat', 'cstat', 'stat')
+        access_rights = pytis.data.AccessRights((None, (None, P.VIEW)),
+                                                ('stat', (None, P.EXPORT)))
+        d = pytis.data.DBDataDefault((key, B('nazev', 'cstat', 'nazev')), key,
+                                     self._dconnection, access_rights=access_rights)
+        f = cStringIO.StringIO()
+        self.assertEqual(d.copy_out(f, columns=('stat',)), 3)
+        self.assertRaises(pytis.data.Data.UnsupportedOperation, d.copy_out, f)
     def test_select_and_aggregate(self):
         d = self.data
         select_result, aggregate_result = d.select_and_aggregate(d.AGG_SUM)
@@ -1473,6 +1745,25 @@ class DBDataDefault(_DBTest):
         self.assertIsNone(self.data.fetchone(), 'too many lines')
         self.assertIsNone(self.data.fetchone(), 'data reincarnation')
         self.data.close()
+    def test_estimated_count(self):
+        self._sql_command("analyze denik")
+        count = self.data.select(async_count=True)
+        try:
+            self.assertIsNotNone(count.estimate())
+            number, finished = count.count()
+            self.assertTrue(finished)
+            self.assertEqual(number, 2)
+            self.assertEqual(count.count(estimated=True), (2, True))
+        finally:
+            self.data.close()
+        count = self.data.select(condition=pytis.data.GT('cislo', ival(1000)), async_count=True)
+        try:
+            # Filtered selects are not estimated (the planner estimates 1 row).
+            self.assertIsNone(count.estimate())
+            self.assertEqual(count.count(estimated=True)[0], 0)
+            self.assertEqual(count.count(), (0, True))
+        finally:
+            self.data.close()
     def test_dummy_select(self):
         UNKNOWN_ARGUMENTS = self.data.UNKNOWN_ARGUMENTS
         self.test_select_fetch(arguments=UNKNOWN_ARGUMENTS)
@@ -1573,6 +1864,62 @@ class DBDataDefault(_DBTest):
         self.assertTrue(ok, 'invalid update succeeded')
         self.assertEqual(self.data.update_many(pytis.data.EQ('cislo', row[0]), row1), 1,
                         'update failed')
+    def test_insert_many(self):
+        d = self.dcosi
+        rows = [pytis.data.Row((('id', ival(i)), ('popis', sval('popis %d' % i)))) for i in (10, 11)]
+        rows.append(pytis.data.Row((('id', ival(12)),)))
+        self.assertEqual(d.insert_many(rows), 3)
+        self.assertEqual(d.row(ival(11))['popis'].value(), 'popis 11')
+        self.assertIsNone(d.row(ival(12))['popis'].value())
+        row = pytis.data.Row((('stat', sval('cz')), ('nazev', sval('Czechia'))))
+        self.assertRaises(pytis.data.DBException, self.dstat.insert_many, [row])
+        self.assertEqual(self.dstat.row(sval('cz'))['nazev'].value(), 'Czech Republic')
+        self.assertEqual(self.data.insert_many([self.newrow]), 1)
+        self.assertEqual(self.data.row(self.newrow[0])['castka'].value(),
+                         self.newrow['castka'].value())
+    def test_update_many_rows(self):
+        row = self.newrow
+        k1 = pytis.data.Value(self.data.columns()[0].type(), self.ROW1[0])
+        self.assertEqual(self.data.update_many_rows([(k1, row)]), 1)
+        self.assertIsNotNone(self.data.row(row[0]))
+        d = self.dcosi
+        pairs = [(ival(2), pytis.data.Row((('popis', sval('first')),))),
+                 (ival(3), pytis.data.Row((('popis', sval(None)),))),
+                 (ival(5), pytis.data.Row((('id', ival(6)), ('popis', sval('moved')),))),
+                 (ival(2), pytis.data.Row((('popis', sval('second')),))),
+                 (ival(4), pytis.data.Row((('popis', sval('missing')),)))]
+        self.assertEqual(d.update_many_rows(pairs), 4)
+        self.assertEqual(d.row(ival(2))['popis'].value(), 'second')
+        self.assertIsNone(d.row(ival(3))['popis'].value())
+        self.assertIsNone(d.row(ival(5)))
+        self.assertEqual(d.row(ival(6))['popis'].value(), 'moved')
+    def test_query_result_after_put_back(self):
+        # The connection is closed when the pool is full on its return.
+        import config
+        max_pool_connections = config.max_pool_connections
+        config.max_pool_connections = 0
+        try:
+            query = pytis.data.postgresql._Query('select id from xcosi order by id')
+            result = self.dcosi._pg_query(query)
+            self.assertEqual([row[0] for row in result], [2, 3, 5, 999])
+            self.assertEqual(len(result), 4)
+            self.assertEqual(result[1][0], 3)
+        finally:
+            config.max_pool_connections = max_pool_connections
+    def test_update_many_rows_composite_key(self):
+        B = pytis.data.DBColumnBinding
+        key = (B('y', 'dist', 'y'), B('x', 'dist', 'x'))
+        if __debug__:
+            # Multicolumn keys are refused unless assertions are disabled.
+            self.assertRaises(AssertionError, pytis.data.DBDataDefault,
+                              key, key, self._dconnection)
+            return
+        d = pytis.data.DBDataDefault(key, key, self._dconnection)
+        pairs = [((ival(1), ival(2)), pytis.data.Row((('x', ival(20)),))),
+                 ((ival(2), ival(4)), pytis.data.Row((('x', ival(40)),)))]
+        self.assertEqual(d.update_many_rows(pairs), 2)
+        self.assertEqual([r[0] for r in self._sql_command('select x from dist order by x')],
+                         [1, 3, 5, 20, 40])
     def test_delete(self):
         def lines(keys, self=self):
             n = len(keys)
@@ -2283,6 +2630,132 @@ class DBDataFetchBuffer(_DBBaseTest):
         # problémů...  TODO: Co s tím??
         # self._check_skip_fetch(d2, (('s', 3), ('f', 1), ('s', -2), ('f', -1)))
         # self._check_skip_fetch(d2, (('s', 4), ('f', 1), ('s', -2), ('f', -1)))
+    def test_buffer_cache(self):
+        d = self.data
+        tsize = self._table_size
+        d.select()
+        for i in range(tsize):
+            self.assertEqual(d.fetchone()['x'].value(), i)
+        statistics = d._pg_buffer.statistics()
+        self.assertEqual(statistics['rows'], tsize)
+        misses = statistics['misses']
+        for i in range(tsize - 2, -1, -1):
+            self.assertEqual(d.fetchone(direction=pytis.data.BACKWARD)['x'].value(), i)
+        d.skip(tsize / 2)
+        self.assertEqual(d.fetchone()['x'].value(), tsize / 2 + 1)
+        statistics = d._pg_buffer.statistics()
+        self.assertEqual(statistics['misses'], misses)
+        self.assertEqual(statistics['hits'], 2 * tsize)
+        d.close()
+    def test_buffer_eviction(self):
+        import config
+        d = self.data
+        tsize = self._table_size
+        cache_size = config.cache_size
+        config.cache_size = 50
+        try:
+            d.select()
+            d._pg_buffer._PAGE_SIZE = 8
+            for i in range(tsize):
+                self.assertEqual(d.fetchone()['x'].value(), i)
+            self.assertLess(d._pg_buffer.statistics()['rows'], tsize)
+            for i in range(tsize - 2, -1, -1):
+                self.assertEqual(d.fetchone(direction=pytis.data.BACKWARD)['x'].value(), i)
+            d.close()
+        finally:
+            config.cache_size = cache_size
+    def test_table_metadata(self):
+        handler = pytis.data.postgresql.PostgreSQLStandardBindingHandler
+        column_data = dict(handler._pdbb_table_column_data)
+        loaded = set(handler._pdbb_table_metadata_loaded)
+        cache_file = config.table_metadata_cache_file
+        fd, filename = tempfile.mkstemp()
+        os.close(fd)
+        def columns(table):
+            key = self.data._pdbb_unique_table_id(table)
+            return [row[0] for row in handler._pdbb_table_column_data[key].basic()]
+        try:
+            config.table_metadata_cache_file = filename
+            for i in range(2):
+                handler._pdbb_table_column_data.clear()
+                self.data._pdbb_load_table_metadata()
+                self.assertEqual(columns('big'), ['x'])
+                self.assertEqual(columns('public.small'), ['x'])
+                self.assertTrue(os.path.getsize(filename) > 0)
+            self._sql_command("alter table big add column y text")
+            handler._pdbb_table_column_data.clear()
+            self.data._pdbb_load_table_metadata()
+            self.assertEqual(columns('big'), ['x', 'y'])
+            handler._pdbb_table_column_data.clear()
+            handler._pdbb_table_metadata_loaded.clear()
+            self.assertEqual(self.data2._pdbb_get_table_type('small', 'x'), pytis.data.Integer())
+            self.assertEqual(columns('small'), ['x'])
+        finally:
+            config.table_metadata_cache_file = cache_file
+            handler._pdbb_table_column_data.clear()
+            handler._pdbb_table_column_data.update(column_data)
+            handler._pdbb_table_metadata_loaded.clear()
+            handler._pdbb_table_metadata_loaded.update(loaded)
+            os.remove(filename)
+    def test_prepared_statements(self):
+        d = self.data2
+        query = pytis.data.postgresql._Query("select count(*) from pg_prepared_statements "
+                                             "where strpos(statement, 'small') > 0")
+        transaction = pytis.data.DBTransactionDefault(connection_data=self._dconnection)
+        try:
+            counts = []
+            for i in range(4):
+                row = d.row(ival(i), transaction=transaction)
+                self.assertEqual(row['x'].value(), i)
+                d.update(ival(i), pytis.data.Row((('x', ival(i + 10)),)), transaction=transaction)
+                counts.append(d._pg_query(query, transaction=transaction)[0][0])
+            self.assertTrue(counts[0] >= 2, counts)
+            self.assertEqual(counts, counts[:1] * 4)
+            self.assertEqual(d.delete(ival(13), transaction=transaction), 1)
+            self.assertIsNone(d.row(ival(3), transaction=transaction))
+            self.assertIsNotNone(d.row(ival(12), transaction=transaction))
+        finally:
+            transaction.rollback()
+        self.assertIsNotNone(d.row(ival(3)))
+    def test_keyset(self):
+        d = self.data
+        tsize = self._table_size
+        def values(rows):
+            return [r['x'].value() for r in rows]
+        for sort, expected in (((), range(tsize)),
+                               ((('x', pytis.data.DESCENDANT),), range(tsize - 1, -1, -1))):
+            result = []
+            row = None
+            while True:
+                rows = d.select_keyset(row, count=30, sort=sort)
+                if not rows:
+                    break
+                result.extend(values(rows))
+                row = rows[-1]
+            self.assertEqual(result, expected)
+            rows = d.select_keyset(None, count=30, sort=sort, direction=pytis.data.BACKWARD)
+            self.assertEqual(values(rows), expected[-30:])
+            rows = d.select_keyset(rows[0], count=30, sort=sort, direction=pytis.data.BACKWARD)
+            self.assertEqual(values(rows), expected[-60:-30])
+        condition = pytis.data.GT('x', ival(tsize - 5))
+        rows = d.select_keyset(None, condition=condition, columns=('x',))
+        self.assertEqual(values(rows), range(tsize - 4, tsize))
+    def test_select_page(self):
+        d = self.data
+        tsize = self._table_size
+        def values(rows):
+            return [r['x'].value() for r in rows]
+        rows, count = d.select_page(offset=20, limit=10)
+        self.assertEqual((values(rows), count), (range(20, 30), tsize))
+        self.assertFalse(d.select_active())
+        rows, count = d.select_page(sort=(('x', pytis.data.DESCENDANT),), offset=tsize - 3,
+                                    limit=10, columns=('x',))
+        self.assertEqual((values(rows), count), ([2, 1, 0], tsize))
+        rows, count = d.select_page(offset=tsize + 5, limit=10)
+        self.assertEqual((rows, count), ([], tsize))
+        rows, count = d.select_page(condition=pytis.data.LT('x', ival(5)), limit=10,
+                                    with_count=False)
+        self.assertEqual((values(rows), count), (range(5), None))
 tests.add(DBDataFetchBuffer)
 
 
@@ -2546,6 +3019,127 @@ class DBDataNotification(DBDataDefault):
         self.assertEqual(d.change_number(), cnumber_1 + 1, (cnumber_1, d.change_number(),))
         self.assertEqual(self.data.change_number(), cnumber_2 + 1,
                         (cnumber_2, self.data.change_number(),))
+    def test_coalesced_notification(self):
+        d = self.dstat
+        time.sleep(1)
+        cnumber = d.change_number()
+        for i in range(10):
+            d.insert(pytis.data.Row((('stat', sval('x%d' % i)),
+                                     ('nazev', sval('Country %d' % i)))))
+        self._ddn_check_result()
+        time.sleep(1)
+        # The first change may be delivered immediately, all the following
+        # ones at most once per config.dbnotification_delay.
+        self.assertIn(d.change_number() - cnumber, (1, 2))
+    def test_row_notification(self):
+        changes = []
+        self.dstat.add_callback_on_row_change(changes.append)
+        time.sleep(1)
+        key = sval('cz')
+        self.dstat1.update(key, pytis.data.Row((('nazev', sval('Czechia')),)))
+        self._ddn_check_result()
+        self.assertIn([('UPDATE', 'cz')], [[(op, k.value()) for op, k in c] for c in changes
+                                           if c is not None])
+        self.dstat1.insert(pytis.data.Row((('stat', sval('at')), ('nazev', sval('Austria')))))
+        self.dstat1.delete(sval('at'))
+        time.sleep(1)
+        self.assertIn(('DELETE', 'at'), [(op, k.value()) for op, k in changes[-1]])
+    def test_reload_buffered_rows(self):
+        d = self.dstat
+        d.select(sort=('stat',))
+        try:
+            self.assertEqual(d.fetchone()['nazev'].value(), 'Czech Republic')
+            d.fetchone()
+            self.dstat1.update(sval('cz'), pytis.data.Row((('nazev', sval('Czechia')),)))
+            self.assertEqual(d.reload_buffered_rows([sval('cz'), sval('xx')]), [0])
+            d.rewind()
+            self.assertEqual(d.fetchone()['nazev'].value(), 'Czechia')
+            self.assertEqual(d.fetchone()['stat'].value(), 'us')
+        finally:
+            d.close()
+        # Rows no longer matching the select condition or sorting can't be patched.
+        d.select(condition=pytis.data.NE('nazev', sval('Czech Republic')), sort=('nazev',))
+        try:
+            d.fetchone()
+            self.dstat1.update(sval('us'), pytis.data.Row((('nazev', sval('USA')),)))
+            self.assertIsNone(d.reload_buffered_rows([sval('us')]))
+        finally:
+            d.close()
+        d.select(condition=pytis.data.NE('nazev', sval('Czech Republic')))
+        try:
+            d.fetchone()
+            self.dstat1.update(sval('us'), pytis.data.Row((('nazev', sval('Czech Republic')),)))
+            self.assertIsNone(d.reload_buffered_rows([sval('us')]))
+        finally:
+            d.close()
+    def test_snapshot(self):
+        B = pytis.data.DBColumnBinding
+        key = B('stat', 'cstat', 'stat')
+        d = pytis.data.DBDataDefault((key, B('nazev', 'cstat', 'nazev')), key,
+                                     self._dconnection, snapshot=True)
+        self.assertEqual(d.select(sort=(('stat', pytis.data.DESCENDANT),)), 2)
+        self.assertEqual(d.fetchone()['stat'].value(), 'us')
+        self.assertEqual(d.search(pytis.data.EQ('stat', sval('cz'))), 1)
+        self.assertEqual(d.fetchone()['nazev'].value(), 'Czech Republic')
+        self.assertIsNone(d.fetchone())
+        d.close()
+        # Changes not announced by a notification are not visible.
+        self._sql_command("update cstat set nazev='Czechia' where stat='cz'")
+        self.assertEqual(d.row(sval('cz'))['nazev'].value(), 'Czech Republic')
+        self.assertEqual(d.select(condition=pytis.data.WM('nazev', sval('U*'))), 1)
+        self.assertEqual(d.fetchone()['stat'].value(), 'us')
+        d.close()
+        self.assertEqual([v.value() for v in d.distinct('stat')], ['cz', 'us'])
+        self.assertEqual(d.select_aggregate((d.AGG_COUNT, 'stat')).value(), 2)
+        # Own modifications reload the snapshot immediately.
+        d.update(sval('us'), pytis.data.Row((('nazev', sval('USA')),)))
+        self.assertEqual(d.row(sval('cz'))['nazev'].value(), 'Czechia')
+        self.assertEqual(d.row(sval('us'))['nazev'].value(), 'USA')
+        # Other data objects' modifications after their notification arrives.
+        self.dstat1.update(sval('cz'), pytis.data.Row((('nazev', sval('Czech Republic')),)))
+        time.sleep(1)
+        self.assertEqual(d.select_map(lambda row: row['nazev'].value(), sort=('stat',)),
+                         ['Czech Republic', 'USA'])
+        # Operations within transactions don't use the snapshot.
+        transaction = pytis.data.DBTransactionDefault(self._dconnection)
+        try:
+            d.update(sval('us'), pytis.data.Row((('nazev', sval('U.S.A.')),)),
+                     transaction=transaction)
+            self.assertEqual(d.row(sval('us'), transaction=transaction)['nazev'].value(),
+                             'U.S.A.')
+            self.assertEqual(d.row(sval('us'))['nazev'].value(), 'USA')
+        finally:
+            transaction.commit()
+        self.assertEqual(d.row(sval('us'))['nazev'].value(), 'U.S.A.')
+    def test_row_count_cache(self):
+        import config
+        d = self.dstat
+        cache_size = config.row_count_cache_size
+        config.row_count_cache_size = 10
+        try:
+            self.assertEqual(d.select(), 2)
+            d.close()
+            # Changes not announced by a notification are not visible.
+            self._sql_command("insert into cstat values ('sk', 'Slovakia')")
+            self.assertEqual(d.select(sort=('nazev',)), 2)
+            d.close()
+            self.assertEqual(d.select_page(offset=0, limit=1)[1], 2)
+            self.assertEqual(d.select(condition=pytis.data.EQ('stat', sval('sk'))), 1)
+            d.close()
+            # Own modifications invalidate the counts immediately.
+            d.insert(pytis.data.Row((('stat', sval('at')), ('nazev', sval('Austria')),)))
+            self.assertEqual(d.select(), 4)
+            d.close()
+            # Other modifications after their notification arrives.
+            self._sql_command("delete from cstat where stat = 'at'")
+            self._sql_command('notify "__modif_cstat"')
+            time.sleep(1)
+            self.assertEqual(d.select_page(offset=0, limit=1)[1], 3)
+            self.assertEqual(d.select(), 3)
+            d.close()
+        finally:
+            config.row_count_cache_size = cache_size
+            d._pg_row_count_cache.reset()
 tests.add(DBDataNotification)
 
 
@@ -365,6 +365,24 @@ class RestrictedData(Data):
         return super(RestrictedData, self).select(condition=condition,
                                                   sort=sort, **kwargs)
     
+    def select_page(self, condition=None, sort=(), **kwargs):
+        self._check_access_condition(condition)
+        self._check_access_sorting(sort)
+        rows, count = super(RestrictedData, self).select_page(condition=condition, sort=sort,
+                                                              **kwargs)
+        return [self._access_filter_row(row) for row in rows], count
+
+    def copy_out(self, stream, condition=None, sort=(), columns=None, **kwargs):
+        self._check_access_condition(condition)
+        self._check_access_sorting(sort)
+        groups = self.access_groups()
+        for c in columns or [c.id() for c in self.columns()]:
+            if not self._access_rights.permitted(Permission.EXPORT, groups, column=c):
+                # Let the caller export the permitted data by other means.
+                raise self.UnsupportedOperation()
+        return super(RestrictedData, self).copy_out(stream, condition=condition, sort=sort,
+                                                    columns=columns, **kwargs)
+
     def fetchone(self, **kwargs):
         row = super(RestrictedData, self).fetchone(**kwargs)
         return self._access_filter_row(row)
@@ -389,6 +407,15 @@ class RestrictedData(Data):
         row = self._access_filter_row(row, Permission.UPDATE)
         return super(RestrictedData, self).update_many(condition, row, **kwargs)
 
+    def insert_many(self, rows, **kwargs):
+        rows = [self._access_filter_row(row, Permission.INSERT) for row in rows]
+        return super(RestrictedData, self).insert_many(rows, **kwargs)
+
+    def update_many_rows(self, pairs, **kwargs):
+        self._check_access_key()
+        pairs = [(key, self._access_filter_row(row, Permission.UPDATE)) for key, row in pairs]
+        return super(RestrictedData, self).update_many_rows(pairs, **kwargs)
+
     def delete(self, key, **kwargs):
         self._check_access_key()
         self._check_access_delete()
@@ -38,14 +38,14 @@ implementaci.
 
 import copy
 import datetime
-import functools
 import operator
+import re
 
 import pytis.util
 from pytis.util import EVENT, \
     InvalidAccessError, LimitedCache, NotImplementedException, ProgramError, \
     compare_objects, find, less, log, object_2_5, sameclass, some, translations, xtuple
-from types_ import DateTime, Number, Type, Value, WMValue
+from types_ import DateTime, Float, Integer, Number, String, Type, Value, WMValue
 
 _ = translations('pytis-data')
 
@@ -293,6 +293,7 @@ class Data(object_2_5):
         self._condition = condition
         self._change_number = pytis.util.Counter()
         self._on_change_callbacks = []
+        self._on_row_change_callbacks = []
         self._select_last_row_number = None
         if full_init:
             self.after_init()
@@ -436,6 +437,85 @@ class Data(object_2_5):
                 pass
         return result
 
+    def select_page(self, condition=None, sort=(), offset=0, limit=None, columns=None,
+                    transaction=None, arguments={}, with_count=True):
+        """Return a single page of select rows and the total number of rows.
+
+        Arguments:
+
+          condition, sort, columns, transaction, arguments -- the same as in
+            'select()'
+          offset -- number of initial select rows to skip, non-negative integer
+          limit -- maximum number of rows to return or 'None' to return all
+            the rows following 'offset'
+          with_count -- iff true, count all the rows matching 'condition'
+
+        Returns: pair (ROWS, COUNT), where ROWS is the list of 'Row' instances
+        of the page and COUNT is the number of all rows of the select or
+        'None' when 'with_count' is false.
+
+        No select remains open after the call, so the method may be used for
+        stateless paging, e.g. in web forms.  In this class the page is read
+        through 'select()', 'skip()' and 'fetchone()'.  Subclasses may
+        retrieve the page more efficiently.
+
+        """
+        assert isinstance(offset, int) and offset >= 0, offset
+        assert limit is None or isinstance(limit, int) and limit >= 0, limit
+        rows = []
+        try:
+            count = self.select(condition=condition, sort=sort, columns=columns,
+                                transaction=transaction, arguments=arguments)
+            if offset:
+                self.skip(offset)
+            while limit is None or len(rows) < limit:
+                row = self.fetchone(transaction=transaction)
+                if row is None:
+                    break
+                rows.append(row)
+        finally:
+            try:
+                self.close()
+            except:
+                pass
+        if not with_count:
+            count = None
+        return rows, count
+
+    def copy_out(self, stream, condition=None, sort=(), columns=None, format='csv',
+                 header=False, delimiter=None, null=None, transaction=None, arguments={}):
+        """Write the selected rows to 'stream' in the native format of the data source.
+
+        Arguments:
+
+          stream -- file like object with the 'write()' method
+          condition, sort, columns, transaction, arguments -- the same as in
+            'select()'
+          format -- output format, one of the strings 'csv' (comma separated
+            values with quoting) or 'text' (tab separated values with special
+            characters escaped by backslashes)
+          header -- iff true, the first line contains column names
+          delimiter -- column delimiter string or 'None' for the default
+            delimiter of 'format'
+          null -- string representing null values or 'None' for the default
+            representation of 'format'
+
+        Returns the number of written rows.
+
+        The values are written in the textual representation of the data
+        source, not by 'Type.export()', so the method is useful for fast bulk
+        exports of plain column values.
+
+        'UnsupportedOperation' is raised when the rows can't be copied this
+        way (e.g. due to missing export permissions), the caller should export
+        them by other means then.
+
+        Podtřídy nejsou povinny tuto metodu implementovat.  V této třídě metoda
+        vždy vyvolává výjimku 'UnsupportedOperation'.
+
+        """
+        raise self.UnsupportedOperation()
+
     def select_aggregate(self, operation, condition=None, transaction=None):
         """Vrať výslednou hodnotu agregační funkce.
 
@@ -466,6 +546,29 @@ class Data(object_2_5):
 
         """
         raise self.UnsupportedOperation()
+
+    def select_aggregates(self, operations, condition=None, transaction=None, arguments={}):
+        """Return the results of several aggregation functions at once.
+
+        Arguments:
+
+          operations -- sequence of pairs (OPERATION, COLUMN), the same as the
+            'operation' argument of 'select_aggregate()'
+          condition, transaction -- the same as in 'select_aggregate()'
+          arguments -- dictionary of table function call arguments
+
+        Returns: list of 'Value' instances, the results of 'operations' in the
+        same order.
+
+        In this class the method calls 'select_aggregate()' for each of the
+        'operations'.  Subclasses may compute all the results together, e.g.
+        by a single database query.
+
+        """
+        kwargs = dict(arguments=arguments) if arguments else {}
+        return [self.select_aggregate(operation, condition=condition, transaction=transaction,
+                                      **kwargs)
+                for operation in operations]
     
     def select_and_aggregate(self, operation, condition=None, reuse=False, sort=(),
                              columns=None, transaction=None):
@@ -788,6 +891,58 @@ class Data(object_2_5):
         
         """
         return 0
+
+    def insert_many(self, rows, transaction=None):
+        """Insert all 'rows' into the table.
+
+        Arguments:
+
+          rows -- sequence of 'Row' instances
+          transaction -- transaction object encapsulating the database
+            operation environment or 'None' (meaning default environment)
+
+        The rows are handled as in 'insert()', except that the implementation
+        need not check for existing rows with the same key in advance and
+        such an insertion may raise an exception.  Change notifications are
+        sent only once, after all the rows are inserted.
+
+        Vrací: Počet vložených řádků.
+
+        V této třídě metoda volá 'insert()' pro každý řádek.
+
+        """
+        result = 0
+        for row in rows:
+            if self.insert(row, transaction=transaction)[1]:
+                result += 1
+        return result
+
+    def update_many_rows(self, pairs, transaction=None):
+        """Update rows given by 'pairs'.
+
+        Arguments:
+
+          pairs -- sequence of pairs (KEY, ROW), where KEY identifies the row
+            to be updated the same way as in 'update()' and ROW is a 'Row'
+            instance containing the new values
+          transaction -- transaction object encapsulating the database
+            operation environment or 'None' (meaning default environment)
+
+        The rows are handled as in 'update()', except that the implementation
+        need not check for existence of the updated rows and new keys.
+        Change notifications are sent only once, after all the rows are
+        updated.
+
+        Vrací: Počet updatovaných řádků.
+
+        V této třídě metoda volá 'update()' pro každou dvojici.
+
+        """
+        result = 0
+        for key, row in pairs:
+            if self.update(key, row, transaction=transaction)[1]:
+                result += 1
+        return result
     
     def delete(self, key, transaction=None):
         """Smaž řádek identifikovaný 'key'.
@@ -870,10 +1025,67 @@ class Data(object_2_5):
         except ValueError:
             pass
 
-    def _call_on_change_callbacks(self):
+    def add_callback_on_row_change(self, function):
+        """Register 'function' to be called with details about changed rows.
+
+        The same as 'add_callback_on_change()', but 'function' is called with
+        one argument describing the changes.  It is a list of pairs
+        (OPERATION, KEY), where OPERATION is one of the strings 'INSERT',
+        'UPDATE' and 'DELETE' and KEY is the key 'Value' of the changed row, or
+        'None' when the changed rows are not known (in which case any data may
+        have changed).
+
+        """
+        self._on_row_change_callbacks.append(function)
+
+    def remove_callback_on_row_change(self, function):
+        """Remove 'function' registered by 'add_callback_on_row_change()'.
+
+        Nothing happens if 'function' is not registered.
+
+        """
+        try:
+            self._on_row_change_callbacks.remove(function)
+        except ValueError:
+            pass
+
+    def changes_notified(self):
+        """Return true iff change callbacks are called on all data changes.
+
+        If true, the callbacks registered by 'add_callback_on_change()' are
+        called after any change of the data, including changes made by other
+        processes, so values derived from the data may be kept until the next
+        callback.  In this class false is always returned.
+
+        """
+        return False
+
+    def _call_on_change_callbacks(self, changes=None):
         self._change_number.next()
         for c in self._on_change_callbacks:
             c()
+        for c in self._on_row_change_callbacks:
+            c(changes)
+
+    def reload_buffered_rows(self, keys):
+        """Replace rows of given keys in the current select by their current data.
+
+        Arguments:
+
+          keys -- sequence of key 'Value' instances of the rows to reload
+
+        The rows are replaced only if they have already been fetched within the
+        current select and are kept by the data object for further fetches.
+        Their position within the select is not changed.
+
+        Returns the list of positions (row numbers starting from 0) of the
+        replaced rows within the select or 'None' if the operation is not
+        supported or a changed row no longer matches the select condition or
+        its sorting (the select must be repeated then).  In this class 'None'
+        is always returned.
+
+        """
+        return None
 
     @classmethod
     def cacheable(class_):
@@ -927,7 +1139,15 @@ class MemData(Data):
     """Data držená v paměti.
 
     Třída slouží jako jednoduchý datový objekt, který řádky svých dat drží
-    v paměti.  Je určena především pro ladění a testování.
+    v paměti.  Je určena především pro ladění a testování, ale díky uložení
+    dat po sloupcích a indexům je použitelná i pro virtuální formuláře
+    s desítkami tisíc řádků.
+
+    Hodnoty jsou uloženy v polích jednotlivých sloupců.  Klíčový sloupec
+    a sloupce zadané v argumentu konstruktoru 'indexes' jsou indexovány pro
+    rychlé vyhledávání podle rovnosti.  Podmínky jsou překládány na filtry
+    zpracovávající najednou celé sloupce; podporovány jsou operátory 'EQ',
+    'LT', 'WM', 'IN', 'AND', 'OR', 'NOT' a operátory na ně převoditelné.
 
     Třída není thread-safe.
 
@@ -937,7 +1157,7 @@ class MemData(Data):
 
     _CACHEABLE = False
 
-    def __init__(self, columns, data=(), **kwargs):
+    def __init__(self, columns, data=(), indexes=(), **kwargs):
         """Inicializuj datový zdroj dle specifikace 'columns'.
 
         'columns' jsou stejné jako v předkovi.  Klíčem je vždy první sloupec
@@ -945,23 +1165,104 @@ class MemData(Data):
 
         Argument 'data' může obsahovat sekvenci instancí 'Row', kterými má být
         inicializován datový objekt.
+
+        Argument 'indexes' je sekvence identifikátorů sloupců, nad kterými mají
+        být kromě klíčového sloupce udržovány indexy.
         
         """
         super(MemData, self).__init__(columns, columns[0], **kwargs)
-        self._mem_data = []
+        self._mem_column_ids = [c.id() for c in self.columns()]
+        key_id = self.key()[0].id()
+        self._mem_index_columns = [key_id] + [cid for cid in indexes if cid != key_id]
+        self._mem_condition_filter = None
+        self._mem_select = []
+        self._mem_select_columns = None
         self._mem_cursor = -1
+        self._mem_clear()
         for row in data:
             self.insert(row)
 
+    def _mem_clear(self):
+        # Remove all rows.
+        self._mem_columns = dict([(cid, []) for cid in self._mem_column_ids])
+        # Deleted rows are only marked as dead until the next compaction to
+        # keep the positions of the current select valid.
+        self._mem_alive = []
+        self._mem_dead = 0
+        self._mem_indexes = dict([(cid, {}) for cid in self._mem_index_columns])
+
+    def _mem_compact(self):
+        alive = self._mem_alive
+        positions = [p for p in xrange(len(alive)) if alive[p]]
+        for cid, values in self._mem_columns.items():
+            self._mem_columns[cid] = [values[p] for p in positions]
+        self._mem_alive = [True] * len(positions)
+        self._mem_dead = 0
+        self._mem_indexes = dict([(cid, {}) for cid in self._mem_index_columns])
+        for p in xrange(len(positions)):
+            self._mem_index_add(p)
+
+    def _mem_index_add(self, position):
+        for cid, index in self._mem_indexes.items():
+            try:
+                index.setdefault(self._mem_columns[cid][position].value(), set()).add(position)
+            except TypeError:
+                # Unhashable values, the column can't be indexed.
+                del self._mem_indexes[cid]
+
+    def _mem_index_remove(self, position):
+        for cid, index in self._mem_indexes.items():
+            value = self._mem_columns[cid][position].value()
+            positions = index[value]
+            positions.discard(position)
+            if not positions:
+                del index[value]
+
+    def _mem_positions(self, positions=None):
+        # Return 'positions' or positions of all living rows if 'positions' is None.
+        if positions is None:
+            alive = self._mem_alive
+            if self._mem_dead:
+                positions = [p for p in xrange(len(alive)) if alive[p]]
+            else:
+                positions = range(len(alive))
+        return positions
+
+    def _mem_lookup(self, column_id, value, positions=None):
+        # Return positions of rows with 'value' in given column.
+        index = self._mem_indexes.get(column_id)
+        if index is not None:
+            try:
+                matching = index.get(value, ())
+            except TypeError:
+                pass
+            else:
+                if positions is None:
+                    return sorted(matching)
+                else:
+                    return [p for p in positions if p in matching]
+        values = self._mem_columns[column_id]
+        return [p for p in self._mem_positions(positions) if values[p].value() == value]
+
+    def _mem_data_filter(self):
+        if self._mem_condition_filter is None:
+            self._mem_condition_filter = self._mem_compile(self._condition)
+        return self._mem_condition_filter
+
+    def _mem_filter(self, condition, positions=None):
+        # Return positions of rows matching both 'condition' and the data object condition.
+        if condition is not None:
+            positions = self._mem_compile(condition)(positions)
+        return self._mem_data_filter()(positions)
+
     def _mem_find_index(self, key):
         if isinstance(key, (tuple, list,)):
             key = key[0]
-        data = self._mem_data
-        k = self.key()[0].id()
-        condition = self._condition2pyfunc(self._condition)
-        for i in range(len(data)):
-            if data[i][k] == key and condition(data[i]):
-                return i
+        positions = self._mem_lookup(self.key()[0].id(), key.value())
+        if positions:
+            positions = self._mem_data_filter()(positions)
+        if positions:
+            return positions[0]
         else:
             return None
 
@@ -973,89 +1274,294 @@ class MemData(Data):
         i = self._mem_find_index(key)
         if index is not None and i is not None and i != index:
             return None
-        pairs = []
+        values = []
         for c in self.columns():
-            id = c.id()
             try:
-                val = row[id]
+                val = row[c.id()]
             except:
-                val = None
-            pairs.append((id, val))
-        return Row(pairs)
+                val = Value(c.type(), None)
+            values.append(val)
+        return values
 
-    def _restrict_row_columns(self, row, columns):
+    def _mem_row(self, position, columns=None):
         if columns is None:
-            return row
-        else:
-            return Row([(cid, row[cid]) for cid in columns])
+            columns = self._mem_column_ids
+        return Row([(cid, self._mem_columns[cid][position]) for cid in columns])
 
-    def row(self, key, columns=None):
-        index = self._mem_find_index(key)
-        if index is None:
-            return None
-        return self._restrict_row_columns(self._mem_data[index], columns)
-
-    def rewind(self):
-        self._mem_cursor = -1
-
-    def _condition2pyfunc(self, condition):
+    def _mem_compile(self, condition):
+        # Return a function of one argument, a list of row positions (or None
+        # for all rows), returning the list of positions of the rows matching
+        # 'condition' in the same order.
         if condition is None:
-            return lambda row: True
+            return self._mem_positions
         op_name = condition.name()
-        relational_operators = {'EQ': operator.eq,
-                                'LT': operator.lt}
-        if op_name in relational_operators.keys():
-            def relop(row, op, args, kwargs):
-                def arg(a, ignore_case=False):
-                    if isinstance(a, basestring):
-                        v = row[a].value()
-                    else:
-                        v = a.value()
-                    if ignore_case and isinstance(v, basestring):
-                        v = v.lower()
-                    return v
-                return op(*[arg(a, **kwargs) for a in args])
-            return lambda row: relop(row, relational_operators[op_name],
-                                     condition.args(), condition.kwargs())
+        op_args = condition.args()
+        op_kwargs = condition.kwargs()
+        if op_name in ('EQ', 'LT'):
+            return self._mem_compile_relation(op_name, op_args, op_kwargs.get('ignore_case'))
+        elif op_name == 'WM':
+            column_id, pattern = op_args
+            if not isinstance(column_id, basestring):
+                raise self.UnsupportedOperation(op_name)
+            regexp = self._mem_wm_regexp(pattern.value(), op_kwargs.get('ignore_case'))
+            def wm_filter(positions):
+                values = self._mem_columns[column_id]
+                return [p for p in self._mem_positions(positions)
+                        if isinstance(values[p].value(), basestring) and
+                        regexp.match(values[p].value())]
+            return wm_filter
+        elif op_name == 'IN':
+            column_id, data, table_column_id, table_condition, table_arguments = op_args
+            def in_filter(positions):
+                kwargs = table_arguments is not None and dict(arguments=table_arguments) or {}
+                matching = set(data.select_map(lambda row: row[table_column_id].value(),
+                                               condition=table_condition, **kwargs))
+                values = self._mem_columns[column_id]
+                return [p for p in self._mem_positions(positions)
+                        if values[p].value() in matching]
+            return in_filter
         elif op_name == 'NOT':
-            func = self._condition2pyfunc(condition.args()[0])
-            return lambda row: not func(row)
+            function = self._mem_compile(op_args[0])
+            def not_filter(positions):
+                positions = self._mem_positions(positions)
+                excluded = set(function(positions))
+                return [p for p in positions if p not in excluded]
+            return not_filter
         elif op_name == 'AND':
-            fctns = [self._condition2pyfunc(c) for c in condition.args()]
-            return lambda row: functools.reduce(lambda r, f: r and f(row), fctns, True)
+            functions = [self._mem_compile(c) for c in op_args]
+            def and_filter(positions):
+                for function in functions:
+                    positions = function(positions)
+                return self._mem_positions(positions)
+            return and_filter
+        elif op_name == 'OR':
+            column_id, values = self._mem_values_condition(op_args)
+            if column_id is not None:
+                # ANY_OF
+                def any_of_filter(positions):
+                    if column_id in self._mem_indexes:
+                        matching = set()
+                        for v in values:
+                            matching.update(self._mem_lookup(column_id, v, positions))
+                        if positions is None:
+                            return sorted(matching)
+                        return [p for p in positions if p in matching]
+                    column = self._mem_columns[column_id]
+                    return [p for p in self._mem_positions(positions)
+                            if column[p].value() in values]
+                return any_of_filter
+            functions = [self._mem_compile(c) for c in op_args]
+            def or_filter(positions):
+                matching = set()
+                for function in functions:
+                    matching.update(function(positions))
+                if positions is None:
+                    return sorted(matching)
+                return [p for p in positions if p in matching]
+            return or_filter
         else:
             t = condition.translation()
             if t is not None:
-                return self._condition2pyfunc(t)
+                return self._mem_compile(t)
             else:
                 raise self.UnsupportedOperation(op_name)
 
+    def _mem_compile_relation(self, op_name, args, ignore_case):
+        for a in args:
+            if not isinstance(a, (basestring, Value)):
+                raise self.UnsupportedOperation(op_name)
+        function = {'EQ': operator.eq, 'LT': operator.lt}[op_name]
+        def value(v):
+            v = v.value()
+            if ignore_case and isinstance(v, basestring):
+                v = v.lower()
+            return v
+        x, y = args
+        if isinstance(x, basestring) and not isinstance(y, basestring) and not ignore_case:
+            # The most common case: column compared with a constant.
+            v = y.value()
+            if op_name == 'EQ':
+                def eq_filter(positions):
+                    return self._mem_lookup(x, v, positions)
+                return eq_filter
+            def relation_filter(positions):
+                column = self._mem_columns[x]
+                return [p for p in self._mem_positions(positions) if function(column[p].value(), v)]
+            return relation_filter
+        def operand(a):
+            if isinstance(a, basestring):
+                column = self._mem_columns[a]
+                return lambda p: value(column[p])
+            else:
+                v = value(a)
+                return lambda p: v
+        def generic_filter(positions):
+            x_value, y_value = operand(x), operand(y)
+            return [p for p in self._mem_positions(positions) if function(x_value(p), y_value(p))]
+        return generic_filter
+
+    def _mem_values_condition(self, args):
+        # Return (COLUMN_ID, VALUES) if 'args' are simple EQ operators on one column.
+        column_id = None
+        values = set()
+        for a in args:
+            if a.name() != 'EQ' or a.kwargs().get('ignore_case'):
+                return None, None
+            cid, v = a.args()
+            if not isinstance(cid, basestring) or not isinstance(v, Value) or \
+                    column_id not in (None, cid):
+                return None, None
+            column_id = cid
+            try:
+                values.add(v.value())
+            except TypeError:
+                return None, None
+        return column_id, values
+
+    def _mem_wm_regexp(self, pattern, ignore_case):
+        regexp = ''
+        escaped = False
+        for char in pattern:
+            if escaped:
+                regexp += re.escape(char)
+                escaped = False
+            elif char == '\\':
+                escaped = True
+            elif char == '*':
+                regexp += '.*'
+            elif char == '?':
+                regexp += '.'
+            else:
+                regexp += re.escape(char)
+        flags = re.UNICODE | re.DOTALL
+        if ignore_case:
+            flags |= re.IGNORECASE
+        return re.compile(regexp + '$', flags)
+
+    def _mem_sort(self, positions, sort):
+        positions = list(positions)
+        for spec in reversed(sort):
+            if isinstance(spec, (tuple, list)):
+                column_id, direction = spec[:2]
+            else:
+                column_id, direction = spec, ASCENDENT
+            column = self._mem_columns[column_id]
+            positions.sort(key=lambda p: self._mem_sort_key(column[p].value()),
+                           reverse=(direction == DESCENDANT))
+        return positions
+
+    def _mem_sort_key(self, value):
+        # Strings are ordered according to the current locale, to match the
+        # database collation as far as possible (plain Python ordering puts
+        # e.g. all accented Czech letters after 'z').
+        if isinstance(value, basestring):
+            import locale
+            if isinstance(value, unicode):
+                encoding = locale.getpreferredencoding() or 'UTF-8'
+                value = value.encode(encoding, 'replace')
+            value = locale.strxfrm(value)
+        return value
+
+    def row(self, key, columns=None):
+        index = self._mem_find_index(key)
+        if index is None:
+            return None
+        return self._mem_row(index, columns)
+
+    def rewind(self):
+        self._mem_cursor = -1
+
     def select(self, condition=None, reuse=False, sort=None, columns=None, transaction=None,
                arguments={}, async_count=False, stop_check=None, timeout_callback=None, limit=None):
         """Inicializace vytahování záznamů.
 
-        Bližší popis viz nadtřída.  Argumenty 'condition', 'sort',
-        'transaction', 'arguments', 'async_count', 'stop_check' a 'timeout_callback'
-        jsou ignorovány.
+        Bližší popis viz nadtřída.  Argumenty 'reuse', 'transaction',
+        'arguments', 'async_count', 'stop_check' a 'timeout_callback' jsou
+        ignorovány.
         
         """
-        if self._condition is not None:
-            if condition is not None:
-                condition = AND(condition, self._condition)
-            else:
-                condition = self._condition
-        cond = self._condition2pyfunc(condition)
+        if self._mem_dead > len(self._mem_alive) / 2:
+            self._mem_compact()
+        positions = self._mem_filter(condition)
+        if sort:
+            positions = self._mem_sort(positions, sort)
+        if limit is not None:
+            positions = positions[:max(limit, 0)]
+        self._mem_select = positions
+        self._mem_select_columns = columns
         self._mem_cursor = -1
-        result = []
-        for row in self._mem_data:
-            if cond(row):
-                if limit is not None:
-                    if limit <= 0:
-                        break
-                    limit -= 1
-                result.append(self._restrict_row_columns(row, columns))
-        self._mem_select = result
-        return len(self._mem_select)
+        return len(positions)
+
+    def select_aggregate(self, operation, condition=None, transaction=None, arguments={}):
+        """Vrať výslednou hodnotu agregační funkce.
+
+        Bližší popis viz nadtřída.  Argumenty 'transaction' a 'arguments' jsou
+        ignorovány.
+
+        """
+        op, column_id = operation
+        column = self._mem_columns[column_id]
+        values = [column[p].value() for p in self._mem_filter(condition)]
+        values = [v for v in values if v is not None]
+        if op == self.AGG_COUNT:
+            return Value(Integer(), len(values))
+        elif op == self.AGG_AVG:
+            type_, function = Float(), lambda values: float(sum(values)) / len(values)
+        else:
+            type_ = self.find_column(column_id).type()
+            try:
+                function = {self.AGG_MIN: min, self.AGG_MAX: max, self.AGG_SUM: sum}[op]
+            except KeyError:
+                raise ProgramError('Invalid aggregate function identifier', op)
+        if values:
+            result = function(values)
+        else:
+            result = None
+        return Value(type_, result)
+
+    def distinct(self, column, prefix=None, condition=None, sort=ASCENDENT, transaction=None,
+                 arguments={}):
+        """Vrať sekvenci všech nestejných hodnot daného sloupce.
+
+        Argumenty jsou stejné jako v 'pytis.data.DBDataDefault.distinct()',
+        argumenty 'transaction' a 'arguments' jsou ignorovány.
+
+        """
+        type_ = self.find_column(column).type()
+        if prefix and not isinstance(type_, String):
+            raise ProgramError("Invalid column type for prefix selection")
+        values = self._mem_columns[column]
+        result = set()
+        for p in self._mem_filter(condition):
+            v = values[p].value()
+            if prefix and v is not None:
+                v = v[:prefix]
+            result.add(v)
+        result = list(result)
+        if sort is not None:
+            result.sort(key=self._mem_sort_key, reverse=(sort == DESCENDANT))
+        return [Value(type_, v) for v in result]
+
+    def search(self, condition, direction=FORWARD, transaction=None, arguments={}):
+        """Vyhledej nejbližší výskyt řádku splňujícího 'condition'.
+
+        Bližší popis viz nadtřída.  Argumenty 'transaction' a 'arguments' jsou
+        ignorovány.
+
+        """
+        cursor = self._mem_cursor
+        data = self._mem_select
+        if direction == FORWARD:
+            start = max(cursor + 1, 0)
+            matching = self._mem_compile(condition)(data[start:])
+            if matching:
+                return data.index(matching[0], start) - cursor
+        else:
+            end = min(cursor, len(data))
+            matching = self._mem_compile(condition)(data[:end])
+            if matching:
+                return cursor - data.index(matching[-1], 0, end)
+        return 0
 
     def close(self):
         self._mem_select = []
@@ -1071,7 +1577,6 @@ class MemData(Data):
                 return None
             else:
                 self._mem_cursor = cursor = cursor + 1
-                return data[cursor]
         else:
             if cursor < 0:
                 return None
@@ -1080,7 +1585,7 @@ class MemData(Data):
                 return None
             else:
                 self._mem_cursor = cursor = cursor - 1
-                return data[cursor]
+        return self._mem_row(data[cursor], self._mem_select_columns)
             
     def last_row_number(self):
         return self._mem_cursor
@@ -1097,11 +1602,15 @@ class MemData(Data):
         
         """
         assert isinstance(row, Row)
-        new_row = self._mem_create_row(row)
-        if new_row is None:
+        values = self._mem_create_row(row)
+        if values is None:
             return None, False
-        self._mem_data.append(new_row)
-        return new_row, True
+        position = len(self._mem_alive)
+        for cid, value in zip(self._mem_column_ids, values):
+            self._mem_columns[cid].append(value)
+        self._mem_alive.append(True)
+        self._mem_index_add(position)
+        return self._mem_row(position), True
 
     def update(self, key, row, transaction=None):
         """Updatuj 'row' v tabulce.
@@ -1117,11 +1626,14 @@ class MemData(Data):
         index = self._mem_find_index(key)
         if index is None:
             return None, False
-        new_row = self._mem_create_row(row, index)
-        if new_row is None:
+        values = self._mem_create_row(row, index)
+        if values is None:
             return None, False
-        self._mem_data[index] = new_row
-        return new_row, True
+        self._mem_index_remove(index)
+        for cid, value in zip(self._mem_column_ids, values):
+            self._mem_columns[cid][index] = value
+        self._mem_index_add(index)
+        return self._mem_row(index), True
         
     def delete(self, key, transaction=None):
         """
@@ -1130,7 +1642,9 @@ class MemData(Data):
         index = self._mem_find_index(key)
         if index is None:
             return 0
-        del self._mem_data[index]
+        self._mem_index_remove(index)
+        self._mem_alive[index] = False
+        self._mem_dead += 1
         return 1
 
 
@@ -1543,7 +2057,7 @@ class ColumnSpec(object):
         return self._type
 
 
-class Row:
+class Row(object):
     """Reprezentace jednoho řádku řádkových dat.
 
     V podstatě se jedná o uspořádaný seznam sloupců (položek) a jejich hodnot.
@@ -1559,6 +2073,8 @@ class Row:
     Mazání sloupců není možné.
     
     """
+    __slots__ = ('_data', '_indexes',)
+    
     def __init__(self, data=()):
         """Inicializuj řádek.
 
@@ -1633,7 +2149,7 @@ class Row:
         Hodnoty a názvy musí být stejné včetně svého pořadí.
         
         """
-        if sameclass(self, other):
+        if isinstance(other, Row):
             l1 = len(self)
             l2 = len(other)
             if l1 < l2:
@@ -1641,8 +2157,8 @@ class Row:
             elif l1 > l2:
                 return 1
             else:
-                data1 = self._data
-                data2 = other._data
+                data1 = self.items()
+                data2 = other.items()
                 for i in range(l1):
                     k1, v1 = data1[i]
                     k2, v2 = data2[i]
@@ -1796,6 +2312,122 @@ class Row:
                 self[k] = dict[k]
 
 
+class CompactRow(Row):
+    """Row sharing its column structure with other rows.
+
+    The class provides the same interface as 'Row', but it stores just the
+    column values, while the column ids and their positions are stored in a
+    'CompactRow.Columns' instance shared by all rows of the same structure,
+    typically all rows of a single select.  This saves memory significantly
+    when many rows are kept in memory, e.g. in row caches.
+
+    """
+    __slots__ = ('_columns', '_values',)
+
+    class Columns(object):
+        """Immutable column structure of 'CompactRow' instances."""
+        __slots__ = ('_keys', '_indexes',)
+        
+        def __init__(self, keys):
+            """Arguments:
+
+              keys -- sequence of column ids (strings) in the order of the row
+                values
+
+            """
+            self._keys = keys = tuple(keys)
+            self._indexes = dict([(key, i) for i, key in enumerate(keys)])
+            assert len(self._indexes) == len(keys), ('Duplicate column ids', keys,)
+
+        def keys(self):
+            """Return tuple of the column ids."""
+            return self._keys
+
+        def index(self, key):
+            """Return position of the column 'key'.
+
+            'KeyError' is raised if there is no such column.
+
+            """
+            return self._indexes[key]
+
+        def __contains__(self, key):
+            return key in self._indexes
+
+        def __len__(self):
+            return len(self._keys)
+    
+    def __init__(self, columns, values):
+        """Initialize the row.
+
+        Arguments:
+
+          columns -- 'CompactRow.Columns' instance describing the row columns
+          values -- list of column values as 'Value' instances, in the order
+            given by 'columns'; the list is owned by the row after the call
+
+        """
+        assert isinstance(columns, CompactRow.Columns), columns
+        assert isinstance(values, list) and len(values) == len(columns), values
+        self._columns = columns
+        self._values = values
+
+    def _index(self, key):
+        if isinstance(key, basestring):
+            return self._columns.index(key)
+        return super(CompactRow, self)._index(key)
+
+    def __copy__(self):
+        return self.__class__(self._columns, self._values)
+
+    def __getstate__(self):
+        return zip(self._columns.keys(), self._values)
+
+    def _set_data(self, data):
+        self._columns = CompactRow.Columns([k for k, v in data])
+        self._values = [v for k, v in data]
+        
+    def __unicode__(self):
+        items = [k + '==' + unicode(v) for k, v in zip(self._columns.keys(), self._values)]
+        return '<Row: %s>' % ', '.join(items)
+
+    def __hash__(self):
+        value = 0
+        for k, v in zip(self._columns.keys(), self._values):
+            value = value ^ hash(k) ^ hash(v)
+        return value
+
+    def __len__(self):
+        return len(self._values)
+
+    def __getitem__(self, key):
+        return self._values[self._index(key)]
+
+    def __setitem__(self, key, value):
+        index = self._index(key)
+        self._values = values = list(self._values)
+        values[index] = value
+
+    def __getslice__(self, i, j):
+        return Row(zip(self._columns.keys()[i:j], self._values[i:j]))
+
+    def __contains__(self, key):
+        return key in self._columns
+
+    def keys(self):
+        return list(self._columns.keys())
+
+    def items(self):
+        return zip(self._columns.keys(), self._values)
+
+    def append(self, key, value):
+        assert isinstance(key, basestring)
+        assert isinstance(value, Value)
+        assert key not in self._columns, key
+        self._columns = CompactRow.Columns(self._columns.keys() + (key,))
+        self._values = self._values + [value]
+
+
 class DataFactory(object):
     """Factory na tvorbu datových objektů dle zadané specifikace.
 
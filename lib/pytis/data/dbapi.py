@@ -27,9 +27,12 @@ Database API implementation.
 
 """
 
+import collections
 import datetime
 import inspect
-import select
+import itertools
+import re
+import thread
 import time
 
 import psycopg2 as dbapi
@@ -46,11 +49,105 @@ from postgresql import DBDataPostgreSQL, DBPostgreSQLCounter, DBPostgreSQLFuncti
 
 _ = translations('pytis-data')
 
+
+class _DBAPIResult(PostgreSQLResult):
+    """Result of a data returning query converted lazily from a DB API cursor.
+
+    The raw rows are taken from the cursor when the result is created, so the
+    result doesn't depend on the cursor's connection, which may be closed
+    after its return to the pool.  The rows are converted to the pytis
+    representation in batches by per-column converters computed just once from
+    the cursor description.  Iteration over the result converts the rows
+    without storing them, the whole converted result is stored only on random
+    access to its rows.
+
+    """
+    _IDENTITY_TYPES = ('BINARY', 'BOOLEAN', 'DATE', 'DATETIME', 'DATETIMETZ', 'DECIMAL',
+                       'FLOAT', 'INTEGER', 'INTERVAL', 'LONGINTEGER', 'ROWID', 'TIME',)
+
+    def __init__(self, cursor, batch_size):
+        super(_DBAPIResult, self).__init__(None)
+        self._batch_size = batch_size
+        self._converters = self._make_converters(cursor.description)
+        if cursor.rowcount > 0:
+            self._rows = cursor.fetchall()
+        else:
+            self._rows = []
+        cursor.close()
+
+    @staticmethod
+    def _decode_string(value):
+        if isinstance(value, str):
+            value = unicode(value, 'utf-8')
+        return value
+
+    @staticmethod
+    def _convert_value(value):
+        if isinstance(value, psycopg2.extras.Range):
+            value = Range.Range(value.lower, value.upper,
+                                lower_inc=value.lower_inc, upper_inc=value.upper_inc)
+        elif isinstance(value, str):
+            value = unicode(value, 'utf-8')
+        return value
+
+    def _make_converters(self, description):
+        # Return the list of pairs (INDEX, CONVERTER) of the columns needing
+        # conversion.  Columns of the types known to be returned by the DB API
+        # in their final form are omitted.
+        converters = []
+        for i, column in enumerate(description):
+            typecaster = psycopg2.extensions.string_types.get(column[1])
+            name = typecaster and typecaster.name
+            if name in self._IDENTITY_TYPES or name and name.endswith('ARRAY'):
+                continue
+            elif name == 'STRING':
+                converter = self._decode_string
+            else:
+                converter = self._convert_value
+            converters.append((i, converter,))
+        return converters
+
+    def _batches(self):
+        converters = self._converters
+        batch_size = self._batch_size
+        for start in xrange(0, len(self._rows), batch_size):
+            rows = self._rows[start:start + batch_size]
+            if converters:
+                batch = []
+                for row in rows:
+                    row = list(row)
+                    for i, converter in converters:
+                        value = row[i]
+                        if value is not None:
+                            row[i] = converter(value)
+                    batch.append(row)
+                yield batch
+            else:
+                yield rows
+
+    def __iter__(self):
+        if self._data is not None:
+            return iter(self._data)
+        return (r for batch in self._batches() for r in batch)
+
+    def __getitem__(self, row):
+        if self._data is None:
+            self._data = [r for batch in self._batches() for r in batch]
+        return self._data[row]
+
+    def __len__(self):
+        return len(self._rows)
+
+
 class _DBAPIAccessor(PostgreSQLAccessor):
 
     _query_callback = (None,)
     _last_server_errors = {}
 
+    _PREPARED_STATEMENTS_LIMIT = 200
+    _prepared_statement_numbers = itertools.count(1)
+    _prepared_parameter_regexp = re.compile(r'%(?:\((\w+)\)s|%)')
+
     @classmethod
     def set_query_callback(class_, callback):
         # We can't simply assign callback, because Python would made an unbound
@@ -112,7 +209,52 @@ class _DBAPIAccessor(PostgreSQLAccessor):
         if __debug__:
             connection.set_connection_info('transaction_start_stack', None)
     
-    def _postgresql_query(self, connection, query, outside_transaction, _retry=True):
+    def _postgresql_prepared_query(self, connection, cursor, query, query_args):
+        # Return the pair (QUERY, QUERY_ARGS) performing 'query' as a
+        # prepared statement of 'connection'.  The statement is prepared on
+        # first use of 'query' (compared with argument names stripped) on the
+        # given connection.  Statements which can't be prepared are performed
+        # directly.
+        statements = connection.connection_info('prepared_statements')
+        if statements is None:
+            statements = collections.OrderedDict()
+            connection.set_connection_info('prepared_statements', statements)
+        names = []
+        def parameter(match):
+            name = match.group(1)
+            if name is None:
+                return '%'
+            if name not in names:
+                names.append(name)
+            return '$%d' % (names.index(name) + 1,)
+        template = self._prepared_parameter_regexp.sub(parameter, query)
+        try:
+            statement = statements.pop(template)
+        except KeyError:
+            statement = '_pytis_statement_%d' % (self._prepared_statement_numbers.next(),)
+            # Preparation errors must not break the current transaction.
+            cursor.execute('savepoint _pytis_prepare')
+            try:
+                cursor.execute('prepare %s as %s' % (statement, template,))
+            except dbapi.DatabaseError as e:
+                log(OPERATIONAL, "Can't prepare statement:", (template, e,))
+                cursor.execute('rollback to savepoint _pytis_prepare')
+                statement = None
+            else:
+                cursor.execute('release savepoint _pytis_prepare')
+            if len(statements) >= self._PREPARED_STATEMENTS_LIMIT:
+                unused = statements.popitem(last=False)[1]
+                if unused is not None:
+                    cursor.execute('deallocate %s' % (unused,))
+        # Move the statement to the end to keep the least recently used first.
+        statements[template] = statement
+        if statement is None:
+            return query, query_args
+        arguments = ', '.join(['%%(%s)s' % (name,) for name in names])
+        return 'execute %s (%s)' % (statement, arguments,), query_args
+
+    def _postgresql_query(self, connection, query, outside_transaction, _retry=True,
+                          prepare=False, copy_to=None):
         result = None
         def transform_arg(arg):
             if isinstance(arg, Range.Range):
@@ -133,6 +275,7 @@ class _DBAPIAccessor(PostgreSQLAccessor):
                 bounds = ('[' if arg.lower_inc() else '(') + (']' if arg.upper_inc() else ')')
                 arg = c(lower, upper, bounds=bounds)
             return arg
+        import config
         if isinstance(query, basestring):
             query_args = {}
         else:
@@ -169,7 +312,16 @@ class _DBAPIAccessor(PostgreSQLAccessor):
             # query_args shouldn't be used when empty to prevent mistaken
             # '%' processing in `query'
             try:
-                if query_args:
+                if copy_to is not None:
+                    # COPY doesn't accept query parameters.
+                    if query_args:
+                        query = cursor.mogrify(query, query_args)
+                    cursor.copy_expert(query, copy_to)
+                elif query_args and prepare and config.dbprepared_statements:
+                    command, command_args = self._postgresql_prepared_query(connection, cursor,
+                                                                            query, query_args)
+                    cursor.execute(command, command_args)
+                elif query_args:
                     cursor.execute(query, query_args)
                 else:
                     cursor.execute(query)
@@ -183,7 +335,8 @@ class _DBAPIAccessor(PostgreSQLAccessor):
             return cursor
         def retry(message, exception):
             connection.set_connection_info('broken', True)
-            if _retry:
+            # A failed COPY may have already written a part of its output.
+            if _retry and copy_to is None:
                 if not outside_transaction:
                     raise DBRetryException(message, exception, exception.args, query)
                 cdata = connection.connection_data()
@@ -271,22 +424,11 @@ class _DBAPIAccessor(PostgreSQLAccessor):
 
     def _postgresql_transform_query_result(self, result):
         cursor = result.result()
-        data = []
         if cursor.description:
-            for i in range(cursor.rowcount):
-                row = cursor.fetchone()
-                row_data = []
-                for col in row:
-                    if isinstance(col, psycopg2.extras.Range):
-                        col = Range.Range(col.lower, col.upper,
-                                          lower_inc=col.lower_inc, upper_inc=col.upper_inc)
-                    elif isinstance(col, str):
-                        col = unicode(col, 'utf-8')
-                    row_data.append(col)
-                data.append(row_data)
+            import config
+            return _DBAPIResult(cursor, config.fetch_batch_size)
         else:
-            data.append([cursor.rowcount])
-        return PostgreSQLResult(data)
+            return PostgreSQLResult([[cursor.rowcount]])
 
     def _postgresql_begin_transaction(self):
         # In psycopg2 `begin' is called automatically.
@@ -362,12 +504,16 @@ class DBAPIData(_DBAPIAccessor, DBDataPostgreSQL):
 
     class _PgNotifier(_DBAPIAccessor, PostgreSQLNotifier._PgNotifier):
 
-        def __init__(self, connection_data, connection_name=None):
+        _RECONNECTION_PAUSE = 10
+
+        def __init__(self, connection_data, key, connection_name=None):
             self._sql_logger = None # difficult to call superclass constructors properly
-            PostgreSQLNotifier._PgNotifier.__init__(self, connection_data,
-                                                    connection_name=connection_name)
-            
             self._pgnotif_connection = None
+            self._registered_notifications = []
+            self._reconnection_time = 0
+            self._reconnecting = False
+            PostgreSQLNotifier._PgNotifier.__init__(self, connection_data, key,
+                                                    connection_name=connection_name)
 
         def _notif_init_connection(self):
             if self._pgnotif_connection is None:
@@ -376,75 +522,83 @@ class DBAPIData(_DBAPIAccessor, DBDataPostgreSQL):
                 self._pgnotif_connection = connection
                 connection.connection().set_isolation_level(
                     psycopg2.extensions.ISOLATION_LEVEL_AUTOCOMMIT)
-                self._registered_notifications = []
             
         def _notif_do_registration(self, notification):
             if notification not in self._registered_notifications:
                 self._registered_notifications.append(notification)
             connection = self._pgnotif_connection
             query = 'listen "%s"' % (notification,)
-            # TODO: Allow reconnection with re-registrations
             def lfunction():
                 return self._postgresql_query(connection, query, True)
             _result, self._pgnotif_connection = \
                 with_lock(self._pg_query_lock, lfunction)
-        
-        def _notif_listen_loop(self):
-            while True:
-                while self._pgnotif_connection is None:
-                    time.sleep(10)
-                    try:
-                        self._notif_init_connection()
-                        for notification in self._registered_notifications:
-                            self._notif_do_registration(notification)
-                    except Exception as e:
-                        self._pgnotif_connection = None
-                connection_ = self._pgnotif_connection
-                connection = connection_.connection()
-                if __debug__:
-                    log(DEBUG, 'Listening for notifications:', connection)
-                def lfunction():
-                    cursor = connection.cursor()
-                    try:
-                        fileno = connection.fileno()
-                    except AttributeError: # older psycogp2 versions
-                        fileno = cursor.fileno()
-                    return cursor, fileno
-                cursor, fileno = with_lock(self._pg_query_lock, lfunction)
+
+        def _notif_reconnect(self):
+            # Reconnect and renew all registrations, but not too often.  It's
+            # done in a separate thread, so that the notification hub serving
+            # other notifiers doesn't wait for the connection.
+            if self._reconnecting or time.time() < self._reconnection_time:
+                return
+            self._reconnecting = True
+            self._reconnection_time = time.time() + self._RECONNECTION_PAUSE
+            def lfunction():
+                self._notif_init_connection()
+                for notification in self._registered_notifications:
+                    self._notif_do_registration(notification)
+            def reconnect():
                 try:
-                    select.select([fileno], [], [], None)
+                    with_lock(self._notif_connection_lock, lfunction)
                 except Exception as e:
                     if __debug__:
-                        log(DEBUG, 'Socket error', e.args)
-                    break
-                if __debug__:
-                    log(DEBUG, 'Input received')
-                def lfunction():
-                    notifications = []
+                        log(DEBUG, 'Notification connection failed:', e)
+                    self._pgnotif_connection = None
+                self._reconnecting = False
+                PostgreSQLNotifier._pg_notification_hub().wakeup()
+            thread.start_new_thread(reconnect, ())
+
+        def _notif_fileno(self):
+            if self._reconnecting:
+                return None
+            if self._pgnotif_connection is None:
+                self._notif_reconnect()
+                return None
+            connection = self._pgnotif_connection.connection()
+            def lfunction():
+                try:
+                    try:
+                        return connection.fileno()
+                    except AttributeError: # older psycogp2 versions
+                        return connection.cursor().fileno()
+                except (dbapi.OperationalError, dbapi.InterfaceError):
+                    self._pgnotif_connection = None
+                    return None
+            return with_lock(self._pg_query_lock, lfunction)
+
+        def _notif_poll(self):
+            connection_ = self._pgnotif_connection
+            if connection_ is None:
+                return []
+            connection = connection_.connection()
+            def lfunction():
+                notifications = []
+                try:
                     try:
                         connection.poll()
-                        ready = True
                     except AttributeError: # older psycopg2 versions
-                        try:
-                            ready = cursor.isready()
-                        except dbapi.OperationalError:
-                            self._pg_notif_connection = None
-                            return notifications
-                    if ready:
-                        notifies = connection.notifies
-                        if notifies:
-                            if __debug__:
-                                log(DEBUG, 'Data change registered')
-                            notifications = []
-                            while notifies:
-                                notifications.append(notifies.pop()[1])
+                        connection.cursor().isready()
+                except (dbapi.OperationalError, dbapi.InterfaceError):
+                    self._pgnotif_connection = None
                     return notifications
-                notifications = with_locks((self._notif_connection_lock,
-                                            self._pg_query_lock,),
-                                           lfunction)
-                if __debug__:
-                    log(DEBUG, 'Notifications received:', notifications)
-                self._notif_invoke_callbacks(notifications)
+                notifies = connection.notifies
+                if notifies:
+                    if __debug__:
+                        log(DEBUG, 'Data change registered')
+                    while notifies:
+                        notify = notifies.pop(0)
+                        notifications.append((notify[1], getattr(notify, 'payload', None)))
+                return notifications
+            return with_locks((self._notif_connection_lock, self._pg_query_lock,),
+                              lfunction)
 
 
 # Defaults
@@ -55,6 +55,8 @@ tabulky.
 
 import gc
 import thread
+import threading
+import time
 import weakref
 
 from pytis.data import ColumnSpec, Data, Type
@@ -232,15 +234,29 @@ class DBData(Data):
         
 
 class DBConnectionPool:
+    """Pool of database connections shared by all data objects.
 
+    Connections are kept separately for each connection specification.  The
+    number of connections allocated for a single specification is limited by
+    'config.connection_limit'; when the limit is reached, 'get()' waits for a
+    connection to be returned to the pool, at most for
+    'config.connection_wait_timeout' seconds.  Idle connections are checked
+    for their age and idle time limits before being passed to the caller.
+
+    """
+    _WAIT_INTERVAL = 1.0
+    
     def __init__(self, connection_creator, connection_closer):
         if __debug__:
             log(DEBUG, 'Creating a new pool')
-        self._lock = thread.allocate_lock()
+        self._lock = threading.Condition(threading.Lock())
         self._pool = {}
         self._connection_creator = connection_creator
         self._connection_closer = connection_closer
         self._allocated_connections = {}
+        self._pending_connections = {}
+        self._statistics = dict(checkouts=0, waits=0, wait_timeouts=0, created=0, broken=0,
+                                expired=0, checkout_time=0.0, max_checkout_time=0.0)
 
     def __del__(self):
         # Pro jistotu uzavíráme všechna spojení, přestože by to mělo být
@@ -262,64 +278,139 @@ class DBConnectionPool:
             schemas = tuple(schemas)
         return (c.database(), c.host(), c.port(), c.user(), c.password(), c.sslmode(), schemas,)
 
+    def _spec_connections(self, spec_id):
+        try:
+            connections = self._pool[spec_id]
+        except KeyError:
+            connections = self._pool[spec_id] = []
+        try:
+            allocated_connections = self._allocated_connections[spec_id]
+        except KeyError:
+            allocated_connections = self._allocated_connections[spec_id] \
+                = weakref.WeakKeyDictionary()
+        return connections, allocated_connections
+
+    def _expired(self, connection, now):
+        import config
+        max_age = config.connection_max_age
+        max_idle = config.connection_max_idle
+        return ((max_age is not None and
+                 connection.connection_info('pool_creation_time') + max_age < now) or
+                (max_idle is not None and
+                 connection.connection_info('pool_return_time') + max_idle < now))
+
+    def _discard(self, connection, allocated_connections):
+        # Must be called with the pool lock held.
+        allocated_connections.pop(connection, None)
+        try:
+            self._connection_closer(connection)
+        except:
+            pass
+        self._lock.notify()
+
+    def _idle_connection(self, connections, allocated_connections):
+        # Must be called with the pool lock held.
+        now = time.time()
+        # The oldest idle connections are at the beginning of the list.
+        while connections and self._expired(connections[0], now):
+            self._statistics['expired'] += 1
+            self._discard(connections.pop(0), allocated_connections)
+        while connections:
+            c = connections.pop()
+            if not c.connection_info('broken'):
+                if __debug__:
+                    log(DEBUG, 'Available connections:', connections)
+                return c
+            self._statistics['broken'] += 1
+            self._discard(c, allocated_connections)
+        return None
+
     def get(self, connection_spec):
         import config
-        pool = self._pool
         spec_id = self._connection_spec_id(connection_spec)
+        start_time = time.time()
         def lfunction():
-            try:
-                connections = pool[spec_id]
-            except KeyError:
-                pool[spec_id] = connections = []
-            try:
-                allocated_connections = self._allocated_connections[spec_id]
-            except KeyError:
-                allocated_connections = self._allocated_connections[spec_id] \
-                    = weakref.WeakKeyDictionary()
-            c = None
-            broken_connections_present = False
-            while connections:
-                c_candidate = connections.pop()
-                if c_candidate.connection_info('broken'):
-                    broken_connections_present = True
-                else:
-                    c = c_candidate
-                    if __debug__:
-                        log(DEBUG, 'Available connections:', connections)
-                    break
-            if c is None or broken_connections_present:
-                gc.collect()
-            if c is None:
-                if ((config.connection_limit is not None and
-                     len(allocated_connections) >= config.connection_limit)):
+            connections, allocated_connections = self._spec_connections(spec_id)
+            deadline = None
+            collected = False
+            while True:
+                c = self._idle_connection(connections, allocated_connections)
+                if c is not None:
+                    return c
+                pending = self._pending_connections.get(spec_id, 0)
+                if ((config.connection_limit is None or
+                     len(allocated_connections) + pending < config.connection_limit)):
+                    # Reserve the place for a new connection, it is created
+                    # outside the lock.
+                    self._pending_connections[spec_id] = pending + 1
+                    return None
+                if deadline is None:
+                    self._statistics['waits'] += 1
+                    deadline = time.time() + (config.connection_wait_timeout or 0)
+                elif not collected:
+                    # Connections not returned to the pool are released from
+                    # 'allocated_connections' only after they get garbage
+                    # collected, so give them a chance once per long wait.
+                    gc.collect()
+                    collected = True
+                    continue
+                remaining = deadline - time.time()
+                if remaining <= 0:
+                    self._statistics['wait_timeouts'] += 1
                     if __debug__:
                         log(EVENT, "Connections summary:")
                         for c in allocated_connections.keys():
                             log(EVENT, "Connection:", c.connection_info('last_access'))
                     raise DBSystemException(_(u"Too many database connections"))
-                else:
-                    c = self._connection_creator(connection_spec)
-                    if __debug__:
-                        log(DEBUG, 'New connection created:', c)
-                    allocated_connections[c] = True
-            return c
+                self._lock.wait(min(remaining, self._WAIT_INTERVAL))
         c = with_lock(self._lock, lfunction)
+        if c is None:
+            c = self._create_connection(connection_spec, spec_id)
+        def lfunction():
+            checkout_time = time.time() - start_time
+            statistics = self._statistics
+            statistics['checkouts'] += 1
+            statistics['checkout_time'] += checkout_time
+            statistics['max_checkout_time'] = max(statistics['max_checkout_time'], checkout_time)
+        with_lock(self._lock, lfunction)
         if __debug__:
             log(DEBUG, 'Passing connection:', c)
         return c
 
+    def _create_connection(self, connection_spec, spec_id):
+        c = None
+        try:
+            c = self._connection_creator(connection_spec)
+            c.set_connection_info('pool_creation_time', time.time())
+            if __debug__:
+                log(DEBUG, 'New connection created:', c)
+        finally:
+            def lfunction():
+                self._pending_connections[spec_id] -= 1
+                if c is None:
+                    # Let other threads use the reserved place.
+                    self._lock.notify()
+                else:
+                    self._statistics['created'] += 1
+                    self._spec_connections(spec_id)[1][c] = True
+            with_lock(self._lock, lfunction)
+        return c
+
     def put_back(self, connection_spec, connection):
-        pool = self._pool
         spec_id = self._connection_spec_id(connection_spec)
         def lfunction():
-            try:
-                connections = pool[spec_id]
-            except KeyError:
-                pool[spec_id] = connections = []
+            connections, allocated_connections = self._spec_connections(spec_id)
             import config
-            if ((config.max_pool_connections is None or
-                 len(connections) < config.max_pool_connections)):
+            if connection.connection_info('broken'):
+                self._statistics['broken'] += 1
+                self._discard(connection, allocated_connections)
+            elif ((config.max_pool_connections is None or
+                   len(connections) < config.max_pool_connections)):
+                connection.set_connection_info('pool_return_time', time.time())
                 connections.append(connection)
+                self._lock.notify()
+            else:
+                self._discard(connection, allocated_connections)
         with_lock(self._lock, lfunction)
         if __debug__:
             log(DEBUG, 'Connection returned to pool:', connection)
@@ -340,6 +431,7 @@ class DBConnectionPool:
                         pass
             self._allocated_connections = {}
             self._pool = {}
+            self._lock.notifyAll()
         with_lock(self._lock, lfunction)
 
     def info(self):
@@ -354,6 +446,32 @@ class DBConnectionPool:
                 info.append(c.connection_info('transaction_commands'))
         return info
 
+    def statistics(self):
+        """Return dictionary of information about the pool state.
+
+        The dictionary contains the following items:
+
+          allocated -- number of all connections created by the pool and not
+            closed yet
+          idle -- number of connections available in the pool
+          checkouts -- number of connections passed by 'get()'
+          waits -- number of 'get()' calls which had to wait for a connection
+          wait_timeouts -- number of 'get()' calls which failed after waiting
+          created -- number of created connections
+          broken -- number of discarded broken connections
+          expired -- number of connections closed due to exceeding their age
+            or idle time limits
+          checkout_time -- total time spent in 'get()' in seconds
+          max_checkout_time -- maximum time spent in a single 'get()' call
+
+        """
+        def lfunction():
+            statistics = dict(self._statistics)
+            statistics['allocated'] = sum([len(c) for c in self._allocated_connections.values()])
+            statistics['idle'] = sum([len(c) for c in self._pool.values()])
+            return statistics
+        return with_lock(self._lock, lfunction)
+
 
 ### Specifikační třídy
 
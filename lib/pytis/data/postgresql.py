@@ -25,9 +25,14 @@ k databázi zajišťují rozhraní dále implementovaná v jiných zdrojových
 
 """
 
+import collections
 import copy
+import cPickle as pickle
+import functools
+import json
 import os
 import re
+import select
 import string
 import sys
 import thread
@@ -38,13 +43,13 @@ import weakref
 import pytis.data
 from pytis.data import DBException, DBInsertException, DBLockException, DBRetryException, \
     DBSystemException, DBUserException, DBConnection, DBConnectionPool, DBData, \
-    ColumnSpec, DBColumnBinding, Row, Function, dbtable, reversed_sorting, \
+    ColumnSpec, DBColumnBinding, CompactRow, Row, Function, MemData, dbtable, reversed_sorting, \
     Array, Binary, Boolean, Date, DateTime, Float, FullTextIndex, Inet, Integer, LTree, \
     Macaddr, Number, Range, Serial, String, Time, TimeInterval, ival, sval, \
     Type, Value, Operator, AND, OR, EQ, NE, GT, LT, FORWARD, BACKWARD, ASCENDENT, DESCENDANT
 import pytis.util
-from pytis.util import ACTION, Counter, DEBUG, ecase, EVENT, is_anystring, is_sequence, \
-    log, object_2_5, OPERATIONAL, ProgramError, remove_duplicates, UNDEFINED, \
+from pytis.util import ACTION, Counter, DEBUG, ecase, EVENT, identity, is_anystring, \
+    is_sequence, log, object_2_5, OPERATIONAL, ProgramError, remove_duplicates, UNDEFINED, \
     with_lock, xtuple
 import evaction
 
@@ -521,7 +526,7 @@ class PostgreSQLAccessor(object_2_5):
                 self._postgresql_query(connection, query, False)
                 connection.set_connection_info('search_path', search_path)
         
-    def _postgresql_query(self, connection, query, restartable):
+    def _postgresql_query(self, connection, query, restartable, prepare=False, copy_to=None):
         """Perform SQL 'query' and return the result.
 
         Arguments:
@@ -530,6 +535,12 @@ class PostgreSQLAccessor(object_2_5):
           query -- '_Query' instance of the SQL command to be performed
           restartable -- iff this is true, the method may try to restart the
             database connection in case of error
+          prepare -- iff this is true, the method may perform the query as a
+            prepared statement of 'connection', so that the queries differing
+            only in their argument values are parsed and planned by the
+            database server just once per connection
+          copy_to -- if not 'None', 'query' is a 'COPY ... TO STDOUT' command
+            and this is a file like object the command output is written to
 
         The return value is a pair ('result', 'connection'), where 'result' is
         a '_postgresql_Result' result and 'connection' a
@@ -655,7 +666,8 @@ class PostgreSQLConnector(PostgreSQLAccessor):
         pool = self._pg_connection_pool()
         pool.put_back(connection.connection_data(), connection)
 
-    def _pg_query(self, query, outside_transaction=False, backup=False, transaction=None):
+    def _pg_query(self, query, outside_transaction=False, backup=False, transaction=None,
+                  prepare=False, copy_to=None):
         """Call the SQL 'query' and return the result.
 
         Arguments:
@@ -668,8 +680,14 @@ class PostgreSQLConnector(PostgreSQLAccessor):
             used for performing the query or 'None' (in which case the
             connection is selected automatically); this argument may not be
             used when 'outside_transaction' is true
+          prepare -- iff it is true, the query may be performed as a prepared
+            statement; this is useful for frequently repeated queries
+            differing only in argument values
+          copy_to -- file like object to write the output of a 'COPY ... TO
+            STDOUT' 'query' to or 'None'
 
-        The return value is a 'PostgreSQLResult' instance.
+        The return value is a 'PostgreSQLResult' instance.  The result of a
+        'COPY' query contains just the number of copied rows.
 
         The method must properly handle database exception and in case any is
         caught the corresponding 'DBException' must be raised.
@@ -695,7 +713,11 @@ class PostgreSQLConnector(PostgreSQLAccessor):
             try:
                 self._postgresql_initialize_search_path(connection,
                                                         self._pg_connection_data().schemas())
-                result, connection = self._postgresql_query(connection, query, outside_transaction)
+                result, connection = self._postgresql_query(connection, query, outside_transaction,
+                                                            prepare=prepare, copy_to=copy_to)
+                # The result must be retrieved before the connection is
+                # returned, the pool may close it.
+                data = self._postgresql_transform_query_result(result)
             finally:
                 # Vrať DB spojení zpět
                 if connection is not None and connection is borrowed_connection:
@@ -710,8 +732,7 @@ class PostgreSQLConnector(PostgreSQLAccessor):
                 # automaticky správně řazeny.
                 logging_query = self._pdbb_logging_command.values((query.format(),))
                 self._postgresql_query(connection, logging_query, False)
-            # Získej a vrať data
-            return self._postgresql_transform_query_result(result)
+            return data
         data = with_lock(self._pg_query_lock, lfunction)
         if __debug__:
             log(DEBUG, 'SQL query result', data)
@@ -835,28 +856,152 @@ class PostgreSQLUserGroups(PostgreSQLConnector):
 class PostgreSQLNotifier(PostgreSQLConnector):
     """Class with notification about table contents changes.
 
-    The class runs a thread watching for notification defined in the
-    `_pg_notifications' attribute and sets the `_pg_changed' attribute to True
-    whenever any of the given object gets changed and calls registered
-    callbacks.
+    The class watches for notifications defined in the `_pg_notifications'
+    attribute and sets the `_pg_changed' attribute to True whenever any of the
+    given object gets changed and calls registered callbacks.
+
+    All notifications of the process are watched by a single thread, see
+    '_PgNotificationHub'.  The thread also discards row counts depending on
+    the received notifications from the process wide row count cache, see
+    '_PgRowCountCache'.
 
     """
 
     NOTIFIERS = {}
 
+    _pg_notification_hub_ = None
+    _pg_notification_hub_lock = thread.allocate_lock()
+
+    class _PgNotificationHub(object):
+        """Thread watching the notification connections of all notifiers.
+
+        There is only one hub per process.  It waits for input on connections
+        of all '_PgNotifier' instances at once and invokes change callbacks of
+        the data objects subscribed to the received notifications.  Callbacks
+        of one data object are not invoked more often than once per
+        'config.dbnotification_delay' milliseconds, notifications received in
+        the meantime are coalesced and delivered together.
+
+        """
+        _RECONNECTION_PAUSE = 10
+        # Pause after an unexpected error to avoid busy looping.
+        _ERROR_PAUSE = 1
+        # Maximum number of notifications of one data object remembered within
+        # the delivery period; if there are more, the data object is informed
+        # about an unspecified change.
+        _MAX_NOTIFICATIONS = 100
+
+        def __init__(self):
+            self._notifiers = []
+            self._lock = thread.allocate_lock()
+            self._pending = weakref.WeakKeyDictionary()
+            self._last_delivery = 0
+            self._wakeup_input, self._wakeup_output = os.pipe()
+            thread.start_new_thread(self._run, ())
+
+        def add_notifier(self, notifier):
+            with_lock(self._lock, lambda: self._notifiers.append(notifier))
+            self.wakeup()
+
+        def wakeup(self):
+            """Make the hub thread watch the current notifier connections."""
+            os.write(self._wakeup_output, 'x')
+
+        def _delay(self):
+            import config
+            return config.dbnotification_delay / 1000.0
+
+        def _run(self):
+            # The hub serves all the notifiers, so it must never stop.
+            while True:
+                try:
+                    self._run_once()
+                except Exception as e:
+                    log(OPERATIONAL, 'Notification hub error:', e)
+                    time.sleep(self._ERROR_PAUSE)
+
+        def _fileno(self, notifier):
+            try:
+                return notifier._notif_fileno()
+            except Exception as e:
+                log(OPERATIONAL, 'Notification connection error:', (notifier, e))
+                return None
+
+        def _run_once(self):
+            notifiers = with_lock(self._lock, lambda: list(self._notifiers))
+            filenos = {}
+            timeout = None
+            for notifier in notifiers:
+                fileno = self._fileno(notifier)
+                if fileno is None:
+                    timeout = self._RECONNECTION_PAUSE
+                else:
+                    filenos[fileno] = notifier
+            if self._pending:
+                delivery_timeout = max(self._last_delivery + self._delay() - time.time(), 0)
+                if timeout is None or delivery_timeout < timeout:
+                    timeout = delivery_timeout
+            try:
+                ready = select.select(filenos.keys() + [self._wakeup_input], [], [],
+                                      timeout)[0]
+            except Exception as e:
+                if __debug__:
+                    log(DEBUG, 'Socket error', e.args)
+                # Let the notifiers find out which connection is broken.
+                ready = filenos.keys()
+            if self._wakeup_input in ready:
+                os.read(self._wakeup_input, 1024)
+            for fileno in ready:
+                notifier = filenos.get(fileno)
+                if notifier is not None:
+                    notifications = notifier._notif_poll()
+                    if notifications:
+                        if __debug__:
+                            log(DEBUG, 'Notifications received:', notifications)
+                        PostgreSQLNotifier._pg_row_count_cache.invalidate(
+                            [(notifier.key(), n[0]) for n in notifications])
+                        subscribers = notifier._notif_subscribers(notifications)
+                        for d, received in subscribers.items():
+                            pending = self._pending.get(d, [])
+                            if pending is not None:
+                                pending = remove_duplicates(pending + received)
+                                if len(pending) > self._MAX_NOTIFICATIONS:
+                                    pending = None
+                            self._pending[d] = pending
+            if self._pending and time.time() >= self._last_delivery + self._delay():
+                self._deliver()
+
+        def _deliver(self):
+            pending = self._pending.items()
+            self._pending.clear()
+            self._last_delivery = time.time()
+            for d, notifications in pending:
+                if __debug__:
+                    log(DEBUG, 'Volám callbacky datového objektu:', d)
+                try:
+                    if notifications is not None:
+                        changes = d._pg_notification_changes(notifications)
+                    else:
+                        changes = None
+                    d._call_on_change_callbacks(changes)
+                except Exception as e:
+                    log(OPERATIONAL, 'Change callback failed:', (d, e))
+
     class _PgNotifier(PostgreSQLConnector):
+        """Notifications of one database, received through a single connection."""
 
         # Jsou tu dva zámky -- pozor na uváznutí!
 
-        def __init__(self, connection_data, connection_name=None):
+        def __init__(self, connection_data, key, connection_name=None):
             if __debug__:
                 log(DEBUG, 'Vytvoření notifikátoru')
             PostgreSQLConnector.__init__(self, connection_data,
                                          connection_name=connection_name)
+            self._notif_key = key
             self._notif_data_lock = thread.allocate_lock()
-            self._notif_data_objects = weakref.WeakKeyDictionary()
+            self._notif_channels = {}
             self._notif_connection_lock = thread.allocate_lock()
-            thread.start_new_thread(self._notif_listen, ())
+            PostgreSQLNotifier._pg_notification_hub().add_notifier(self)
 
         def _notif_do_registration(self, notification):
             self._pg_query(_Query('listen "%s"' % notification))
@@ -873,64 +1018,139 @@ class PostgreSQLNotifier(PostgreSQLConnector):
             if __debug__:
                 log(DEBUG, 'Notifikace zaregistrována:', notification)
 
-        def _notif_listen(self):
-            if __debug__:
-                log(DEBUG, 'Nový listener')
-            error_pause = 1
-            self._notif_init_connection()
-            while True:
-                if __debug__:
-                    log(DEBUG, 'Napichuji se na nové spojení')
-                notiflist = []
-                for d in self._notif_data_objects.values():
-                    notiflist = notiflist + d
-                if __debug__:
-                    log(DEBUG, 'Notifikace k registraci:', notiflist)
-                notiflist = []
-                for list_ in self._notif_data_objects.values():
-                    notiflist += list_
-                try:
-                    # connection do poolu nikdy nevracíme, takže na něj můžeme
-                    # navěsit, co je nám libo.
-                    for n in remove_duplicates(notiflist):
-                        self._notif_register(n)
-                except DBException:
-                    time.sleep(error_pause)
-                    error_pause = error_pause * 2
-                    continue
-                self._notif_listen_loop()
+        def _notif_fileno(self):
+            # Return the file descriptor of the notification connection to
+            # watch or None if the connection is not available.
+            raise Exception("Volána neimplementovaná metoda")
 
-        def _notif_listen_loop(self):
+        def _notif_poll(self):
+            # Return the list of notifications received on the connection as
+            # pairs (NAME, PAYLOAD).
             raise Exception("Volána neimplementovaná metoda")
 
-        def _notif_invoke_callbacks(self, notifications):
-            if __debug__:
-                log(DEBUG, 'Volám callbacky')
+        def _notif_subscribers(self, notifications):
+            # Return dictionary of data objects subscribed to given
+            # notifications and the lists of their notifications.
             def lfunction():
-                return copy.copy(self._notif_data_objects)
-            data_objects = with_lock(self._notif_data_lock, lfunction)
-            for d, ns in data_objects.items():
-                for n in ns:
-                    if n in notifications:
-                        if __debug__:
-                            log(DEBUG, 'Volám callbacky datového objektu:', d)
-                        d._call_on_change_callbacks()
-                        break
+                data_objects = {}
+                for n in notifications:
+                    for d in self._notif_channels.get(n[0], {}).keys():
+                        data_objects.setdefault(d, []).append(n)
+                return data_objects
+            return with_lock(self._notif_data_lock, lfunction)
+
+        def key(self):
+            """Return the database key of the notifier, see '_pg_notifier_key()'."""
+            return self._notif_key
 
         def register_notification(self, data, notification):
             if __debug__:
                 log(DEBUG, 'Registruji notifikaci:', notification)
             def lfunction():
                 try:
-                    notifications = self._notif_data_objects[data]
+                    data_objects = self._notif_channels[notification]
                 except KeyError:
-                    self._notif_data_objects[data] = notifications = []
-                notifications.append(notification)
+                    data_objects = self._notif_channels[notification] = \
+                        weakref.WeakKeyDictionary()
+                data_objects[data] = True
             with_lock(self._notif_data_lock, lfunction)
             self._notif_register(notification)
+            PostgreSQLNotifier._pg_notification_hub().wakeup()
             if __debug__:
                 log(DEBUG, 'Notifikace zaregistrována')
 
+    class _PgRowCountCache(object):
+        """Process wide cache of the numbers of rows of selects.
+
+        The counts are stored under keys identifying the database, the table
+        and the select condition and arguments.  Each count depends on
+        notifications given as pairs (DATABASE_KEY, NOTIFICATION) and it is
+        discarded as soon as any of them is received or sent by the process.
+        Counts computed while an invalidation was in progress are not stored,
+        see 'generation()'.
+
+        """
+        def __init__(self):
+            self._lock = thread.allocate_lock()
+            self._counts = collections.OrderedDict()
+            self._dependencies = {}
+            self._generation = 0
+
+        def _remove(self, key):
+            count, dependencies = self._counts.pop(key)
+            for d in dependencies:
+                keys = self._dependencies[d]
+                keys.discard(key)
+                if not keys:
+                    del self._dependencies[d]
+
+        def generation(self):
+            """Return the current invalidation number to be passed to 'put()'."""
+            return self._generation
+
+        def get(self, key):
+            """Return the row count stored under 'key' or 'None'."""
+            def lfunction():
+                try:
+                    item = self._counts.pop(key)
+                except KeyError:
+                    return None
+                self._counts[key] = item
+                return item[0]
+            return with_lock(self._lock, lfunction)
+
+        def put(self, key, count, dependencies, generation, limit):
+            """Store 'count' under 'key' unless invalidated since 'generation'.
+
+            Arguments:
+
+              key -- hashable cache key
+              count -- the number of rows, integer
+              dependencies -- sequence of (DATABASE_KEY, NOTIFICATION) pairs
+              generation -- the value of 'generation()' before the count was
+                computed
+              limit -- maximum number of counts in the cache
+
+            """
+            def lfunction():
+                if generation != self._generation:
+                    return
+                if key in self._counts:
+                    self._remove(key)
+                self._counts[key] = (count, tuple(dependencies))
+                for d in dependencies:
+                    self._dependencies.setdefault(d, set()).add(key)
+                while len(self._counts) > limit:
+                    self._remove(next(iter(self._counts)))
+            with_lock(self._lock, lfunction)
+
+        def invalidate(self, dependencies):
+            """Discard all counts depending on any of 'dependencies'."""
+            def lfunction():
+                self._generation += 1
+                for d in dependencies:
+                    for key in list(self._dependencies.get(d, ())):
+                        self._remove(key)
+            with_lock(self._lock, lfunction)
+
+        def reset(self):
+            """Discard all counts."""
+            def lfunction():
+                self._generation += 1
+                self._counts.clear()
+                self._dependencies.clear()
+            with_lock(self._lock, lfunction)
+
+    _pg_row_count_cache = _PgRowCountCache()
+
+    @classmethod
+    def _pg_notification_hub(class_):
+        def lfunction():
+            if PostgreSQLNotifier._pg_notification_hub_ is None:
+                PostgreSQLNotifier._pg_notification_hub_ = PostgreSQLNotifier._PgNotificationHub()
+            return PostgreSQLNotifier._pg_notification_hub_
+        return with_lock(PostgreSQLNotifier._pg_notification_hub_lock, lfunction)
+
     def __init__(self, connection_data, **kwargs):
         """
         Argumenty:
@@ -952,24 +1172,74 @@ class PostgreSQLNotifier(PostgreSQLConnector):
         if config.dblisten:
             self._pg_add_notifications()
 
-    def _call_on_change_callbacks(self):
+    def _call_on_change_callbacks(self, changes=None):
         self._pg_changed = True
-        super(PostgreSQLNotifier, self)._call_on_change_callbacks()
+        super(PostgreSQLNotifier, self)._call_on_change_callbacks(changes)
+
+    def changes_notified(self):
+        import config
+        return bool(config.dblisten and self._pg_notifications)
+
+    def _pg_notification_changes(self, notifications):
+        """Return changes for 'add_callback_on_row_change()' callbacks.
+
+        'notifications' is a list of received notifications as pairs (NAME,
+        PAYLOAD).  Return a list of (OPERATION, KEY) pairs or 'None' if the
+        changed rows can't be determined.  In this class 'None' is always
+        returned.
+
+        """
+        return None
 
     def _pg_notifier_key(self, connection_data):
         d = connection_data
         return (d.host(), d.port(), d.database())
 
+    def _pg_row_count_dependencies(self):
+        key = self._pg_notifier_key(self._pg_connection_data())
+        return [(key, n) for n in self._pg_notifications]
+
+    def _pg_row_count_key(self, query):
+        """Return the row count cache key of counting 'query' or 'None'.
+
+        'None' is returned when the counts of this data object may not be
+        cached, i.e. when the cache is disabled or the changes of the data
+        are not announced by notifications.  The query arguments are numbered
+        differently in each query instance, so the key is made of the query
+        with positional arguments and their values.
+
+        """
+        import config
+        if not self.changes_notified() or config.row_count_cache_size <= 0:
+            return None
+        template, args = query.query()
+        names = re.findall(r'%\((\w+)\)s', template)
+        return (self._pg_notifier_key(self._pg_connection_data()),
+                re.sub(r'%\(\w+\)s', '%s', template),
+                tuple([repr(args[name]) for name in names]))
+
+    def _pg_cached_row_count(self, key):
+        if key is None:
+            return None
+        return self._pg_row_count_cache.get(key)
+
+    def _pg_cache_row_count(self, key, count, generation):
+        if key is not None:
+            import config
+            self._pg_row_count_cache.put(key, count, self._pg_row_count_dependencies(),
+                                         generation, config.row_count_cache_size)
+
     def _pg_add_notifications(self):
         notifications = self._pg_notifications
         if not notifications:
             return
         spec = self._pg_connection_data()
+        key = self._pg_notifier_key(spec)
         try:
-            notifier = PostgreSQLNotifier.NOTIFIERS[spec]
+            notifier = PostgreSQLNotifier.NOTIFIERS[key]
         except KeyError:
-            notifier = PostgreSQLNotifier.NOTIFIERS[spec] = \
-                self._PgNotifier(spec, connection_name=self._connection_name)
+            notifier = PostgreSQLNotifier.NOTIFIERS[key] = \
+                self._PgNotifier(spec, key, connection_name=self._connection_name)
         for n in notifications:
             notifier.register_notification(self, n)
 
@@ -1014,6 +1284,11 @@ class PostgreSQLStandardBindingHandler(PostgreSQLConnector, DBData):
     _pdbb_selection_counter_lock = thread.allocate_lock()
 
     _pdbb_table_column_data = {}
+    _pdbb_table_metadata_loaded = set()
+    _pdbb_table_metadata_lock = thread.allocate_lock()
+
+    _PDBB_TABLE_METADATA_VERSION = 1
+    """Version of the table metadata snapshot file format."""
 
     class _TableColumnData(object):
         def __init__(self, basic, default, unique):
@@ -1259,6 +1534,113 @@ class PostgreSQLStandardBindingHandler(PostgreSQLConnector, DBData):
         PostgreSQLStandardBindingHandler._pdbb_table_column_data[table_key] = table_data
         return table_data
 
+    def _pdbb_preload_table_metadata(self):
+        # Load column data of all tables of the current connection at once.
+        # Return true iff the data were loaded by this call.
+        connection_key = self._pdbb_unique_table_id(None)[1:]
+        class_ = PostgreSQLStandardBindingHandler
+        def lfunction():
+            if connection_key in class_._pdbb_table_metadata_loaded:
+                return False
+            class_._pdbb_table_metadata_loaded.add(connection_key)
+            try:
+                self._pdbb_load_table_metadata()
+            except DBException as e:
+                log(OPERATIONAL, "Table metadata preloading failed:", e)
+                return False
+            return True
+        return with_lock(class_._pdbb_table_metadata_lock, lfunction)
+
+    def _pdbb_load_table_metadata(self):
+        """Store column data of all tables of the configured schemas.
+
+        The data are retrieved by a single catalog query and stored in
+        '_pdbb_table_column_data' under both the qualified and the unqualified
+        table names.  If 'config.table_metadata_cache_file' is set, the data
+        are stored there and reused in the next application runs until the
+        database schema changes.  The schema changes are detected by comparing
+        a fingerprint of the catalog data computed on the server side, so
+        the full catalog data are transferred only when the snapshot is
+        missing or outdated.
+
+        """
+        import config
+        schemas = list(self._pg_connection_data().schemas() or ['public'])
+        host, port, database = self._pdbb_unique_table_id(None)[1:]
+        query = _Query(
+            ("select nspname, relname, attname, typname, atttypmod, attnotnull, "
+             "(select adsrc from pg_attrdef where adrelid = attrelid and adnum = attnum), "
+             "(select conkey from pg_constraint "
+             " where conrelid = attrelid and attnum = any (conkey) and "
+             " (contype = 'p' or contype = 'u') "
+             " order by array_length(conkey, 1) limit 1) "
+             "from pg_attribute "
+             "join pg_class on attrelid = pg_class.oid "
+             "join pg_namespace on relnamespace = pg_namespace.oid "
+             "join pg_type on atttypid = pg_type.oid "
+             "where nspname in (%(schemas)s) and relkind <> 'i' and attnum > 0 "
+             "order by nspname, relname, attnum"),
+            dict(schemas=_Query.join([sval(schema) for schema in schemas])))
+        cache_file = config.table_metadata_cache_file
+        snapshot_key = (host, port, database, tuple(schemas),)
+        tables = None
+        if cache_file:
+            fingerprint_query = _Query("select md5(string_agg(t::text, ',' order by t::text)) "
+                                       "from (%(query)s) as t", dict(query=query))
+            fingerprint = self._pg_query(fingerprint_query, outside_transaction=True)[0][0]
+            snapshots = self._pdbb_read_table_metadata_snapshots(cache_file)
+            snapshot = snapshots.get(snapshot_key)
+            if snapshot is not None and snapshot[0] == fingerprint:
+                tables = snapshot[1]
+        if tables is None:
+            tables = {}
+            for row in self._pg_query(query, outside_transaction=True):
+                schema, table, column, type_, size_string, not_null, default, unique = row
+                basic, defaults, uniques = tables.setdefault((schema, table), ([], [], []))
+                basic.append((column, type_, size_string, not_null))
+                if default is not None:
+                    defaults.append((column, default))
+                if unique is not None:
+                    uniques.append((column, unique))
+            if cache_file:
+                snapshots[snapshot_key] = (fingerprint, tables)
+                self._pdbb_write_table_metadata_snapshots(cache_file, snapshots)
+        table_column_data = PostgreSQLStandardBindingHandler._pdbb_table_column_data
+        # Unqualified table names refer to the table in the first schema
+        # containing it, so the tables must be processed in the schema order.
+        for schema, table in sorted(tables, key=lambda k: (schemas.index(k[0]), k[1])):
+            table_data = self._TableColumnData(*tables[(schema, table)])
+            for name in ('%s.%s' % (schema, table), table):
+                table_column_data.setdefault((name, host, port, database), table_data)
+
+    def _pdbb_read_table_metadata_snapshots(self, filename):
+        try:
+            f = open(filename, 'rb')
+            try:
+                version, snapshots = pickle.load(f)
+            finally:
+                f.close()
+        except (IOError, EOFError, ValueError, TypeError, pickle.UnpicklingError):
+            return {}
+        if version != self._PDBB_TABLE_METADATA_VERSION:
+            return {}
+        return snapshots
+
+    def _pdbb_write_table_metadata_snapshots(self, filename, snapshots):
+        # Write to a temporary file first to prevent concurrently running
+        # applications from reading an incomplete snapshot.
+        tmp_filename = '%s.%d' % (filename, os.getpid(),)
+        try:
+            f = open(tmp_filename, 'wb')
+            try:
+                pickle.dump((self._PDBB_TABLE_METADATA_VERSION, snapshots), f,
+                            pickle.HIGHEST_PROTOCOL)
+            finally:
+                f.close()
+            os.rename(tmp_filename, filename)
+        except (IOError, OSError) as e:
+            log(OPERATIONAL, "Can't save table metadata snapshot:", (filename, e,))
+
     def _pdbb_get_table_type(self, table, column, noerror=False):
         if self._pdbb_db_spec is not None:
             for b in self._bindings:
@@ -1266,6 +1648,8 @@ class PostgreSQLStandardBindingHandler(PostgreSQLConnector, DBData):
                     return b.type()
         table_key = self._pdbb_unique_table_id(table)
         table_data = PostgreSQLStandardBindingHandler._pdbb_table_column_data.get(table_key)
+        if table_data is None and self._pdbb_preload_table_metadata():
+            table_data = PostgreSQLStandardBindingHandler._pdbb_table_column_data.get(table_key)
         if table_data is None:
             table_data = self._pdbb_get_table_column_data(table)
         def lookup_column(data):
@@ -1692,7 +2076,7 @@ class PostgreSQLStandardBindingHandler(PostgreSQLConnector, DBData):
                     groupby=groupby, relation=relation_and_condition,
                     filter_condition=filter_condition, tables=table_list, ordering=ordering)
         template = ('select %(columns)s from %(tables)s '
-                    'where %(relation)s and %(filter_condition)s '
+                    'where %(relation)s and %(filter_condition)s and %(condition)s '
                     '%(groupby)s order by %(ordering)s %(supplement)s')
         self._pdbb_command_row = _Query(template, args)
         self._pdbb_command_distinct = _Query(
@@ -1732,6 +2116,13 @@ class PostgreSQLStandardBindingHandler(PostgreSQLConnector, DBData):
                  "order by %(distinct_ordering)s%(ordering)s %(std_ordering)s"),
                 args)
         self._pdbb_command_select = query % dict(inner_query=inner_query)
+        self._pdbb_command_estimate = (_Query('explain (format json) %(inner_query)s %(limit)s') %
+                                       dict(inner_query=inner_query))
+        self._pdbb_command_page = _Query('%(inner_query)s %(limit)s') % dict(inner_query=inner_query)
+        self._pdbb_command_count = (_Query('select count(*) from (%(inner_query)s) __pytis_count') %
+                                    dict(inner_query=inner_query))
+        self._pdbb_command_copy = (_Query('copy (%(inner_query)s) to stdout with (%(options)s)') %
+                                   dict(inner_query=inner_query))
         self._pdbb_command_dummy_select = _Query("declare %s scroll cursor for select 1 where false"
                                                  % (cursor_name,))
         self._pdbb_command_close_select = _Query('close %s' % (cursor_name,))
@@ -1761,11 +2152,15 @@ class PostgreSQLStandardBindingHandler(PostgreSQLConnector, DBData):
                                                   (cursor_name,))
         query = _Query(('select %(columns)s from %(main_table)s '
                         'where (%(relation)s) and %(filter_condition)s and %(condition)s '
-                        '%(groupby)s order by %(ordering)s %(search_ordering)s limit 1'),
+                        '%(groupby)s order by %(ordering)s %(search_ordering)s %(limit)s'),
                        dict(columns=column_list, relation=relation, groupby=groupby,
                             filter_condition=filter_condition, main_table=main_table_from))
-        self._pdbb_command_search_first = query % dict(search_ordering=ordering)
-        self._pdbb_command_search_last = query % dict(search_ordering=rordering)
+        self._pdbb_command_search_first = query % dict(search_ordering=ordering,
+                                                       limit=_Query('limit 1'))
+        self._pdbb_command_search_last = query % dict(search_ordering=rordering,
+                                                      limit=_Query('limit 1'))
+        self._pdbb_command_keyset_forward = query % dict(search_ordering=ordering)
+        self._pdbb_command_keyset_backward = query % dict(search_ordering=rordering)
         args = dict(relation=relation, filter_condition=filter_condition, columns=column_list,
                     key_column=first_key_column, main_table=main_table_from, groupby=groupby,
                     distinct=distinct_on, tables=table_list)
@@ -1794,6 +2189,8 @@ class PostgreSQLStandardBindingHandler(PostgreSQLConnector, DBData):
             args)
         self._pdbb_command_insert_alternative = _Query(
             'insert into %s (%%(columns)s) values (%%(values)s)' % (main_table,))
+        self._pdbb_command_insert_many = _Query(
+            'insert into %s (%%(columns)s) values %%(rows)s' % (main_table,))
         self._pdbb_command_insert_get_last = _Query(
             'select %%(key_column)s from %s order by %%(key_column)s desc limit 1' % (main_table,),
             args)
@@ -1831,6 +2228,24 @@ class PostgreSQLStandardBindingHandler(PostgreSQLConnector, DBData):
             'update %s set %%(settings)s%s where (%%(relation)s) and (%%(condition)s)' %
             (main_table, update_from_clause),
             args)
+        if update_from_tables:
+            self._pdbb_command_update_rows = None
+        else:
+            # The empty select from the table itself determines the column
+            # types of the values list, otherwise they may be unknown.  The
+            # rows are joined on all the key columns.
+            key_columns = [b.column() for b in self._key_binding]
+            key_select = string.join(['%s as __pytis_key%d' % (c, i)
+                                      for i, c in enumerate(key_columns)], ', ')
+            key_join = string.join(['%s.%s = __pytis_values.__pytis_key%d' % (main_table, c, i)
+                                    for i, c in enumerate(key_columns)], ' and ')
+            self._pdbb_command_update_rows = _Query(
+                ('update %s set %%(settings)s '
+                 'from (select %s, %%(columns)s from %s where false '
+                 'union all values %%(rows)s) as __pytis_values '
+                 'where (%%(relation)s) and %s') %
+                (main_table, key_select, main_table, key_join),
+                args)
         args['key_column'] = first_key_column
         self._pdbb_command_broken_update_preselect = _Query(
             'select count (%%(key_column)s) from %s where (%%(relation)s) and (%%(condition)s)' %
@@ -1849,7 +2264,10 @@ class PostgreSQLStandardBindingHandler(PostgreSQLConnector, DBData):
         self._pdbb_command_refresh = _Query('refresh materialized view %s' % (main_table,))
         self._pdbb_command_isolation = _Query('set transaction isolation level %(isolation)s'
                                               '%(read_only)s')
-        self._pdbb_command_notify = _Query('notify "__modif_%s"' % (main_table.lower(),))
+        self._pg_main_notification = '__modif_%s' % (main_table.lower(),)
+        self._pdbb_command_notify = _Query('notify "%s"' % (self._pg_main_notification,))
+        self._pdbb_command_notify_payload = \
+            _Query("select pg_notify('%s', %%(payload)s)" % (self._pg_main_notification,))
         self._pg_notifications = map(lambda t: '__modif_%s' % (t.lower(),), table_names)
 
     def _pdbb_condition2sql(self, condition):
@@ -1942,6 +2360,12 @@ class PostgreSQLStandardBindingHandler(PostgreSQLConnector, DBData):
         elif op_name == 'AND' or op_name == 'OR':
             if not op_args:
                 expression = _Query('true' if op_name == 'AND' else 'false')
+            elif op_name == 'OR' and self._pdbb_value_list_condition(op_args):
+                # OR of equalities on a single column (typically ANY_OF) is
+                # sent as `IN' to keep the query small and easy to plan.
+                a, t = colarg(op_args[0].args()[0])
+                values = [self._pdbb_coalesce(t, arg.args()[1]) for arg in op_args]
+                expression = a + ' in (' + _Query.join(values) + ')'
             else:
                 assert not filter(lambda a: a and not isinstance(a, Operator),
                                   op_args), \
@@ -1983,6 +2407,27 @@ class PostgreSQLStandardBindingHandler(PostgreSQLConnector, DBData):
             raise ProgramError('Unknown operator', op_name)
         return expression.wrap()
 
+    def _pdbb_value_list_condition(self, op_args):
+        if len(op_args) < 2:
+            return False
+        column = None
+        for arg in op_args:
+            if ((not isinstance(arg, Operator) or arg.name() != 'EQ' or
+                 arg.kwargs().get('ignore_case'))):
+                return False
+            col, value = arg.args()
+            if not isinstance(col, basestring) or not isinstance(value, Value):
+                return False
+            if column is None:
+                column = col
+                if isinstance(self.find_column(col).type(), Binary):
+                    return False
+            elif col != column:
+                return False
+            if value.value() is None:
+                return False
+        return True
+
     def _pdbb_sort2sql(self, sort):
         function_column_dict = {}
         for g in (self._pdbb_column_groups or []):
@@ -2014,8 +2459,11 @@ class PostgreSQLStandardBindingHandler(PostgreSQLConnector, DBData):
             sort_string += ','
         return sort_string
 
-    def _pdbb_limit2sql(self, limit):
-        return _Query('' if limit is None else 'limit %d' % (limit,))
+    def _pdbb_limit2sql(self, limit, offset=0):
+        query = '' if limit is None else 'limit %d' % (limit,)
+        if offset:
+            query += ' offset %d' % (offset,)
+        return _Query(query)
 
     def _pdbb_fulltext_query_name(self, column_name):
         return '_pytis_ftq__%s' % (column_name,)
@@ -2102,16 +2550,76 @@ class PostgreSQLStandardBindingHandler(PostgreSQLConnector, DBData):
                 call_arguments.append(arg_value)
             args[self._arguments_arg] = _Query.join(call_arguments)
 
-    def _pg_row(self, key_value, columns, transaction=None, supplement='', arguments={}):
-        """Retrieve and return raw data corresponding to 'key_value'."""
+    def _pg_row(self, key_value, columns, transaction=None, supplement='', arguments={},
+                condition=None):
+        """Retrieve and return raw data corresponding to 'key_value'.
+
+        If 'condition' is given, the row is returned only if it also satisfies
+        the condition.
+
+        """
         args = dict(key=key_value, supplement=_Query(supplement))
+        if condition is not None:
+            args['condition'] = self._pdbb_condition2sql(condition).wrap()
         if columns:
             args['columns'] = self._pdbb_sql_column_list_from_names(
                 columns, operations=self._pdbb_operations,
                 column_groups=self._pdbb_column_groups)
         self._pg_make_arguments(args, arguments)
         query = self._pdbb_command_row.update(args)
-        return self._pg_query(query, transaction=transaction)
+        return self._pg_query(query, transaction=transaction, prepare=True)
+
+    def _pg_sorting_condition(self, sorting, direction, forwards, row, mayeq):
+        """Return condition selecting rows beyond 'row' in given sorting.
+
+        Arguments:
+
+          sorting -- sequence of (COLUMN_ID, DIRECTION) pairs, already reversed
+            when moving in the BACKWARD 'direction'; the key columns are
+            appended to it automatically to make the ordering unique
+          direction -- 'FORWARD' or 'BACKWARD', direction of the movement
+          forwards -- iff true, 'row' is the row we stand on and the condition
+            selects all the rows in the movement 'direction'; otherwise 'row' is
+            the row found and the condition selects all the rows in the
+            opposite direction
+          row -- the boundary 'Row' instance, containing all the sorting and
+            key columns, or 'None' (in which case 'None' is returned)
+          mayeq -- iff true, 'row' itself satisfies the condition as well
+
+        """
+        if row is None:
+            return None
+        sdirection = ecase(direction,
+                           (FORWARD, ASCENDENT),
+                           (BACKWARD, DESCENDANT))
+        sorting = (tuple(sorting) +
+                   tuple(map(lambda c: (c.id(), sdirection), self.key())))
+        processed = []
+        conditions = []
+        for cid, dir in sorting:
+            if cid in processed:
+                continue
+            conds = [EQ(c, row[c]) for c in processed]
+            if (forwards and dir == ASCENDENT) or (not forwards and dir == DESCENDANT):
+                relop = GT
+            else:
+                relop = LT
+            if row[cid].value() is None:
+                if relop is LT:
+                    conds.append(NE(cid, row[cid]))
+            else:
+                neq = relop(cid, row[cid], ignore_case=False)
+                if relop is GT:
+                    nullval = Value(row[cid].type(), None)
+                    neq = OR(neq, EQ(cid, nullval))
+                conds.append(neq)
+            if conds:
+                conditions.append(AND(*conds))
+            processed.append(cid)
+        if mayeq:
+            eqs = [EQ(c, row[c], ignore_case=False) for c in processed]
+            conditions.append(AND(*eqs))
+        return OR(*conditions)
 
     def _pg_search(self, row, condition, direction, transaction=None, arguments={}):
         if transaction is None:
@@ -2123,49 +2631,10 @@ class PostgreSQLStandardBindingHandler(PostgreSQLConnector, DBData):
             sorting = reversed_sorting(sorting)
         else:
             raise ProgramError('Invalid direction', direction)
-        def sorting_condition(sorting, forwards, row, mayeq):
-            # - forwards je True:
-            #   pak je row řádek, na kterém stojíme a hledáme všechny řádky
-            #   v směru pohybu vyhledávání
-            # - forwards je False:
-            #   pak je row řádek vyhledávaný řádek a hledáme všechny řádky,
-            #   které jsou v protisměru pohybu vyhledávání.
-            if row is None:
-                return None
-            sdirection = ecase(direction,
-                               (FORWARD, ASCENDENT),
-                               (BACKWARD, DESCENDANT))
-            sorting = (tuple(sorting) +
-                       tuple(map(lambda c: (c.id(), sdirection), self.key())))
-            processed = []
-            conditions = []
-            for cid, dir in sorting:
-                if cid in processed:
-                    continue
-                conds = [EQ(c, row[c]) for c in processed]
-                if (forwards and dir == ASCENDENT) or (not forwards and dir == DESCENDANT):
-                    relop = GT
-                else:
-                    relop = LT
-                if row[cid].value() is None:
-                    if relop is LT:
-                        conds.append(NE(cid, row[cid]))
-                else:
-                    neq = relop(cid, row[cid], ignore_case=False)
-                    if relop is GT:
-                        nullval = Value(row[cid].type(), None)
-                        neq = OR(neq, EQ(cid, nullval))
-                    conds.append(neq)
-                if conds:
-                    conditions.append(AND(*conds))
-                processed.append(cid)
-            if mayeq:
-                eqs = [EQ(c, row[c], ignore_case=False) for c in processed]
-                conditions.append(AND(*eqs))
-            return OR(*conditions)
+        sorting_condition = self._pg_sorting_condition
         select_cond = self._pg_last_select_condition
         common_cond = AND(select_cond,
-                          sorting_condition(sorting, True, row, False))
+                          sorting_condition(sorting, direction, True, row, False))
         sort_string = self._pdbb_sort2sql(sorting)
         # Najdi první řádek splňující požadovanou podmínku
         search_cond = AND(common_cond, condition)
@@ -2188,7 +2657,7 @@ class PostgreSQLStandardBindingHandler(PostgreSQLConnector, DBData):
         row_found = self._pg_make_row_from_raw_data(
             data_, template=self._pg_make_row_template_limited)
         search_cond = AND(common_cond,
-                          sorting_condition(sorting, False,
+                          sorting_condition(sorting, direction, False,
                                             row_found, True))
         cond_string = self._pdbb_condition2sql(search_cond)
         args = dict(condition=cond_string)
@@ -2314,13 +2783,20 @@ class PostgreSQLStandardBindingHandler(PostgreSQLConnector, DBData):
                 return new_thread
             def pg_correct(self, correction):
                 self._pg_correction += correction
-        def __init__(self, data, transaction, selection, position):
+        def __init__(self, data, transaction, selection, position, estimate=None):
             self._thread = self._Thread(data, 0, transaction, selection, position)
+            self._estimate = estimate
         def start(self):
             self._thread.start()
-        def count(self, min_value=None, timeout=None, corrected=False):
-            result = self._thread.pg_count(min_value, timeout, corrected)
-            return result
+        def count(self, min_value=None, timeout=None, corrected=False, estimated=False):
+            count, finished = self._thread.pg_count(min_value, timeout, corrected)
+            if estimated and not finished and self._estimate is not None:
+                # The estimate is only an approximation, so it may be both
+                # lower and higher than the final number of rows.
+                count = max(count, self._estimate)
+            return count, finished
+        def estimate(self):
+            return self._estimate
         def stop(self):
             self._thread.pg_stop()
         def restart(self):
@@ -2329,11 +2805,49 @@ class PostgreSQLStandardBindingHandler(PostgreSQLConnector, DBData):
             self._thread.pg_correct(correction)
             return self
 
-    def _pg_start_row_counting_thread(self, transaction, selection):
-        t = self._PgRowCounting(self, transaction, selection, self._pg_buffer.dbpointer)
+    def _pg_start_row_counting_thread(self, transaction, selection, estimate=None):
+        t = self._PgRowCounting(self, transaction, selection, self._pg_buffer.dbpointer,
+                                estimate=estimate)
         t.start()
         return t
 
+    def _pg_estimate_row_count(self, args, transaction):
+        # Return the number of select rows as estimated by the query planner
+        # (i.e. from the table statistics, without scanning the table) or
+        # 'None' if the estimate is not available.
+        data = self._pg_query(self._pdbb_command_estimate.update(args), transaction=transaction)
+        try:
+            plan = data[0][0]
+            if isinstance(plan, basestring):
+                plan = json.loads(plan)
+            return max(int(plan[0]['Plan']['Plan Rows']), 0)
+        except (IndexError, KeyError, TypeError, ValueError):
+            return None
+
+    def _pg_select_args(self, condition, sort, arguments, limit=None, offset=0):
+        # Return the query arguments common to select commands.
+        cond_string = self._pdbb_condition2sql(condition)
+        sort_string = self._pdbb_sort2sql(sort)
+        limit_string = self._pdbb_limit2sql(limit, offset=offset)
+        args = {'condition': cond_string, 'ordering': sort_string, 'limit': limit_string}
+        fulltext_queries = [_Query('')]
+        if condition:
+            def find_fulltext(op):
+                if op.name() == 'FT':
+                    index_column = op.args()[0]
+                    query = op.args()[1]
+                    fulltext_queries[0] += (",to_tsquery('%s') as %s" %
+                                            (query,
+                                             self._pdbb_fulltext_query_name(index_column),))
+                elif op.logical():
+                    for a in op.args():
+                        if isinstance(a, pytis.data.Operator):
+                            find_fulltext(a)
+            find_fulltext(condition)
+        args['fulltext_queries'] = fulltext_queries[0]
+        self._pg_make_arguments(args, arguments)
+        return args
+
     def _pg_select(self, condition, sort, columns, arguments={}, transaction=None,
                    async_count=False, stop_check=None, limit=None):
         """Initiate select and return the number of its lines or 'None'.
@@ -2349,7 +2863,10 @@ class PostgreSQLStandardBindingHandler(PostgreSQLConnector, DBData):
           async_count -- if true, count result lines asynchronously and return
             a '_PgRowCounting' instance instead of the number of lines;
             this is useful on large tables where row counting may take
-            significant amount of time
+            significant amount of time.  If the configuration option
+            'row_count_estimate' is set, the instance of an unfiltered select
+            also provides the planner's estimate of the number of lines until
+            the counting is finished.
           stop_check -- if not 'None' then it is a function to be called
             periodically, during some long taking operations, with the single
             argument passing start time of the long operation as returned by
@@ -2360,26 +2877,7 @@ class PostgreSQLStandardBindingHandler(PostgreSQLConnector, DBData):
           limit -- maximum number of rows
 
         """
-        cond_string = self._pdbb_condition2sql(condition)
-        sort_string = self._pdbb_sort2sql(sort)
-        limit_string = self._pdbb_limit2sql(limit)
-        args = {'condition': cond_string, 'ordering': sort_string, 'limit': limit_string}
-        fulltext_queries = [_Query('')]
-        if condition:
-            def find_fulltext(op):
-                if op.name() == 'FT':
-                    index_column = op.args()[0]
-                    query = op.args()[1]
-                    fulltext_queries[0] += (",to_tsquery('%s') as %s" %
-                                            (query,
-                                             self._pdbb_fulltext_query_name(index_column),))
-                elif op.logical():
-                    for a in op.args():
-                        if isinstance(a, pytis.data.Operator):
-                            find_fulltext(a)
-            find_fulltext(condition)
-        args['fulltext_queries'] = fulltext_queries[0]
-        self._pg_make_arguments(args, arguments)
+        args = self._pg_select_args(condition, sort, arguments, limit=limit)
         connections = self._pg_connections()
         if connections and connections[-1].connection_info('broken') and transaction is None:
             # Current connection is broken, maybe after database server
@@ -2403,9 +2901,27 @@ class PostgreSQLStandardBindingHandler(PostgreSQLConnector, DBData):
         dummy_select = (self._arguments is not None and arguments is self.UNKNOWN_ARGUMENTS)
         command = self._pdbb_command_dummy_select if dummy_select else self._pdbb_command_select
         transaction_ = self._pg_select_transaction if transaction is None else transaction
+        if transaction is None and limit is None and not dummy_select:
+            count_key = self._pg_row_count_key_from_args(args)
+        else:
+            count_key = None
+        self._pg_row_count_pending = (count_key, self._pg_row_count_cache.generation())
+        cached_count = self._pg_cached_row_count(count_key)
         self._pg_query(command.update(args), transaction=transaction_)
-        if async_count:
-            result = self._pg_start_row_counting_thread(transaction_, args['selection'])
+        if cached_count is not None:
+            result = cached_count
+        elif async_count:
+            import config
+            # The planner's statistics may be far off for filtered selects
+            # (and never estimate less than one row), so the estimate is only
+            # used for unfiltered selects.
+            if ((config.row_count_estimate and not dummy_select and condition is None and
+                 self._condition is None and not self._distinct_on)):
+                estimate = self._pg_estimate_row_count(args, transaction_)
+            else:
+                estimate = None
+            result = self._pg_start_row_counting_thread(transaction_, args['selection'],
+                                                        estimate=estimate)
         elif stop_check is not None:
             # Allow stop_check even when sync count is requested.
             counting_thread = self._pg_start_row_counting_thread(transaction_, args['selection'])
@@ -2419,9 +2935,17 @@ class PostgreSQLStandardBindingHandler(PostgreSQLConnector, DBData):
                 result = int(data[0][-1])
             else:
                 result = 0
+        if isinstance(result, int):
+            self._pg_cache_row_count(count_key, result, self._pg_row_count_pending[1])
         self._pdbb_select_rows = result
         return result
 
+    def _pg_row_count_key_from_args(self, args):
+        # The count doesn't depend on the selected columns and sorting.
+        args = dict(args, ordering=self._pdbb_sort2sql(()))
+        args.pop('columns', None)
+        return self._pg_row_count_key(self._pdbb_command_count.update(args))
+
     def _pg_distinct(self, column, prefix, condition, sort, transaction=None,
                      arguments={}):
         cond_string = self._pdbb_condition2sql(condition)
@@ -2445,36 +2969,39 @@ class PostgreSQLStandardBindingHandler(PostgreSQLConnector, DBData):
         return result
 
     def _pg_select_aggregate(self, operation, colids, condition, transaction=None, arguments={}):
+        return self._pg_select_aggregates([(operation, cid) for cid in colids], condition,
+                                          transaction=transaction, arguments=arguments)
+
+    def _pg_select_aggregates(self, operations, condition, transaction=None, arguments={}):
         if __debug__:
-            if operation != self.AGG_COUNT:
-                if operation in (self.AGG_MIN, self.AGG_MAX):
-                    allowed = (Number, DateTime, String)
-                else:
-                    allowed = Number
-                for cid in colids:
+            for operation, cid in operations:
+                if operation != self.AGG_COUNT:
+                    if operation in (self.AGG_MIN, self.AGG_MAX):
+                        allowed = (Number, DateTime, String)
+                    else:
+                        allowed = Number
                     t = self.find_column(cid).type()
                     assert isinstance(t, allowed), (operation, cid, t, allowed,)
-        close_select = False
-        if self._pg_select_transaction is None:
-            self.select(condition=condition, transaction=transaction)
-            close_select = True
+        if not operations:
+            return []
+        # The query runs within the current select transaction if there is
+        # any, so the results correspond to the selected rows.  Otherwise it
+        # runs on its own, there is no need to open a select for it.
         try:
-            data = self._pg_select_aggregate_1(operation, colids, condition,
+            data = self._pg_select_aggregate_1(operations, condition,
                                                transaction=transaction, arguments=arguments)
         except:
             cls, e, tb = sys.exc_info()
-            try:
-                if transaction is None:
+            if transaction is None and self._pg_select_transaction is not None:
+                try:
                     self._pg_select_transaction.rollback()
-            except:
-                pass
-            self._pg_select_transaction = None
+                except:
+                    pass
+                self._pg_select_transaction = None
             raise cls, e, tb
-        if close_select:
-            self.close()
         I = Integer()
         F = Float()
-        def make_value(cid, dbvalue):
+        def make_value(operation, cid, dbvalue):
             if operation == self.AGG_COUNT:
                 t = I
             elif operation == self.AGG_AVG:
@@ -2482,8 +3009,8 @@ class PostgreSQLStandardBindingHandler(PostgreSQLConnector, DBData):
             else:
                 t = self.find_column(cid).type()
             return Value(t, dbvalue)
-        result = [make_value(cid, data[0][i]) for i, cid in enumerate(colids)]
-        return result
+        return [make_value(operation, cid, data[0][i])
+                for i, (operation, cid) in enumerate(operations)]
 
     def _pg_aggregate_name(self, operation):
         FMAPPING = {self.AGG_MIN: 'min',
@@ -2498,11 +3025,11 @@ class PostgreSQLStandardBindingHandler(PostgreSQLConnector, DBData):
             raise ProgramError('Invalid aggregate function identifier',
                                operation)
 
-    def _pg_select_aggregate_1(self, operation, colids, condition, transaction=None, arguments={}):
+    def _pg_select_aggregate_1(self, operations, condition, transaction=None, arguments={}):
         cond_string = self._pdbb_condition2sql(condition)
-        colnames = [self._pdbb_btabcol(self._db_column_binding(cid)) for cid in colids]
-        function = self._pg_aggregate_name(operation)
-        function_list = [_QFunction(function, (cname,)) for cname in colnames]
+        function_list = [_QFunction(self._pg_aggregate_name(operation),
+                                    (self._pdbb_btabcol(self._db_column_binding(cid)),))
+                         for operation, cid in operations]
         function_string = _Query.join(function_list)
         args = dict(columns=function_string, condition=cond_string)
         if arguments:
@@ -2588,7 +3115,7 @@ class PostgreSQLStandardBindingHandler(PostgreSQLConnector, DBData):
         try:
             key_data = self._pg_query(
                 self._pdbb_command_insert.update(dict(columns=columns, values=values)),
-                backup=True, transaction=transaction)
+                backup=True, transaction=transaction, prepare=True)
             key_row = self._pg_make_row_from_raw_data(
                 key_data, template=(self._pg_make_row_template[0],))
             key = key_row[0]
@@ -2597,7 +3124,7 @@ class PostgreSQLStandardBindingHandler(PostgreSQLConnector, DBData):
             self._pg_query(_Query("rollback to _insert"), transaction=transaction)
             self._pg_query(
                 self._pdbb_command_insert_alternative.update(dict(columns=columns, values=values)),
-                backup=True, transaction=transaction)
+                backup=True, transaction=transaction, prepare=True)
             try:
                 key = row[self._key_binding[0].id()]
             except KeyError:
@@ -2640,18 +3167,14 @@ class PostgreSQLStandardBindingHandler(PostgreSQLConnector, DBData):
                 return int(d[0][0])
             except:
                 raise DBSystemException('Unexpected UPDATE result', None, d)
-        try:
-            broken = self._pdbb_broken_update_result
-        except AttributeError:
-            broken = self._pdbb_broken_update_result = \
-                self._pg_query(self._pdbb_command_test_broken_update, transaction=transaction)
+        broken = self._pg_broken_update_result(transaction)
         if broken:
             q = self._pdbb_command_broken_update_preselect.update(dict(condition=cond_query))
             d = self._pg_query(q, transaction=transaction)
             result = extract_result(d)
         d = self._pg_query(self._pdbb_command_update.update(dict(settings=settings,
                                                                  condition=cond_query)),
-                           backup=True, transaction=transaction)
+                           backup=True, transaction=transaction, prepare=True)
         if not broken:
             result = extract_result(d)
         if result >= 0:
@@ -2659,6 +3182,79 @@ class PostgreSQLStandardBindingHandler(PostgreSQLConnector, DBData):
         else:
             raise DBSystemException('Unexpected UPDATE value', None, result)
 
+    def _pg_broken_update_result(self, transaction=None):
+        # Return true iff UPDATE on the table doesn't return the number of
+        # updated rows due to INSTEAD rules.
+        try:
+            broken = self._pdbb_broken_update_result
+        except AttributeError:
+            broken = self._pdbb_broken_update_result = \
+                self._pg_query(self._pdbb_command_test_broken_update, transaction=transaction)
+        return broken
+
+    def _pg_insert_many(self, rows, transaction=None):
+        """Vlož 'rows' vícenásobnými příkazy INSERT a vrať počet vložených řádků.
+
+        Consecutive rows containing the same columns are inserted by a single
+        INSERT command with multiple rows in its VALUES list.
+
+        """
+        def insert(columns, values):
+            if values:
+                args = dict(columns=_Query.join(columns), rows=_Query.join(values))
+                self._pg_query(self._pdbb_command_insert_many.update(args), backup=True,
+                               transaction=transaction)
+            return len(values)
+        result = 0
+        columns, values = None, []
+        for row in rows:
+            cols, vals = self._pdbb_table_row_lists(row)
+            if cols != columns or len(values) >= self._PG_BATCH_SIZE:
+                result += insert(columns, values)
+                columns, values = cols, []
+            values.append(_Query.join(vals).wrap())
+        result += insert(columns, values)
+        return result
+
+    def _pg_update_rows(self, pairs, transaction=None):
+        """Updatuj řádky podle dvojic (KEY, ROW) z 'pairs'.
+
+        Consecutive rows updating the same columns are updated by a single
+        UPDATE command joining the table with the list of the new values.
+
+        Vrací: Počet updatovaných řádků.
+
+        """
+        def update(columns, values):
+            if not values:
+                return 0
+            settings = _Query.join(['%s = __pytis_values.%s' % (c, c,) for c in columns])
+            args = dict(settings=settings, columns=_Query.join(columns),
+                        rows=_Query.join(values))
+            d = self._pg_query(self._pdbb_command_update_rows.update(args), backup=True,
+                               transaction=transaction)
+            try:
+                return int(d[0][0])
+            except:
+                raise DBSystemException('Unexpected UPDATE result', None, d)
+        result = 0
+        columns, values, keys = None, [], set()
+        for key, row in pairs:
+            key = xtuple(key)
+            key_values = tuple([k.value() for k in key])
+            cols, vals = self._pdbb_table_row_lists(row)
+            if not cols:
+                continue
+            # A row may be updated only once in a single UPDATE command.
+            if ((cols != columns or len(values) >= self._PG_BATCH_SIZE or
+                 key_values in keys)):
+                result += update(columns, values)
+                columns, values, keys = cols, [], set()
+            values.append(_Query.join(list(key) + vals).wrap())
+            keys.add(key_values)
+        result += update(columns, values)
+        return result
+
     def _pg_delete(self, condition, transaction=None):
         """Smaž řádek identifikovaný podmínkou 'condition'.
 
@@ -2667,7 +3263,7 @@ class PostgreSQLStandardBindingHandler(PostgreSQLConnector, DBData):
         """
         sql_condition = self._pdbb_condition2sql(condition)
         d = self._pg_query(self._pdbb_command_delete.update(dict(condition=sql_condition)),
-                           backup=True, transaction=transaction)
+                           backup=True, transaction=transaction, prepare=True)
         try:
             result = int(d[0][0])
         except:
@@ -2677,9 +3273,67 @@ class PostgreSQLStandardBindingHandler(PostgreSQLConnector, DBData):
         else:
             raise DBSystemException('Unexpected DELETE value', None, result)
 
-    def _pg_send_notifications(self):
-        """Rozešli notifikace o modifikaci tohoto datového objektu."""
-        self._pg_query(self._pdbb_command_notify, outside_transaction=True)
+    def _pg_send_notifications(self, operation=None, key=None):
+        """Rozešli notifikace o modifikaci tohoto datového objektu.
+
+        Jsou-li zadány argumenty 'operation' (jeden z řetězců 'INSERT',
+        'UPDATE', 'DELETE') a 'key' (klíč změněného řádku), jsou příjemcům
+        předány spolu s notifikací.
+
+        """
+        payload = self._pg_notification_payload(operation, key)
+        if payload is None:
+            query = self._pdbb_command_notify
+        else:
+            query = self._pdbb_command_notify_payload % dict(payload=sval(payload))
+        self._pg_query(query, outside_transaction=True)
+
+    def _pg_notification_key_type(self):
+        # Return the key type if keys may be passed in notifications, None
+        # otherwise.
+        key = self.key()
+        if len(key) == 1 and isinstance(key[0].type(), (Integer, String)):
+            return key[0].type()
+        else:
+            return None
+
+    def _pg_notification_payload(self, operation, key):
+        # The payload has the form OPERATION:KEY, the same as the payload sent
+        # by the `log_trigger' database function.
+        if operation is None or key is None or self._pg_notification_key_type() is None:
+            return None
+        if is_sequence(key):
+            key = key[0]
+        value = key.value()
+        if value is None:
+            return None
+        elif not isinstance(value, basestring):
+            value = str(value)
+        return operation + ':' + value
+
+    def _pg_notification_changes(self, notifications):
+        key_type = self._pg_notification_key_type()
+        if key_type is None:
+            return None
+        changes = []
+        for name, payload in notifications:
+            if name != self._pg_main_notification:
+                # Change of another table of the data object.
+                return None
+            operation, __, key = (payload or '').partition(':')
+            if operation not in ('INSERT', 'UPDATE', 'DELETE') or not key:
+                return None
+            try:
+                if isinstance(key_type, Integer):
+                    value = int(key)
+                elif isinstance(key, unicode):
+                    value = key
+                else:
+                    value = unicode(key, 'utf-8')
+            except (ValueError, UnicodeDecodeError):
+                return None
+            changes.append((operation, Value(key_type, value)))
+        return changes
 
 
 class DBDataPostgreSQL(PostgreSQLStandardBindingHandler, PostgreSQLNotifier):
@@ -2692,15 +3346,29 @@ class DBDataPostgreSQL(PostgreSQLStandardBindingHandler, PostgreSQLNotifier):
     # TODO: Tato třída je mamut a měla by být rozdělena na několik menších částí
 
     _PG_LOCK_TABLE = '_rowlocks_real'
+    _PG_BATCH_SIZE = 500
     _PG_LOCK_TABLE_LOCK = '_rowlocks_real'
     _PG_LOCK_TIMEOUT = 30         # perioda updatu v sekundách
 
-    class _PgBuffer:
-        # Dříve to býval buffer, nyní se přeměňuje na "buffer-cache".
+    class _PgBuffer(object):
+        # Dříve to býval buffer, nyní je to "buffer-cache" stránek řádků.
+        #
+        # Rows are stored in pages of _PAGE_SIZE rows keyed by the page number,
+        # i.e. the position of the row in the database cursor divided by the
+        # page size.  The pages are kept in LRU order and the least recently
+        # used ones are discarded when the number of cached rows exceeds
+        # config.cache_size or their estimated size exceeds
+        # config.cache_memory_limit.  The page of the current position and its
+        # neighbors are never discarded.
+
+        _PAGE_SIZE = 128
+        # Estimated size of a 'Value' instance in bytes, excluding its value.
+        _VALUE_OVERHEAD = 350
 
         def __init__(self):
             if __debug__:
                 log(DEBUG, 'Nový buffer')
+            self._hits = self._misses = 0
             self.reset()
 
         def _number_of_rows(self, row_count_info, min_value=None):
@@ -2714,32 +3382,113 @@ class DBDataPostgreSQL(PostgreSQLStandardBindingHandler, PostgreSQLNotifier):
             """Kompletně resetuj buffer."""
             if __debug__:
                 log(DEBUG, 'Resetuji buffer')
-            self._buffer = []
+            # _pages ... page number -> [ROWS, NUMBER_OF_ROWS, SIZE], in LRU
+            #   order; ROWS is a list of rows or Nones for rows not present
             # _dbpointer ... pozice ukazovátka kursoru v databázi, na který
             #   prvek kursoru počínaje od 0 ukazuje
-            # _dbposition ... pozice začátku bufferu v databázi, číslo prvku
-            #   kurzoru počínaje 0, který odpovídá prvnímu prvku bufferu
-            # _pointer ... pozice ukazovátka v bufferu, ukazuje na poslední
-            #   přečtený prvek, nemusí vždy ukazovat dovnitř bufferu
-            self._dbposition = 0
-            self._dbpointer = self._pointer = -1
+            # _position ... pozice posledního přečteného prvku v databázi,
+            #   nemusí vždy ukazovat na prvek přítomný v bufferu
+            self._pages = collections.OrderedDict()
+            self._last_page = None
+            self._rows = 0
+            self._bytes = 0
+            self._dbpointer = self._position = -1
+
+        def _row(self, position):
+            if position < 0:
+                return None
+            page_number, index = divmod(position, self._PAGE_SIZE)
+            page = self._pages.get(page_number)
+            if page is None:
+                return None
+            row = page[0][index]
+            if row is not None and page_number != self._last_page:
+                # Move the page to the end of the LRU order.
+                del self._pages[page_number]
+                self._pages[page_number] = page
+                self._last_page = page_number
+            return row
+
+        def _row_size(self, rows):
+            # Rough estimate of the average row size, computed from a few
+            # sample rows.
+            samples = rows[0], rows[len(rows) / 2], rows[-1]
+            size = 0
+            for row in samples:
+                size += sys.getsizeof(row)
+                for value in row:
+                    size += self._VALUE_OVERHEAD + sys.getsizeof(value.value())
+            return size / len(samples)
+
+        def _store(self, rows, start):
+            page_size = self._PAGE_SIZE
+            row_size = self._row_size(rows)
+            pages = self._pages
+            page_number = page = None
+            for position, row in enumerate(rows, start):
+                if position < 0:
+                    continue
+                n, index = divmod(position, page_size)
+                if n != page_number:
+                    page_number = n
+                    page = pages.get(n)
+                    if page is None:
+                        page = pages[n] = [[None] * page_size, 0, 0]
+                page_rows = page[0]
+                if page_rows[index] is None:
+                    page[1] += 1
+                    page[2] += row_size
+                    self._rows += 1
+                    self._bytes += row_size
+                page_rows[index] = row
+
+        def _evict(self, protected):
+            import config
+            max_rows = config.cache_size
+            max_bytes = config.cache_memory_limit
+            def full():
+                return (self._rows > max_rows or
+                        max_bytes is not None and self._bytes > max_bytes)
+            if not full():
+                return
+            current_page = max(self._position, 0) / self._PAGE_SIZE
+            protected = protected | set((current_page - 1, current_page, current_page + 1,))
+            for page_number in self._pages.keys():
+                if page_number not in protected:
+                    __, n, size = self._pages.pop(page_number)
+                    self._rows -= n
+                    self._bytes -= size
+                    if not full():
+                        break
+            self._last_page = None
+
+        def find(self, column_id, value):
+            """Return (POSITION, ROW) pairs of buffered rows having 'value' in 'column_id'."""
+            result = []
+            page_size = self._PAGE_SIZE
+            for page_number, page in self._pages.items():
+                for index, row in enumerate(page[0]):
+                    if row is not None and row[column_id].value() == value:
+                        result.append((page_number * page_size + index, row))
+            return result
+
+        def replace(self, position, row):
+            """Replace the buffered row at 'position' by 'row'."""
+            page_number, index = divmod(position, self._PAGE_SIZE)
+            page = self._pages.get(page_number)
+            if page is not None and page[0][index] is not None:
+                page[0][index] = row
 
         def current(self):
             """Vrať aktuální řádek a jeho pozici v databázi počínaje od 0.
 
             Výsledek je vrácen jako dvojice (ROW, POSITION).  Je-li aktuální
             řádek mimo buffer, je ROW 'None'.  Je-li aktuální pozice mimo
-            buffer, je POSITION je -1 nebo počet řádků selectu.
+            data, je POSITION je -1 nebo počet řádků selectu.
 
             """
-            buffer = self._buffer
-            pointer = self._pointer
-            position = self._dbposition + pointer
-            if pointer < 0 or pointer >= len(buffer):
-                row = None
-            else:
-                row = buffer[pointer]
-            return row, position
+            position = self._position
+            return self._row(position), position
 
         def fetch(self, direction, row_count_info):
             """Vrať řádek nebo 'None' a updatuj ukazovátka.
@@ -2748,32 +3497,31 @@ class DBDataPostgreSQL(PostgreSQLStandardBindingHandler, PostgreSQLNotifier):
             následné volání metod 'correction()' a 'fill()'.
 
             """
-            buffer = self._buffer
-            pointer = self._pointer
             if direction == FORWARD:
-                pointer += 1
+                pos = self._position + 1
             elif direction == BACKWARD:
-                pointer -= 1
+                pos = self._position - 1
             else:
                 raise ProgramError('Invalid direction', direction)
-            if pointer < 0 or pointer >= len(buffer):
+            result = self._row(pos)
+            if result is None:
                 if __debug__:
-                    log(DEBUG, 'Buffer miss:', pointer)
-                pos = self._dbposition + pointer
+                    log(DEBUG, 'Buffer miss:', pos)
+                self._misses += 1
                 # Interní ukazovátko po obyčejném minutí neupdatujeme, protože
                 # přijde fill a pokus o znovuvytažení hodnoty, s novým updatem
                 # ukazovátka.  Avšak pokud jsme kompletně mimo rozsah dat, není
                 # tato zdrženlivost namístě a je nutno ukazovátko posunout na
                 # správnou pozici, tj. mimo rozsah dat.
                 if pos < 0:
-                    self._pointer = -1 - self._dbposition
+                    self._position = -1
                 elif pos >= self._number_of_rows(row_count_info, pos + 1):
-                    self._pointer = self._number_of_rows(row_count_info) - self._dbposition
+                    self._position = self._number_of_rows(row_count_info)
                 return None
-            self._pointer = pointer
-            result = buffer[pointer]
+            self._hits += 1
+            self._position = pos
             if __debug__:
-                log(DEBUG, 'Buffer hit:', pointer) #, str(result))
+                log(DEBUG, 'Buffer hit:', pos)
             return result
 
         def correction(self, direction, row_count_info):
@@ -2786,35 +3534,17 @@ class DBDataPostgreSQL(PostgreSQLStandardBindingHandler, PostgreSQLNotifier):
 
             """
             if __debug__:
-                log(DEBUG, 'Žádost o korekci:',
-                    (self._dbpointer, self._dbposition, self._pointer, direction))
-            pointer = self._pointer
-            buflen = len(self._buffer)
-            pos = self._dbposition + pointer
-            if pointer > buflen or pointer < -1:
-                # Dostali jsme se daleko za buffer, je nutno provést DB skip.
-                # TODO: zde by mohlo být dobré nastavit pozici tak, aby byla
-                # načtena ještě nějaká data proti směru bufferu.  Jak to ale
-                # udělat čistě?
-                if pos >= 0:
-                    pos = min(pos, self._number_of_rows(row_count_info, pos))
-                else:
-                    pos = max(pos, -1)
-                correction = pos - self._dbpointer
-                self._buffer = []
-                self._pointer = -1
-                self._dbpointer = self._dbpointer + correction
-                self._dbposition = self._dbpointer + 1
-            elif (direction == FORWARD and pointer >= buflen - 1) or \
-                 (direction == BACKWARD and pointer <= 1):
-                # Jsme u hranice bufferu, provedeme DB skip bez mazání bufferu.
-                # Rozsah v podmínce je zvolen tak, aby ošetřil i předchozí
-                # buffer miss.
-                correction = pos - self._dbpointer
-                self._dbpointer = self._dbpointer + correction
+                log(DEBUG, 'Žádost o korekci:', (self._dbpointer, self._position, direction))
+            pos = self._position
+            if pos >= 0:
+                pos = min(pos, self._number_of_rows(row_count_info, pos))
             else:
-                # Jsme uvnitř bufferu, žádný DB skip se nekoná.
-                correction = 0
+                pos = -1
+            # The database cursor is moved to the current position so that the
+            # following fetch retrieves the rows right after it.  Cached rows
+            # are retained, there's no need to discard them.
+            correction = pos - self._dbpointer
+            self._dbpointer = pos
             if __debug__:
                 log(DEBUG, 'Určená korekce:', correction)
             return correction
@@ -2828,7 +3558,7 @@ class DBDataPostgreSQL(PostgreSQLStandardBindingHandler, PostgreSQLNotifier):
                 ukazovátko databázového kurzoru právě ukazuje
 
             """
-            self._pointer = position - self._dbposition
+            self._position = position
             self._dbpointer = position
 
         def skip(self, count, direction, row_count_info):
@@ -2843,22 +3573,20 @@ class DBDataPostgreSQL(PostgreSQLStandardBindingHandler, PostgreSQLNotifier):
             Vrací: Počet skutečně přeskočených řádků ve směru 'direction'.
 
             """
-            pointer = self._pointer
             if direction == FORWARD:
-                pointer = pointer + count
+                pos = self._position + count
             elif direction == BACKWARD:
-                pointer = pointer - count
+                pos = self._position - count
             else:
                 raise ProgramError('Invalid direction', direction)
-            pos = self._dbposition + pointer
             if pos < -1:
-                pointer = -1 - self._dbposition
+                pos = -1
             elif pos > self._number_of_rows(row_count_info, pos):
-                pointer = self._number_of_rows(row_count_info) - self._dbposition
-            result = pointer - self._pointer
+                pos = self._number_of_rows(row_count_info)
+            result = pos - self._position
             if direction == BACKWARD:
                 result = -result
-            self._pointer = pointer
+            self._position = pos
             return result
 
         def fill(self, rows, direction, extra_move=False):
@@ -2870,82 +3598,50 @@ class DBDataPostgreSQL(PostgreSQLStandardBindingHandler, PostgreSQLNotifier):
             if __debug__:
                 log(DEBUG, 'Plním buffer:', direction)
             n = len(rows)
-            buffer = self._buffer
-            buflen = len(buffer)
-            dbpointer = self._dbpointer
-            dbposition = self._dbposition
-            pointer = self._pointer + dbposition
-            import config
-            retain = max(config.cache_size - n, 0)
-            cutoff = max(buflen - retain, 0)
             if direction == FORWARD:
-                if dbposition + buflen - 1 == dbpointer:
-                    buffer = buffer[cutoff:] + rows
-                    dbposition = dbposition + cutoff
-                else:
-                    buffer = rows
-                    dbposition = dbpointer + 1
-                dbpointer = dbpointer + n
+                start = self._dbpointer + 1
+                self._dbpointer += n
                 if extra_move:
-                    dbpointer = dbpointer + 1
+                    self._dbpointer += 1
             elif direction == BACKWARD:
-                rows.reverse()
-                if dbposition == dbpointer:
-                    buffer = rows + buffer[:retain]
-                else:
-                    buffer = rows
-                dbpointer = dbpointer - n
-                dbposition = dbpointer
+                rows = rows[::-1]
+                self._dbpointer -= n
+                start = self._dbpointer
                 if extra_move:
-                    dbpointer = dbpointer - 1
+                    self._dbpointer -= 1
             else:
                 raise ProgramError('Invalid direction', direction)
-            self._pointer = pointer - dbposition
-            self._dbpointer = dbpointer
-            self._dbposition = dbposition
-            self._buffer = buffer
+            if n:
+                self._store(rows, start)
+                page_size = self._PAGE_SIZE
+                self._evict(set(range(max(start, 0) / page_size,
+                                      max(start + n - 1, 0) / page_size + 1)))
 
         def dbpointer(self):
             """Return database pointer position within the database cursor."""
             return self._dbpointer
 
-        def copy(self):
-            """Vrať \"rozumnou\" kopii instance."""
-            # Nepoužíváme postupy modulu `copy', protože potřebujeme něco mezi
-            # hlubokou a mělkou kopií.
-            copy_ = self.__class__()
-            copy_._buffer = copy.copy(self._buffer)
-            copy_._pointer = self._pointer
-            copy_._dpointer = self._dpointer
-            copy_._dbposition = self._dbposition
-            return copy_
+        def statistics(self):
+            """Return dictionary of the buffer usage statistics.
+
+            The dictionary contains the following items: 'hits' and 'misses'
+            -- the number of row fetches served from the buffer and the number
+            of those requiring data from the database since the buffer creation;
+            'pages', 'rows' and 'bytes' -- the number of pages, rows and the
+            estimated size of rows currently present in the buffer.
+
+            """
+            return dict(hits=self._hits, misses=self._misses, pages=len(self._pages),
+                        rows=self._rows, bytes=self._bytes)
 
         def __str__(self):
-            buffer = self._buffer
-            pointer = self._pointer
-            max = len(buffer) - 1
-            if max < 0:
-                bufstr = ''
-            elif max == 0:
-                bufstr = str(buffer[0])
-            elif max == 1:
-                bufstr = '%s\n%s' % (buffer[0], buffer[1])
-            elif pointer <= 0 or pointer >= max:
-                bufstr = '%s\n...\n%s' % (buffer[0], buffer[-1])
-            elif max == 2:
-                bufstr = '%s\n%s\n%s' % (buffer[0], buffer[1], buffer[2])
-            elif pointer == 1:
-                bufstr = '%s\n%s\n...\n%s' % (buffer[0], buffer[1], buffer[-1])
-            elif pointer == max - 1:
-                bufstr = '%s\n...\n%s\n%s' % \
-                         (buffer[0], buffer[-2], buffer[-1])
-            else:
-                bufstr = '%s\n...\n%s\n...\n%s' % \
-                         (buffer[0], buffer[pointer], buffer[-1])
-            return '<PgBuffer: db=%d, start=%d, index=%d\n%s>' % \
-                   (self._dbpointer, self._dbposition, self._pointer, bufstr)
+            return ('<PgBuffer: db=%d, position=%d, pages=%d, rows=%d, bytes=%d, '
+                    'hits=%d, misses=%d>' %
+                    (self._dbpointer, self._position, len(self._pages), self._rows, self._bytes,
+                     self._hits, self._misses,))
 
-    def __init__(self, bindings, key, connection_data, ro_select=True, **kwargs):
+    def __init__(self, bindings, key, connection_data, ro_select=True, snapshot=False,
+                 **kwargs):
         """Inicializuj databázovou tabulku dle uvedených specifikací.
 
         Argumenty:
@@ -2958,6 +3654,17 @@ class DBDataPostgreSQL(PostgreSQLStandardBindingHandler, PostgreSQLNotifier):
             instanci 'DBConnection'
           ro_select -- iff true, make select transactions read-only when
             possible
+          snapshot -- iff true, load the whole table into memory on the first
+            select and serve selects, 'row()', 'distinct()' and aggregations
+            outside transactions from the in-memory snapshot.  The snapshot is
+            discarded whenever a change notification of the table arrives.
+            Intended for small, rarely changing codebook tables.  Snapshots
+            are used only with single column keys, without table function
+            arguments and when change notifications are enabled
+            ('config.dblisten').  Strings in snapshot selects are sorted
+            according to the client's locale, so the order matches the
+            database only if the client locale corresponds to the database
+            collation.
           kwargs -- předá se předkovi
 
         """
@@ -2973,6 +3680,7 @@ class DBDataPostgreSQL(PostgreSQLStandardBindingHandler, PostgreSQLNotifier):
             **kwargs)
         self._pg_buffer = self._PgBuffer()
         self._pg_number_of_rows = None
+        self._pg_row_count_pending = (None, None)
         self._pg_initial_select = False
         self._pg_ro_select = ro_select
         # TODO: Ugly, fix this!
@@ -2985,6 +3693,19 @@ class DBDataPostgreSQL(PostgreSQLStandardBindingHandler, PostgreSQLNotifier):
             self._pg_create_make_row_template(filtered_columns,
                                               column_groups=getattr(self, '_pdbb_column_groups'))
         self._pg_make_row_template_limited = None
+        self._pg_row_decoder = self._pg_make_row_decoder(self._pg_make_row_template)
+        self._pg_row_decoder_limited = None
+        import config
+        self._pg_snapshot_enabled = (snapshot and config.dblisten and len(self._key_binding) == 1
+                                     and self._arguments is None)
+        if self._pg_snapshot_enabled:
+            key_id = self._key_binding[0].id()
+            self._pg_snapshot_columns = ([c for c in filtered_columns if c.id() == key_id] +
+                                         [c for c in filtered_columns if c.id() != key_id])
+        self._pg_snapshot = None
+        self._pg_snapshot_generation = 0
+        self._pg_snapshot_bypass = False
+        self._pg_snapshot_select = None
         # NASTAVENÍ CACHE
         # Protože pro různé parametry (rychlost linky mezi serverem a klientem,
         # velikost paměti atd.), je vhodné různé nastavení cache,
@@ -2992,7 +3713,6 @@ class DBDataPostgreSQL(PostgreSQLStandardBindingHandler, PostgreSQLNotifier):
         # Pozor, config.cache_size je využíváno přímo v _PgBuffer.
         # Zde tyto hodnoty zapamatujeme jako atributy objektu, protože jsou
         # potřeba v kritických částech kódu a čtení konfigurace přeci jen trvá.
-        import config
         self._pg_initial_fetch_size = config.initial_fetch_size
         self._pg_fetch_size = config.fetch_size
 
@@ -3068,30 +3788,63 @@ class DBDataPostgreSQL(PostgreSQLStandardBindingHandler, PostgreSQLNotifier):
                 raise ProgramError("Column not found in template", c)
         return template
 
-    def _pg_make_row_from_raw_data(self, data_, template=None):
-        if not data_:
-            return None
-        if not template:
-            template = self._pg_make_row_template
-        row_data = []
-        data_0 = data_[0]
-        i = 0
-        for id, typid, type_ in template:
-            dbvalue = data_0[i]
-            i += 1
-            if isinstance(type_, Array):
+    def _pg_make_row_decoder(self, template):
+        """Return function making 'Row' instances from raw data rows.
+
+        The returned function takes a single raw data row (a sequence of column
+        values as returned by the database backend) and returns the
+        corresponding 'CompactRow' instance.  The column conversions are
+        resolved just once here for all the columns of 'template', rows made by
+        the returned function share the same column structure.
+
+        Arguments:
+
+          template -- make row template as returned by
+            '_pg_create_make_row_template()'
+
+        """
+        def array_converter(type_):
+            inner_type = type_.inner_type()
+            def convert(dbvalue):
                 if dbvalue is None:
                     dbvalue = ()
                 else:
-                    inner_type = type_.inner_type()
                     dbvalue = tuple([Value(inner_type, v) for v in dbvalue])
-            elif isinstance(type_, Binary):
+                return Value(type_, dbvalue)
+            return convert
+        def binary_converter(type_):
+            buffer_class = type_.Buffer
+            def convert(dbvalue):
                 if dbvalue is not None:
-                    dbvalue = type_.Buffer(dbvalue)
+                    dbvalue = buffer_class(dbvalue)
+                return Value(type_, dbvalue)
+            return convert
+        converters = []
+        for id_, typid, type_ in template:
+            if isinstance(type_, Array):
+                converter = array_converter(type_)
+            elif isinstance(type_, Binary):
+                converter = binary_converter(type_)
             else:
-                dbvalue = type_.adjust_value(dbvalue)
-            row_data.append((id, Value(type_, dbvalue)))
-        return Row(row_data)
+                # Value constructor performs the type's adjust_value() itself.
+                converter = functools.partial(Value, type_)
+            converters.append(converter)
+        columns = CompactRow.Columns([id_ for id_, typid, type_ in template])
+        def decode(raw_row):
+            return CompactRow(columns, [converter(dbvalue)
+                                        for converter, dbvalue in zip(converters, raw_row)])
+        return decode
+
+    def _pg_make_row_from_raw_data(self, data_, template=None):
+        if not data_:
+            return None
+        if not template:
+            decoder = self._pg_row_decoder
+        elif template is self._pg_make_row_template_limited:
+            decoder = self._pg_row_decoder_limited
+        else:
+            decoder = self._pg_make_row_decoder(template)
+        return decoder(data_[0])
 
     def _pg_already_present(self, row, transaction=None):
         key = []
@@ -3145,6 +3898,8 @@ class DBDataPostgreSQL(PostgreSQLStandardBindingHandler, PostgreSQLNotifier):
             number, finished = self._pg_number_of_rows.count(min_value=min_value)
             if finished:
                 self._pg_number_of_rows = number
+                count_key, generation = self._pg_row_count_pending
+                self._pg_cache_row_count(count_key, number, generation)
         return number
 
     def _pg_check_arguments(self, arguments):
@@ -3157,9 +3912,52 @@ class DBDataPostgreSQL(PostgreSQLStandardBindingHandler, PostgreSQLNotifier):
 
     # Veřejné metody a jimi přímo volané abstraktní metody
 
+    def _pg_snapshot_usable(self, transaction=None, arguments=None):
+        return (self._pg_snapshot_enabled and not self._pg_snapshot_bypass and
+                transaction is None and not arguments)
+
+    def _pg_snapshot_data(self, transaction=None, arguments=None):
+        # Return the table snapshot as a 'MemData' instance if it may be used
+        # for the given arguments, None otherwise.  The snapshot is loaded
+        # only when no select is open since loading performs its own select.
+        if not self._pg_snapshot_usable(transaction, arguments):
+            return None
+        snapshot = self._pg_snapshot
+        if snapshot is None and not self.select_active():
+            generation = self._pg_snapshot_generation
+            self._pg_snapshot_bypass = True
+            try:
+                rows = self.select_map(identity)
+            finally:
+                self._pg_snapshot_bypass = False
+            snapshot = MemData(self._pg_snapshot_columns, data=rows)
+            if generation == self._pg_snapshot_generation:
+                self._pg_snapshot = snapshot
+        return snapshot
+
+    def _pg_reset_snapshot(self):
+        self._pg_snapshot = None
+        self._pg_snapshot_generation += 1
+
+    def _call_on_change_callbacks(self, changes=None):
+        self._pg_reset_snapshot()
+        super(DBDataPostgreSQL, self)._call_on_change_callbacks(changes)
+
+    def _pg_send_notifications(self, operation=None, key=None):
+        # Don't wait for our own notification to arrive.
+        self._pg_reset_snapshot()
+        self._pg_row_count_cache.invalidate(self._pg_row_count_dependencies())
+        super(DBDataPostgreSQL, self)._pg_send_notifications(operation=operation, key=key)
+
     def row(self, key, columns=None, transaction=None, arguments={}):
         if self._arguments is not None and arguments is self.UNKNOWN_ARGUMENTS:
             return None
+        snapshot = self._pg_snapshot_data(transaction, arguments)
+        if snapshot is not None:
+            try:
+                return snapshot.row(key, columns=columns)
+            except KeyError:
+                pass
         if __debug__:
             self._pg_check_arguments(arguments)
         # TODO: Temporary compatibility hack.  The current internal db code
@@ -3193,6 +3991,23 @@ class DBDataPostgreSQL(PostgreSQLStandardBindingHandler, PostgreSQLNotifier):
             log(DEBUG, 'Select started:', condition)
         if __debug__:
             self._pg_check_arguments(arguments)
+        if self._pg_snapshot_usable(transaction, arguments):
+            self.close()
+            snapshot = self._pg_snapshot_data(transaction, arguments)
+            if snapshot is not None:
+                try:
+                    count = snapshot.select(condition, sort=sort, columns=columns, limit=limit)
+                except (self.UnsupportedOperation, KeyError):
+                    pass
+                else:
+                    self._pg_snapshot_select = snapshot
+                    self._pg_last_select_condition = condition
+                    self._pg_last_select_sorting = sort
+                    self._pg_last_select_transaction = transaction
+                    self._pg_last_select_arguments = arguments
+                    self._pg_last_select_limit = limit
+                    self._pg_number_of_rows = None
+                    return count
         if ((reuse and not self._pg_changed and self._pg_number_of_rows and
              condition == self._pg_last_select_condition and
              sort == self._pg_last_select_sorting and
@@ -3231,8 +4046,11 @@ class DBDataPostgreSQL(PostgreSQLStandardBindingHandler, PostgreSQLNotifier):
         if columns:
             self._pg_make_row_template_limited = \
                 self._pg_limited_make_row_template(columns)
+            self._pg_row_decoder_limited = \
+                self._pg_make_row_decoder(self._pg_make_row_template_limited)
         else:
             self._pg_make_row_template_limited = None
+            self._pg_row_decoder_limited = None
         try:
             row_count_info = self._pg_select(condition, sort, columns, transaction=transaction,
                                              arguments=arguments, async_count=async_count,
@@ -3262,13 +4080,220 @@ class DBDataPostgreSQL(PostgreSQLStandardBindingHandler, PostgreSQLNotifier):
         self._pg_number_of_rows = row_count_info
         return row_count_info
 
+    def select_map(self, function, transaction=None, **kwargs):
+        """Stejné jako v nadtřídě.
+
+        Rows are fetched from the database cursor in batches of the configured
+        fetch size and passed to 'function' as they arrive, without storing
+        them in the select buffer.
+
+        """
+        if ((kwargs.get('async_count') or
+             self._pg_snapshot_usable(transaction, kwargs.get('arguments')))):
+            # The row counting thread moves the cursor and snapshot selects
+            # don't use the cursor at all, so let fetchone() handle it.
+            return super(DBDataPostgreSQL, self).select_map(function, transaction=transaction,
+                                                            **kwargs)
+        result = []
+        try:
+            self.select(transaction=transaction, **kwargs)
+            transaction_ = self._pg_select_transaction if transaction is None else transaction
+            decode = self._pg_row_decoder_limited or self._pg_row_decoder
+            size = max(self._pg_fetch_size, 1)
+            while True:
+                data_ = self._pg_fetchmany(size, FORWARD, transaction=transaction_)
+                if self._pg_select_set_read_only:
+                    self._pg_select_transaction.set_read_only()
+                    self._pg_select_set_read_only = False
+                for d in data_:
+                    result.append(function(decode(d)))
+                if len(data_) < size:
+                    break
+        finally:
+            try:
+                self.close()
+            except:
+                pass
+        return result
+
+    def select_keyset(self, row=None, count=100, direction=FORWARD, condition=None, sort=(),
+                      columns=None, transaction=None, arguments={}):
+        """Return the list of up to 'count' rows following 'row' in the given sorting.
+
+        This is a stateless alternative to paging through 'select()' results.
+        Each call performs a single query limited to 'count' rows.  The rows
+        beyond 'row' are selected by comparison of the sorting and key column
+        values (keyset pagination), so no database cursor is declared, no
+        transaction is held between the calls and no rows are counted.
+
+        Arguments:
+
+          row -- the 'Row' instance the page starts after (or ends before, in
+            the 'BACKWARD' direction), typically the last (first) row of the
+            previous page; it must contain all the sorting and key columns.
+            If 'None', the first (last) page is returned.
+          count -- maximum number of rows to return
+          direction -- 'FORWARD' to return the rows following 'row' or
+            'BACKWARD' to return the rows preceding 'row'
+          condition, sort, arguments -- the same as in 'select()'
+          columns -- the same as in 'select()'; key and sorting columns are
+            added automatically when missing
+          transaction -- transaction object to perform the query in or 'None'
+            to perform it outside any transaction
+
+        The rows are always returned in the order given by 'sort', regardless
+        of 'direction'.
+
+        """
+        assert direction in (FORWARD, BACKWARD), ('Invalid direction', direction)
+        assert isinstance(count, int) and count > 0, count
+        if __debug__:
+            self._pg_check_arguments(arguments)
+        sorting = [spec if isinstance(spec, (tuple, list,)) else (spec, ASCENDENT)
+                   for spec in sort]
+        if direction == FORWARD:
+            command = self._pdbb_command_keyset_forward
+        else:
+            sorting = reversed_sorting(sorting)
+            command = self._pdbb_command_keyset_backward
+        keyset_condition = self._pg_sorting_condition(sorting, direction, True, row, False)
+        args = dict(condition=self._pdbb_condition2sql(AND(condition, keyset_condition)),
+                    ordering=self._pdbb_sort2sql(sorting),
+                    limit=self._pdbb_limit2sql(count))
+        if columns:
+            columns = list(columns)
+            for cid in [c.id() for c in self.key()] + [cid for cid, dir in sorting]:
+                if cid not in columns:
+                    columns.append(cid)
+            args['columns'] = self._pdbb_sql_column_list_from_names(
+                columns,
+                full_text_handler=self._pdbb_full_text_handler,
+                operations=self._pdbb_operations,
+                column_groups=self._pdbb_column_groups)
+            decode = self._pg_make_row_decoder(self._pg_limited_make_row_template(columns))
+        else:
+            decode = self._pg_row_decoder
+        self._pg_make_arguments(args, arguments)
+        data_ = self._pg_query(command.update(args), transaction=transaction)
+        result = [decode(d) for d in data_]
+        if direction == BACKWARD:
+            result.reverse()
+        return result
+
+    def select_page(self, condition=None, sort=(), offset=0, limit=None, columns=None,
+                    transaction=None, arguments={}, with_count=True):
+        """Stejné jako v nadtřídě.
+
+        The page is retrieved by a single LIMIT/OFFSET query, without
+        declaring a database cursor.  The rows are counted by a separate
+        query only when the count can't be determined from the page itself,
+        i.e. when the page is full or empty and past the first row.  Counts
+        may be served from the process wide row count cache.
+
+        """
+        assert isinstance(offset, int) and offset >= 0, offset
+        assert limit is None or isinstance(limit, int) and limit >= 0, limit
+        if self._pg_snapshot_usable(transaction, arguments):
+            return super(DBDataPostgreSQL, self).select_page(
+                condition=condition, sort=sort, offset=offset, limit=limit, columns=columns,
+                transaction=transaction, arguments=arguments, with_count=with_count)
+        if __debug__:
+            self._pg_check_arguments(arguments)
+        if self._arguments is not None and arguments is self.UNKNOWN_ARGUMENTS:
+            return [], (0 if with_count else None)
+        args = self._pg_select_args(condition, sort, arguments, limit=limit, offset=offset)
+        if columns:
+            args['columns'] = self._pdbb_sql_column_list_from_names(
+                columns,
+                full_text_handler=self._pdbb_full_text_handler,
+                operations=self._pdbb_operations,
+                column_groups=self._pdbb_column_groups)
+            decode = self._pg_make_row_decoder(self._pg_limited_make_row_template(columns))
+        else:
+            decode = self._pg_row_decoder
+        if with_count and transaction is None:
+            count_key = self._pg_row_count_key_from_args(args)
+        else:
+            count_key = None
+        generation = self._pg_row_count_cache.generation()
+        data_ = self._pg_query(self._pdbb_command_page.update(args), transaction=transaction)
+        rows = [decode(d) for d in data_]
+        if not with_count:
+            count = None
+        elif (limit is None or len(rows) < limit) and (rows or offset == 0):
+            count = offset + len(rows)
+            self._pg_cache_row_count(count_key, count, generation)
+        else:
+            count = self._pg_cached_row_count(count_key)
+            if count is None:
+                data_ = self._pg_query(self._pdbb_command_count.update(args),
+                                       transaction=transaction)
+                count = int(data_[0][0])
+                self._pg_cache_row_count(count_key, count, generation)
+        return rows, count
+
+    def copy_out(self, stream, condition=None, sort=(), columns=None, format='csv',
+                 header=False, delimiter=None, null=None, transaction=None, arguments={}):
+        """Stejné jako v nadtřídě.
+
+        The rows are written by the 'COPY (SELECT ...) TO STDOUT' command,
+        'format', 'header', 'delimiter' and 'null' are passed to it as the
+        options of the same names.  See the PostgreSQL documentation of 'COPY'
+        for the output formats.
+
+        """
+        assert format in ('csv', 'text'), format
+        assert delimiter is None or '%' not in delimiter, delimiter
+        assert null is None or '%' not in null, null
+        if __debug__:
+            self._pg_check_arguments(arguments)
+        if self._arguments is not None and arguments is self.UNKNOWN_ARGUMENTS:
+            return 0
+        args = self._pg_select_args(condition, sort, arguments)
+        if columns:
+            args['columns'] = self._pdbb_sql_column_list_from_names(
+                columns,
+                full_text_handler=self._pdbb_full_text_handler,
+                operations=self._pdbb_operations,
+                column_groups=self._pdbb_column_groups)
+        options = ['format ' + format]
+        if header:
+            options.append('header true')
+        for name, value in (('delimiter', delimiter), ('null', null)):
+            if value is not None:
+                options.append("%s '%s'" % (name, value.replace("'", "''"),))
+        args['options'] = _Query(', '.join(options))
+        data_ = self._pg_query(self._pdbb_command_copy.update(args), transaction=transaction,
+                               copy_to=stream)
+        return int(data_[0][0])
+
     def select_aggregate(self, operation, condition=None, transaction=None, arguments={}):
+        snapshot = self._pg_snapshot_data(transaction, arguments)
+        if snapshot is not None:
+            try:
+                return snapshot.select_aggregate(operation, condition=condition)
+            except (self.UnsupportedOperation, KeyError):
+                pass
         if __debug__:
             self._pg_check_arguments(arguments)
         return self._pg_select_aggregate(operation[0], (operation[1],),
                                          condition=condition, transaction=transaction,
                                          arguments=arguments)[0]
 
+    def select_aggregates(self, operations, condition=None, transaction=None, arguments={}):
+        """Stejné jako v nadtřídě.
+
+        All the results are computed by a single database query.
+
+        """
+        if self._pg_snapshot_usable(transaction, arguments):
+            return super(DBDataPostgreSQL, self).select_aggregates(
+                operations, condition=condition, transaction=transaction, arguments=arguments)
+        if __debug__:
+            self._pg_check_arguments(arguments)
+        return self._pg_select_aggregates(operations, condition, transaction=transaction,
+                                          arguments=arguments)
+
     def select_and_aggregate(self, operation, condition=None, reuse=False, sort=(),
                              columns=None, transaction=None, arguments={}):
         if __debug__:
@@ -3321,6 +4346,12 @@ class DBDataPostgreSQL(PostgreSQLStandardBindingHandler, PostgreSQLNotifier):
         """
         if __debug__:
             self._pg_check_arguments(arguments)
+        snapshot = self._pg_snapshot_data(transaction, arguments)
+        if snapshot is not None:
+            try:
+                return snapshot.distinct(column, prefix=prefix, condition=condition, sort=sort)
+            except (self.UnsupportedOperation, KeyError):
+                pass
         return self._pg_distinct(column, prefix, condition, sort, transaction=transaction,
                                  arguments=arguments)
 
@@ -3339,6 +4370,8 @@ class DBDataPostgreSQL(PostgreSQLStandardBindingHandler, PostgreSQLNotifier):
             log(DEBUG, 'Vytažení řádku ze selectu ve směru:', direction)
         assert direction in(FORWARD, BACKWARD), \
             ('Invalid direction', direction)
+        if self._pg_snapshot_select is not None:
+            return self._pg_snapshot_select.fetchone(direction)
         if self._pg_select_transaction is None:
             if not self._pg_restore_select():
                 raise ProgramError('Not within select')
@@ -3423,9 +4456,8 @@ class DBDataPostgreSQL(PostgreSQLStandardBindingHandler, PostgreSQLNotifier):
                 self._pg_select_transaction = None
                 raise cls, e, tb
             if data_:
-                r = self._pg_make_row_from_raw_data
-                row_data = [r([d], template=self._pg_make_row_template_limited)
-                            for d in data_]
+                decode = self._pg_row_decoder_limited or self._pg_row_decoder
+                row_data = [decode(d) for d in data_]
                 buffer.fill(row_data, FORWARD, len(row_data) != size)
                 if xskip:
                     buffer.skip(xskip, FORWARD, self._pg_number_of_rows)
@@ -3442,6 +4474,8 @@ class DBDataPostgreSQL(PostgreSQLStandardBindingHandler, PostgreSQLNotifier):
         return result
 
     def last_row_number(self):
+        if self._pg_snapshot_select is not None:
+            return self._pg_snapshot_select.last_row_number()
         if self._pg_select_transaction is None:
             if not self._pg_restore_select():
                 raise ProgramError('Not within select')
@@ -3458,6 +4492,8 @@ class DBDataPostgreSQL(PostgreSQLStandardBindingHandler, PostgreSQLNotifier):
             log(DEBUG, 'Přeskočení řádků:', (direction, count))
         assert isinstance(count, int) and count >= 0, ('Invalid count', count)
         assert direction in (FORWARD, BACKWARD), ('Invalid direction', direction)
+        if self._pg_snapshot_select is not None:
+            return self._pg_snapshot_select.skip(count, direction)
         if self._pg_select_transaction is None:
             if not self._pg_restore_select():
                 raise ProgramError('Not within select')
@@ -3470,6 +4506,8 @@ class DBDataPostgreSQL(PostgreSQLStandardBindingHandler, PostgreSQLNotifier):
         return result
 
     def rewind(self):
+        if self._pg_snapshot_select is not None:
+            return self._pg_snapshot_select.rewind()
         if self._pg_select_transaction is None:
             if not self._pg_restore_select():
                 raise ProgramError('Not within select')
@@ -3490,6 +4528,22 @@ class DBDataPostgreSQL(PostgreSQLStandardBindingHandler, PostgreSQLNotifier):
             ('Invalid direction', direction)
         if __debug__:
             self._pg_check_arguments(arguments)
+        if self._pg_snapshot_select is not None:
+            try:
+                return self._pg_snapshot_select.search(condition, direction=direction)
+            except (self.UnsupportedOperation, KeyError):
+                # Fall back to a database select of the same rows.
+                row_number = self._pg_snapshot_select.last_row_number()
+                self._pg_snapshot_select = None
+                self._pg_snapshot_bypass = True
+                try:
+                    self.select(condition=self._pg_last_select_condition,
+                                sort=self._pg_last_select_sorting,
+                                limit=self._pg_last_select_limit)
+                finally:
+                    self._pg_snapshot_bypass = False
+                if row_number >= 0:
+                    self.skip(row_number + 1)
         if self._pg_select_transaction is None:
             if not self._pg_restore_select():
                 raise ProgramError('Not within select')
@@ -3527,6 +4581,9 @@ class DBDataPostgreSQL(PostgreSQLStandardBindingHandler, PostgreSQLNotifier):
     def close(self):
         if __debug__:
             log(DEBUG, 'Explicitly closing current select')
+        if self._pg_snapshot_select is not None:
+            self._pg_snapshot_select.close()
+            self._pg_snapshot_select = None
         if self._pg_select_transaction is not None:
             if isinstance(self._pg_number_of_rows, self._PgRowCounting):
                 self._pg_number_of_rows.stop()
@@ -3548,7 +4605,37 @@ class DBDataPostgreSQL(PostgreSQLStandardBindingHandler, PostgreSQLNotifier):
         self._pg_buffer.reset()
 
     def select_active(self):
-        return self._pg_select_transaction is not None
+        return self._pg_select_transaction is not None or self._pg_snapshot_select is not None
+
+    def reload_buffered_rows(self, keys):
+        if self._pg_snapshot_select is not None:
+            # The snapshot is reloaded as a whole, the select must be repeated.
+            return None
+        if self._pg_select_transaction is None:
+            return []
+        key_id = self.key()[0].id()
+        arguments = self._pg_last_select_arguments or {}
+        condition = self._pg_last_select_condition
+        transaction = self._pg_last_select_transaction
+        sorting = [isinstance(item, tuple) and item[0] or item
+                   for item in self._pg_last_select_sorting or ()]
+        positions = []
+        for key in keys:
+            for position, old_row in self._pg_buffer.find(key_id, key.value()):
+                columns = old_row.keys()
+                data = self._pg_row(key, columns, transaction=transaction,
+                                    arguments=arguments, condition=condition)
+                if not data:
+                    # The row doesn't belong to the select anymore.
+                    return None
+                template = self._pg_limited_make_row_template(columns)
+                row = self._pg_make_row_from_raw_data(data, template=template)
+                if [cid for cid in sorting if cid not in columns or row[cid] != old_row[cid]]:
+                    # The row may have moved to another position.
+                    return None
+                self._pg_buffer.replace(position, row)
+                positions.append(position)
+        return positions
         
     def insert(self, row, after=None, before=None, transaction=None):
         assert after is None or before is None, 'Both after and before specified'
@@ -3586,7 +4673,12 @@ class DBDataPostgreSQL(PostgreSQLStandardBindingHandler, PostgreSQLNotifier):
             raise cls, e, tb
         if transaction is None:
             self._pg_commit_transaction()
-            self._pg_send_notifications()
+            new_row = result[0] if result[1] else None
+            key_id = self.key()[0].id()
+            if isinstance(new_row, Row) and key_id in new_row.keys():
+                self._pg_send_notifications('INSERT', new_row[key_id])
+            else:
+                self._pg_send_notifications()
         else:
             transaction._trans_notify(self)
         if result[1]:
@@ -3645,7 +4737,10 @@ class DBDataPostgreSQL(PostgreSQLStandardBindingHandler, PostgreSQLNotifier):
             raise cls, e, tb
         if transaction is None:
             self._pg_commit_transaction()
-            self._pg_send_notifications()
+            if result[1] and new_key == key:
+                self._pg_send_notifications('UPDATE', key)
+            else:
+                self._pg_send_notifications()
         else:
             transaction._trans_notify(self)
         if result[1]:
@@ -3683,6 +4778,67 @@ class DBDataPostgreSQL(PostgreSQLStandardBindingHandler, PostgreSQLNotifier):
             log(ACTION, 'Rows updated:', result)
         return result
 
+    def insert_many(self, rows, transaction=None):
+        log(ACTION, 'Insert rows:', len(rows))
+        if transaction is None:
+            self._pg_begin_transaction()
+        try:
+            if self._ordering:
+                # Each row needs its own position in the ordering.
+                for row in rows:
+                    self._pg_insert(row, transaction=transaction)
+                result = len(rows)
+            else:
+                result = self._pg_insert_many(rows, transaction=transaction)
+        except:
+            cls, e, tb = sys.exc_info()
+            try:
+                if transaction is None:
+                    self._pg_rollback_transaction()
+            except:
+                pass
+            raise cls, e, tb
+        if transaction is None:
+            self._pg_commit_transaction()
+            self._pg_send_notifications()
+        else:
+            transaction._trans_notify(self)
+        log(ACTION, 'Rows inserted:', result)
+        return result
+
+    def update_many_rows(self, pairs, transaction=None):
+        log(ACTION, 'Update rows:', len(pairs))
+        if transaction is None:
+            self._pg_begin_transaction()
+        try:
+            ordering = self._ordering
+            if ordering:
+                pairs = [(key, Row([(k, v) for k, v in row.items() if k not in ordering]))
+                         for key, row in pairs]
+            if ((self._pdbb_command_update_rows is None or
+                 self._pg_broken_update_result(transaction))):
+                result = 0
+                for key, row in pairs:
+                    result += self._pg_update(self._pg_key_condition(key), row,
+                                              transaction=transaction)
+            else:
+                result = self._pg_update_rows(pairs, transaction=transaction)
+        except:
+            cls, e, tb = sys.exc_info()
+            try:
+                if transaction is None:
+                    self._pg_rollback_transaction()
+            except:
+                pass
+            raise cls, e, tb
+        if transaction is None:
+            self._pg_commit_transaction()
+            self._pg_send_notifications()
+        else:
+            transaction._trans_notify(self)
+        log(ACTION, 'Rows updated:', result)
+        return result
+
     def delete(self, key, transaction=None):
         log(ACTION, 'Delete row:', key)
         if transaction is None:
@@ -3700,7 +4856,7 @@ class DBDataPostgreSQL(PostgreSQLStandardBindingHandler, PostgreSQLNotifier):
             raise cls, e, tb
         if transaction is None:
             self._pg_commit_transaction()
-            self._pg_send_notifications()
+            self._pg_send_notifications('DELETE', key)
         else:
             transaction._trans_notify(self)
         log(ACTION, 'Row deleted:', result)
@@ -62,8 +62,8 @@ else:
     import sqlalchemy.dialects.postgresql
 
 from pytis.util import Counter, InvalidAccessError, LimitedCache, OPERATIONAL, ProgramError, \
-    assoc, compare_objects, format_byte_size, identity, log, rassoc, sameclass, super_, \
-    with_lock, xtuple
+    UNDEFINED, assoc, compare_objects, format_byte_size, identity, log, rassoc, sameclass, \
+    super_, with_lock, xtuple
 
 
 class _MType(type):
@@ -166,6 +166,9 @@ class Type(object):
     _SPECIAL_VALUES = ()
     
     _VALIDATION_CACHE_LIMIT = 1000
+    # If true, '_validate()' is cheap enough to be called directly, without
+    # constructing validation cache keys.
+    _FAST_VALIDATION = False
 
     def _make(class_, *args, **kwargs):
         result = Type._type_table.get_instance(class_, *args, **kwargs)
@@ -347,9 +350,22 @@ class Type(object):
         # s tím spojené.  Pokud by bylo potřeba v budoucnu toto rozlišit, lze
         # přidat další metodu nebo argument.  Nyní je to částečně řešeno
         # argumentem 'strict'.
-        if arguments:
+        enumerator = self._enumerator
+        if self._FAST_VALIDATION or enumerator is not None and transaction is not None:
+            # Enumerator checks within transactions can't be shared and
+            # enumerators cache their rows keyed by value and condition anyway.
+            try:
+                result = self._validated_value(object, strict, transaction, condition,
+                                               arguments, kwargs), None
+            except ValidationError as e:
+                result = None, e
+            return result
+        if enumerator is None:
+            # These arguments only matter for enumerator checks.
+            condition = arguments = None
+        elif arguments:
             arguments = tuple(arguments.items())
-        key = (object, strict, transaction, condition, arguments, tuple(kwargs.items()))
+        key = (object, strict, condition, arguments, tuple(kwargs.items()))
         try:
             result = self._validation_cache[key], None
         except ValidationError as e:
@@ -357,19 +373,23 @@ class Type(object):
         return result
 
     def _validating_provider(self, key):
-        object, strict, transaction, condition, arguments, kwargs_items = key
+        object, strict, condition, arguments, kwargs_items = key
+        if arguments:
+            arguments = dict(arguments)
+        return self._validated_value(object, strict, None, condition, arguments,
+                                     dict(kwargs_items))
+
+    def _validated_value(self, object, strict, transaction, condition, arguments, kwargs):
         special = rassoc(object, self._SPECIAL_VALUES)
         if special:
             value = Value(self, special[0])
         elif object is None:
             value = Value(self, None)
         else:
-            value, error = self._validate(object, **dict(kwargs_items))
+            value, error = self._validate(object, **kwargs)
             if error:
                 raise error
         if strict:
-            if arguments:
-                arguments = dict(arguments)
             self._check_constraints(value.value(), transaction=transaction, condition=condition,
                                     arguments=arguments)
         return value
@@ -864,6 +884,8 @@ class Range(Type):
 class Integer(Number):
     """Libovolný integer."""
 
+    _FAST_VALIDATION = True
+
     VM_NONINTEGER = 'VM_NONINTEGER'
     # Translators: User input validation error message.
     _VM_NONINTEGER_MSG = _(u"Not an integer")
@@ -1007,6 +1029,8 @@ class Float(Number):
     VM_INVALID_NUMBER = 'VM_INVALID_NUMBER'
     # Translators: User input validation error message.
     _VM_INVALID_NUMBER_MSG = _(u"Invalid number")
+
+    _FAST_VALIDATION = True
     
     def _init(self, precision=None, digits=None, **kwargs):
         super(Float, self)._init(**kwargs)
@@ -1196,6 +1220,7 @@ class String(Limited):
     # Translators: User input validation error message.
     _VM_MAXLEN_MSG = _(u"Maximal size %(maxlen)s exceeded")
     _SPECIAL_VALUES = Type._SPECIAL_VALUES + ((None, ''),)
+    _FAST_VALIDATION = True
     
     def _validate(self, string):
         """Vrať instanci třídy 'Value' s hodnotou 'string'.
@@ -1766,6 +1791,8 @@ class DateTime(_CommonDateTime):
     
     _ISO_TZ_MATCHER = re.compile('(?P<sign>[-+])(?P<hours>[0-9]+):(?P<minutes>[0-9]+)')
 
+    _FAST_VALIDATION = True
+
     def _init(self, format=None, mindate=None, maxdate=None, utc=True, **kwargs):
         assert mindate is None or isinstance(mindate, basestring)
         assert maxdate is None or isinstance(maxdate, basestring)
@@ -2321,6 +2348,7 @@ class Boolean(Type):
     """
 
     _SPECIAL_VALUES = ((True, 'T'), (False, 'F'), (None, ''))
+    _FAST_VALIDATION = True
     
     def _init(self, not_null=True):
         e = FixedEnumerator((True, False))
@@ -2955,9 +2983,11 @@ class DataEnumerator(Enumerator, TransactionalEnumerator):
         self._validity_condition = validity_condition
         self._change_callbacks = []
         self._connection_data = connection_data
+        self._row_cache_lock = thread.allocate_lock()
+        self._row_cache_generation = 0
 
     def __getattr__(self, name):
-        if name in ('_data', '_value_column'):
+        if name in ('_data', '_value_column', '_row_cache'):
             self._complete()
             return self.__dict__[name]
         else:
@@ -2984,6 +3014,18 @@ class DataEnumerator(Enumerator, TransactionalEnumerator):
         for callback in self._change_callbacks:
             self._data.add_callback_on_change(callback)
         self._change_callbacks = []
+        # Cached rows are valid until the next change notification.  Without
+        # reliable notifications they expire after a limited time.
+        import config
+        limit = config.enumerator_cache_size
+        if data.changes_notified():
+            ttl = None
+        elif config.enumerator_cache_ttl > 0:
+            ttl = config.enumerator_cache_ttl
+        else:
+            limit, ttl = 0, None
+        self._row_cache = LimitedCache(self._retrieve_uncached, limit=limit, ttl=ttl)
+        self._data.add_callback_on_change(self._reset_row_cache)
         self._non_big_columns = [c.id() for c in data.columns()
                                  if not isinstance(c.type(), pytis.data.Big)]
         if __debug__:
@@ -3002,8 +3044,48 @@ class DataEnumerator(Enumerator, TransactionalEnumerator):
         else:
             return condition
 
+    def _row_cache_key(self, value, condition, arguments):
+        if arguments:
+            arguments = tuple(sorted(arguments.items()))
+        else:
+            arguments = None
+        key = (value, condition, arguments)
+        try:
+            hash(key)
+        except TypeError:
+            key = None
+        return key
+
+    def _retrieve_uncached(self, key):
+        # The row cache is filled explicitly by _cache_row().
+        raise KeyError(key)
+
+    def _cache_row(self, key, row, generation):
+        def lfunction():
+            # Don't store rows retrieved before the last change notification.
+            if generation == self._row_cache_generation:
+                self._row_cache[key] = row
+        with_lock(self._row_cache_lock, lfunction)
+
+    def _reset_row_cache(self):
+        def lfunction():
+            self._row_cache.reset()
+            self._row_cache_generation += 1
+        with_lock(self._row_cache_lock, lfunction)
+
     def _retrieve(self, value, transaction=None, condition=None, arguments=None):
         from pytis.data import AND, EQ
+        # Rows retrieved within a transaction may not be visible to others,
+        # so they are never cached.
+        if transaction is None:
+            key = self._row_cache_key(value, condition, arguments)
+            if key is not None:
+                row = self._row_cache.get(key, UNDEFINED)
+                if row is not UNDEFINED:
+                    return row
+        else:
+            key = None
+        generation = self._row_cache_generation
         if arguments is None:
             arguments = {}
         the_condition = EQ(self._value_column, Value(self._value_column_type, value))
@@ -3025,7 +3107,10 @@ class DataEnumerator(Enumerator, TransactionalEnumerator):
                 except:
                     pass
             return row
-        return with_lock(self._data_lock, lfunction)
+        row = with_lock(self._data_lock, lfunction)
+        if key is not None:
+            self._cache_row(key, row, generation)
+        return row
 
     def __str__(self):
         factory = self._data_factory
@@ -3112,6 +3197,53 @@ class DataEnumerator(Enumerator, TransactionalEnumerator):
         return self._retrieve(value, transaction=transaction, condition=condition,
                               arguments=arguments)
     
+    def prefetch(self, values, condition=None, arguments=None):
+        """Load rows for given codebook values into the enumerator's cache.
+
+        Arguments:
+
+          values -- sequence of internal (Python) values of the enumerator's
+            'value_column'.
+          condition, arguments -- the same as in 'row()'.
+
+        All rows not present in the cache yet are retrieved by a single query,
+        so that subsequent 'row()' and 'check()' calls for these values (with
+        the same 'condition' and 'arguments') don't need to query the data
+        object.  This is useful when codebook values are needed for a whole
+        set of rows at once, such as a visible page of a table.
+
+        """
+        import config
+        from pytis.data import AND, ANY_OF
+        limit = config.enumerator_cache_size
+        keys = {}
+        for value in values:
+            if value is not None and value not in keys and len(keys) < limit:
+                key = self._row_cache_key(value, condition, arguments)
+                if key is not None and self._row_cache.get(key, UNDEFINED) is UNDEFINED:
+                    keys[value] = key
+        if not keys:
+            return
+        generation = self._row_cache_generation
+        value_column = self._value_column
+        value_type = self._value_column_type
+        the_condition = ANY_OF(value_column, *[Value(value_type, v) for v in keys])
+        validity_condition = self._condition(condition=condition)
+        if validity_condition is not None:
+            the_condition = AND(the_condition, validity_condition)
+        def lfunction():
+            return self._data.select_map(identity, condition=the_condition,
+                                         arguments=arguments or {},
+                                         columns=self._non_big_columns)
+        rows = {}
+        for row in with_lock(self._data_lock, lfunction):
+            rows.setdefault(row[value_column].value(), []).append(row)
+        for value, key in keys.items():
+            found = rows.get(value, ())
+            # Ambiguous values are left to 'row()' to report the error.
+            if len(found) <= 1:
+                self._cache_row(key, found[0] if found else None, generation)
+
     def rows(self, transaction=None, condition=None, arguments=None, sort=()):
         """Return sequence of rows of the underlying data object.
 
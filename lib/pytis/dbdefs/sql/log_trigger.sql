@@ -62,6 +62,10 @@ begin
            values (now(), session_user, tg_table_schema, tg_table_name, tg_op, key_column_, key_value_)
            returning id into strict id_;
     insert into t_changes_detail (id, detail) values (id_, detail_);
+    -- Let the applications update the changed row instead of all data.
+    perform pg_notify(concat('__modif_', lower(tg_table_name)), concat(tg_op, ':', key_value_));
+    perform pg_notify(concat('__modif_', lower(tg_table_schema), '.', lower(tg_table_name)),
+                      concat(tg_op, ':', key_value_));
   end if;
   return null;
 end;
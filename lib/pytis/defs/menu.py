@@ -564,7 +564,7 @@ class ColnameData(pytis.data.RestrictedMemData):
             return
         self._last_argument = argument
         if argument is None:
-            self._mem_data = []
+            self._mem_clear()
             return
         import config
         resolver = config.resolver
@@ -573,11 +573,13 @@ class ColnameData(pytis.data.RestrictedMemData):
         except pytis.util.ResolverError:
             return None
         fields = specification.view_spec().fields()
-        self._mem_data = mem_data = []
+        self._mem_clear()
         for f in fields:
             label = (f.column_label() or f.label() or f.id())
-            mem_data.append(pytis.data.Row((('colname', pytis.data.sval(f.id()),),
-                                            ('label', pytis.data.sval(label),),)))
+            row = pytis.data.Row((('colname', pytis.data.sval(f.id()),),
+                                  ('label', pytis.data.sval(label),),))
+            # Bypass access rights checking of RestrictedData.insert().
+            pytis.data.MemData.insert(self, row)
         
     def row(self, key, columns=None, arguments={}, transaction=None):
         self._update_data(arguments)
@@ -105,6 +105,28 @@ def dbinsert(spec, row, transaction=None):
     return result
 
 
+def dbinsert_many(spec, rows, transaction=None):
+    """Provede hromadný insert řádků do tabulky dané specifikací.
+
+    Argumenty:
+
+      spec -- název specifikace datového objektu nad kterým má být proveden
+        insert.
+      rows -- sekvence instancí pytis.data.Row
+      transaction -- instance pytis.data.DBTransactionDefault
+
+    Řádky jsou vkládány po dávkách metodou 'insert_many()' datového objektu,
+    což je u velkého počtu řádků výrazně rychlejší než opakované volání
+    'dbinsert()'.
+
+    Vrací počet vložených řádků.
+
+    """
+    data = data_object(spec)
+    success, result = pytis.form.db_operation(data.insert_many, rows, transaction=transaction)
+    return result
+
+
 def dbupdate(row, values=(), transaction=None):
     """Provede update nad předaným řádkem.
 
@@ -127,6 +127,11 @@ class DataTable(object):
                 self._start_row = new_start
                 cache[row - new_start] = the_row
                 self._cache = cache
+        def invalidate(self, row):
+            # Unlike __setitem__ never move the cached window.
+            index = row - self._start_row
+            if 0 <= index < self._size:
+                self._cache[index] = None
             
     class _Column(object):
         def __init__(self, id_, type_, label, style):
@@ -137,6 +142,7 @@ class DataTable(object):
 
     _DEFAULT_FOREGROUND_COLOR = pytis.presentation.Color.BLACK
     _DEFAULT_BACKGROUND_COLOR = pytis.presentation.Color.WHITE
+    _PREFETCH_ROWS = 40
         
     def __init__(self, form, data, presented_row, columns, row_count,
                  sorting=(), grouping=(), prefill=None, row_style=None):
@@ -347,6 +353,25 @@ class DataTable(object):
             self._presented_row.set_row(result)
             self._current_row = self._CurrentRow(row, copy.copy(self._presented_row))
 
+    def invalidate_rows(self, rows):
+        """Forget the displayed values of given 'rows' to fetch them again.
+
+        Arguments:
+
+          rows -- sequence of row numbers within the database select
+
+        Unlike 'update()', the data select is not reinitialized, so this is
+        useful after reloading the given rows in the data object buffer.
+
+        """
+        for row in rows:
+            self._cache.invalidate(row)
+        self._group_cache = {0: False}
+        self._group_value_cache = {}
+        current = self._current_row
+        if current is not None and current.row in rows:
+            self._current_row = None
+
     def form(self):
         return self._form
     
@@ -404,33 +429,60 @@ class DataTable(object):
         #
         cached_things = self._cache[row]
         if cached_things is None:
-            the_row = self.row(row)
-            style_dict = {}
-            value_dict = {}
-            # Cache the values and styles for all columns at once.
-            for c in self._columns:
-                cid = c.id
-                s = c.style
-                if isinstance(s, collections.Callable):
-                    style_dict[cid] = s(the_row)
-                value_dict[cid] = the_row.format(cid, pretty=True, form=self._form, secure=True)
-            # Grouping column may not be in self._columns.
-            for gcol in self._grouping:
-                if gcol not in value_dict:
-                    value_dict[gcol] = the_row.format(gcol, pretty=True, form=self._form,
-                                                      secure=True)
-            # If row_style is defined, lets compute it.
-            if isinstance(self._row_style, collections.Callable):
-                protected_row = the_row.protected()
-                try:
-                    row_style = self._row_style(protected_row)
-                except protected_row.ProtectionError:
-                    row_style = None
-                style_dict[None] = row_style
-            self._cache[row] = cached_things = [value_dict, style_dict]
+            for n, the_row in self._uncached_rows(row):
+                self._cache[n] = self._row_values(the_row)
+            cached_things = self._cache[row]
         cached_row = cached_things[style and 1 or 0]
         return cached_row[col_id]
 
+    def _uncached_rows(self, row):
+        # Return the list of pairs (row_number, the_row) for 'row' and the
+        # following rows missing in the cache (or the preceding rows, when the
+        # table is scrolled up).  Codebook rows of all of them are retrieved at
+        # once, so that painting a page of the grid doesn't need a separate
+        # codebook query for each cell.
+        if row > 0 and self._cache[row - 1] is None and self._cache[row + 1] is not None:
+            step = -1
+        else:
+            step = 1
+        rows = [(row, self.row(row))]
+        n = row + step
+        while len(rows) < self._PREFETCH_ROWS and n >= 0 and self._cache[n] is None:
+            the_row = self.row(n)
+            if the_row is None:
+                break
+            rows.append((n, the_row))
+            n += step
+        keys = [c.id for c in self._columns] + list(self._grouping)
+        self._presented_row.prefetch_codebooks([r.row() for n, r in rows if r is not None],
+                                               keys=keys)
+        return rows
+
+    def _row_values(self, the_row):
+        style_dict = {}
+        value_dict = {}
+        # Cache the values and styles for all columns at once.
+        for c in self._columns:
+            cid = c.id
+            s = c.style
+            if isinstance(s, collections.Callable):
+                style_dict[cid] = s(the_row)
+            value_dict[cid] = the_row.format(cid, pretty=True, form=self._form, secure=True)
+        # Grouping column may not be in self._columns.
+        for gcol in self._grouping:
+            if gcol not in value_dict:
+                value_dict[gcol] = the_row.format(gcol, pretty=True, form=self._form,
+                                                  secure=True)
+        # If row_style is defined, lets compute it.
+        if isinstance(self._row_style, collections.Callable):
+            protected_row = the_row.protected()
+            try:
+                row_style = self._row_style(protected_row)
+            except protected_row.ProtectionError:
+                row_style = None
+            style_dict[None] = row_style
+        return [value_dict, style_dict]
+
     def edit_row(self, row):
         """Zahaj editaci řádku číslo 'row'.
         
@@ -494,7 +546,10 @@ class DataTable(object):
         if isinstance(self._row_count, int):
             count, finished = self._row_count, True
         else:
-            count, finished = self._row_count.count(min_value=min_value, timeout=timeout)
+            # Unless a minimal number of rows is required, the planner's
+            # estimate may be used until the row counting finishes.
+            count, finished = self._row_count.count(min_value=min_value, timeout=timeout,
+                                                    estimated=(min_value is None))
             if finished:
                 self._row_count = count
         if self._edited_row is not None and self._edited_row.the_row.new():
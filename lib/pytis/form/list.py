@@ -32,10 +32,10 @@ wxWindows.
 
 import collections
 import copy
-import cStringIO
 import datetime
 import functools
 import string
+import thread
 import time
 import types
 
@@ -51,7 +51,8 @@ from pytis.presentation import Action, ActionGroup, AggregatedView, \
     FormType, Link, TextFormat, ViewSpec
 from pytis.util import ACTION, DEBUG, EVENT, OPERATIONAL, \
     Attribute, ProgramError, ResolverError, SimpleCache, Structure, \
-    UNDEFINED, compare_objects, find, form_view_data, log, sameclass
+    UNDEFINED, compare_objects, find, form_view_data, log, remove_duplicates, sameclass, \
+    with_lock
 import pytis.remote
 from dialog import AggregationSetupDialog, Error, InputNumeric, MultiQuestion, Question
 from event import UserBreakException, wx_callback
@@ -118,7 +119,7 @@ class ListForm(RecordForm, TitledForm, Refreshable):
             if action.hotkey():
                 self.define_key(action.hotkey(), self.COMMAND_CONTEXT_ACTION, dict(action=action))
         # Závěrečné akce
-        self._data.add_callback_on_change(self.on_data_change)
+        self._data.add_callback_on_row_change(self._on_data_row_change)
         wx_callback(wx.EVT_SIZE, self, self._on_size)
         self._select_cell(row=self._get_row_number(self._row.row()))
         self.set_callback(ListForm.CALL_ACTIVATION, self._on_activation)
@@ -137,6 +138,8 @@ class ListForm(RecordForm, TitledForm, Refreshable):
         self._selection_callback_tick = None
         self._in_select_cell = False
         self._last_reshuffle_request = self._reshuffle_request = 0
+        self._updated_keys = []
+        self._updated_keys_lock = thread.allocate_lock()
         self._current_editor = None
         self._column_to_move = None
         self._column_move_target = None
@@ -168,16 +171,27 @@ class ListForm(RecordForm, TitledForm, Refreshable):
         return isinstance(type, allowed_types)
 
     def _get_aggregation_result(self, key):
-        cid, operation = key
-        c = self._data.find_column(cid)
-        if ((c is not None and
-             self._aggregation_valid(operation, c.type()) and
-             self._row.permitted(cid, pytis.data.Permission.VIEW))):
-            return self._data.select_aggregate((operation, cid),
-                                               condition=self._current_condition(),
-                                               transaction=self._open_transaction(),
-                                               arguments=self._current_arguments())
-        return None
+        # Compute the results of all displayed aggregations by a single query
+        # and store them in the cache together with the requested result.
+        keys = [(c.id(), operation) for operation in self._aggregations for c in self._columns]
+        if key not in keys:
+            keys.append(key)
+        valid_keys = []
+        for cid, operation in keys:
+            c = self._data.find_column(cid)
+            if ((c is not None and
+                 self._aggregation_valid(operation, c.type()) and
+                 self._row.permitted(cid, pytis.data.Permission.VIEW))):
+                valid_keys.append((cid, operation))
+        values = self._data.select_aggregates([(operation, cid) for cid, operation in valid_keys],
+                                              condition=self._current_condition(),
+                                              transaction=self._open_transaction(),
+                                              arguments=self._current_arguments())
+        results = dict(zip(valid_keys, values))
+        for k in keys:
+            if k != key:
+                self._aggregation_results[k] = results.get(k)
+        return results.get(key)
         
     def _init_columns(self, columns=None):
         if not columns:
@@ -1051,9 +1065,42 @@ class ListForm(RecordForm, TitledForm, Refreshable):
         self._reshuffle_request = max(now, maybe_future)
         self._show_data_status()
 
+    def _on_data_row_change(self, changes):
+        # Called from the notification thread, so only remember the updated keys
+        # here and let _on_idle patch the displayed rows.
+        if changes and all(operation == 'UPDATE' for operation, key in changes):
+            def lfunction():
+                self._updated_keys.extend([key for operation, key in changes])
+            with_lock(self._updated_keys_lock, lfunction)
+        else:
+            self.on_data_change()
+
+    def _reload_updated_rows(self):
+        # Replace the rows updated by others in the grid without reselecting
+        # the whole form data.  Fall back to the standard refresh when the
+        # rows can't be patched (e.g. they are not in the data object buffer
+        # or they no longer match the form's condition or sorting).
+        if not self._updated_keys or self._table.editing():
+            return
+        def lfunction():
+            keys = remove_duplicates(self._updated_keys)
+            self._updated_keys = []
+            return keys
+        keys = with_lock(self._updated_keys_lock, lfunction)
+        success, positions = db_operation(self._data.reload_buffered_rows, keys)
+        if not success or positions is None or len(positions) < len(keys):
+            self.on_data_change()
+        else:
+            # The aggregation results may be affected by the changed values.
+            self._aggregation_results.reset()
+            self._table.invalidate_rows(positions)
+            self._grid.Refresh()
+            self._grid.GetGridColLabelWindow().Refresh()
+
     def _on_idle(self, event):
         if super(ListForm, self)._on_idle(event):
             return True
+        self._reload_updated_rows()
         if is_busy_cursor() or current_form() is not self:
             # Prevent blocking the idle method of a popup form opened on top of the current form,
             # such as PopupEditForm or Codebook.
@@ -1786,7 +1833,7 @@ class ListForm(RecordForm, TitledForm, Refreshable):
                 self._table.close()
 
     def _cleanup_data(self):
-        self._data.remove_callback_on_change(self.on_data_change)
+        self._data.remove_callback_on_row_change(self._on_data_row_change)
         super(ListForm, self)._cleanup_data()
 
     # Zpracování příkazů
@@ -2237,17 +2284,45 @@ class ListForm(RecordForm, TitledForm, Refreshable):
         if export_function(export_file) and remote:
             pytis.remote.launch_file(filename.name())
 
+    def _export_data_object(self):
+        # Database rows are exported by a dedicated data object (the form's
+        # data object select must be kept), but in-memory data objects are
+        # filled at runtime, so only the form's own instance has the rows.
+        if isinstance(self._data, pytis.data.DBData):
+            return self._create_data_object()
+        else:
+            return self._data
+
+    def _export_rows(self, exporter, export_file):
+        # Export the rows of the current select with progress dialog.
+        number_rows = self._table.number_of_rows()
+        def progress(update, n):
+            # The number of rows may have changed since the last refresh.
+            if number_rows:
+                return update(min(100, int(float(n) / number_rows * 100)))
+            else:
+                return update(100)
+        def _process_table(update):
+            exporter.export(export_file, condition=self._current_condition(display=True),
+                            sort=self._lf_sorting, arguments=self._current_arguments(),
+                            transaction=self._open_transaction(),
+                            progress=lambda n: progress(update, n))
+        try:
+            pytis.form.run_dialog(pytis.form.ProgressDialog, _process_table)
+        finally:
+            if not isinstance(self._data, pytis.data.DBData):
+                # The export closed the form's own select.
+                self._init_select()
+
     def _cmd_export_csv(self, filename):
         log(EVENT, 'Called CSV export')
-        column_list = [(c.id(), self._row.type(c.id())) for c in self._columns]
         export_encoding = config.export_encoding
-        db_encoding = 'utf-8'
         try:
             u"test".encode(export_encoding)
         except:
             msg = '\n'.join(_("Encoding %s not supported.", export_encoding),
                             _("Exported data will not be recoded."))
-            export_encoding = None
+            export_encoding = 'utf-8'
             run_dialog(Error, msg)
         if isinstance(filename, basestring):
             try:
@@ -2258,103 +2333,24 @@ class ListForm(RecordForm, TitledForm, Refreshable):
                 return False
         else:
             export_file = filename
-        number_rows = self._table.number_of_rows()
-        def _process_table(update):
-            # We buffer exported data before writing them to the file in order
-            # to prevent numerous rpc calls in case of remote export.
-            csv_buffer = cStringIO.StringIO()
-            for column in self._columns:
-                label = column.column_label()
-                if label is None:
-                    label = column.label()
-                if export_encoding and export_encoding != db_encoding:
-                    if not isinstance(label, unicode):
-                        label = unicode(label, db_encoding)
-                    label = label.encode(export_encoding)
-                csv_buffer.write(label + '\t')
-            csv_buffer.write('\n')
-            for r in range(0, number_rows):
-                if not update(int(float(r) / number_rows * 100)):
-                    break
-                for cid, ctype in column_list:
-                    presented_row = self._table.row(r)
-                    if isinstance(ctype, pytis.data.Float):
-                        s = presented_row.format(cid, secure=True, locale_format=False)
-                    else:
-                        s = presented_row.format(cid, secure=True)
-                    if export_encoding and export_encoding != db_encoding:
-                        if not isinstance(s, unicode):
-                            s = unicode(s, db_encoding)
-                        s = s.encode(export_encoding)
-                    csv_buffer.write(';'.join(s.split('\n')) + '\t')
-                csv_buffer.write('\n')
-            export_file.write(csv_buffer.getvalue())
+        exporter = pytis.presentation.CSVExporter(self.record(None), self._export_data_object(),
+                                                  [c.id() for c in self._columns],
+                                                  encoding=export_encoding)
+        try:
+            self._export_rows(exporter, export_file)
+        finally:
             export_file.close()
-        pytis.form.run_dialog(pytis.form.ProgressDialog, _process_table)
         return True
         
     def _cmd_export_xls(self, filename):
         log(EVENT, 'Called XLS export')
-        column_list = [(c.id(), self._row.type(c.id())) for c in self._columns]
-        import datetime
-        import pyExcelerator as pyxls
-        number_rows = self._table.number_of_rows()
-        def _process_table(update):
-            w = pyxls.Workbook()
-            ws = w.add_sheet('Export')
-            # Export labelů
-            for i, column in enumerate(self._columns):
-                label = column.column_label()
-                if label is None:
-                    label = column.label()
-                ws.write(0, i, unicode(label))
-            default_style = pyxls.XFStyle()
-            w.add_style(default_style)
-            # Styles
-            column_styles = {}
-            for cid, ctype in column_list:
-                st = pyxls.XFStyle()
-                if isinstance(ctype, pytis.data.Float):
-                    precision = ctype.precision()
-                    if precision and precision > 0:
-                        fmt = "0." + "0" * precision
-                    else:
-                        fmt = "general"
-                    st.num_format_str = fmt
-                elif isinstance(ctype, pytis.data.Date):
-                    st.num_format_str = "D.M.YYYY"
-                elif isinstance(ctype, pytis.data.Time):
-                    st.num_format_str = "h:mm:ss"
-                elif isinstance(ctype, pytis.data.DateTime):
-                    st.num_format_str = "D.M.YYYY h:mm:ss"
-                column_styles[cid] = st
-                w.add_style(st)
-            for r in range(0, number_rows):
-                if not update(int(float(r) / number_rows * 100)):
-                    break
-                presented_row = self._table.row(r)
-                for j, (cid, ctype) in enumerate(column_list):
-                    value = presented_row.get(cid, secure=True)
-                    if value and value.value() is not None:
-                        v = value.value()
-                        if isinstance(ctype, pytis.data.Float):
-                            s = float(v)
-                        else:
-                            if isinstance(ctype, pytis.data.Date):
-                                s = datetime.date(v.year, v.month, v.day)
-                            elif isinstance(ctype, pytis.data.Time):
-                                s = datetime.time(v.hour, v.minute, int(v.second))
-                            elif isinstance(ctype, pytis.data.DateTime):
-                                s = v.strftime(pytis.data.DateTime.CZECH_FORMAT)
-                            else:
-                                s = ';'.join(presented_row.format(cid, secure=True).split('\n'))
-                        ws.write(r + 1, j, s, column_styles[cid])
-            w.save(filename)
-            if not isinstance(filename, basestring):
-                # This is necessary to prevent truncation of the file in some
-                # cases as pyxls doesn't close the file.
-                filename.close()
-        pytis.form.run_dialog(pytis.form.ProgressDialog, _process_table)
+        exporter = pytis.presentation.XLSExporter(self.record(None), self._export_data_object(),
+                                                  [c.id() for c in self._columns])
+        self._export_rows(exporter, filename)
+        if not isinstance(filename, basestring):
+            # This is necessary to prevent truncation of the file in some
+            # cases as pyxls doesn't close the file.
+            filename.close()
         return True
         
     def _cmd_insert_line(self, before=False, copy=False):
@@ -30,6 +30,7 @@ různého druhu do stringové podoby nebo formátování stringového textu.
 from spec import *
 from field import *
 from types_ import PrettyType, PrettyTreeOrder, PrettyFoldable
+from export import Exporter, CSVExporter, XLSExporter
 
 for file in (spec, field):
     file.__dict__.update(globals())
@@ -266,6 +266,36 @@ class PresentedRow(unittest.TestCase):
         self.assertTrue(enabled[0])
         row['c'] = self._value('c', 2)
         self.assertFalse(enabled[0])
+    def test_dependency_graph(self):
+        calls = []
+        def editable(row):
+            calls.append(row['inc'].value())
+            return True
+        fields = self._fields + (pp.Field('x', type=pd.Integer(), virtual=True,
+                                          editable=pp.Computer(editable, depends=('inc',))),)
+        row = pp.PresentedRow(fields, self._data, None, new=True, prefill={'b': 3})
+        row2 = pp.PresentedRow(fields, self._data, None, new=True)
+        self.assertIs(row._dependent, row2._dependent)
+        self.assertEqual(row._dependent['c'], ('d', 'sum', 'inc'))
+        changed = []
+        for id in ('d', 'sum', 'inc'):
+            row.register_callback(row.CALL_CHANGE, id, lambda id=id: changed.append(id))
+        row['c'] = self._value('c', 100)
+        self.assertEqual(changed, ['d', 'sum', 'inc'])
+        # Editability without a callback is only computed on demand.
+        self.assertEqual(calls, [])
+        self.assertTrue(row.editable('x'))
+        self.assertTrue(row.editable('x'))
+        self.assertEqual(calls, [104])
+    def test_row_schema(self):
+        row = pp.PresentedRow(self._fields, self._data, None)
+        row2 = pp.PresentedRow(self._fields, self._data, None, new=True, prefill={'b': 3})
+        self.assertIs(row._coldict, row2._coldict)
+        self._check_values(row2, (('sum', 8), ('inc', 9)))
+        data = pd.Data(self._columns, self._columns[0])
+        row3 = pp.PresentedRow(self._fields, data, None)
+        self.assertIsNot(row._coldict, row3._coldict)
+        self.assertEqual(row.keys(), row3.keys())
     def test_has_key(self):
         row = pp.PresentedRow(self._fields, self._data, None)
         self.assertIn('a', row)
@@ -320,6 +350,38 @@ class PresentedRow(unittest.TestCase):
         self.assertEqual(row.display('b'), 'SECOND')
         self.assertEqual(row.display('c'), '-3-')
         self.assertEqual(row.display('d'), 'first')
+    def test_prefetch_codebooks(self):
+        C = pd.ColumnSpec
+        S = pd.String
+        V = pd.Value
+        rows = [pd.Row((('x', V(S(), x)), ('y', V(S(), y))))
+                for x, y in (('1', 'FIRST'), ('2', 'SECOND'), ('3', 'THIRD'))]
+        edata = pd.DataFactory(pd.MemData, (C('x', S()), C('y', S())), data=rows)
+        enum = pd.DataEnumerator(edata)
+        key = C('a', pd.Integer())
+        columns = (key, C('b', S(enumerator=enum)))
+        data = pd.Data(columns, key)
+        fields = (Field('a'),
+                  Field('b', display='y'),
+                  Field('c', virtual=True, computer=pp.CbComputer('b', 'y')))
+        row = pp.PresentedRow(fields, data, None)
+        selects = []
+        select = enum._data.select
+        def counting_select(*args, **kwargs):
+            selects.append(kwargs.get('condition'))
+            return select(*args, **kwargs)
+        enum._data.select = counting_select
+        data_rows = [pd.Row((('a', V(pd.Integer(), i)), ('b', V(S(), x))))
+                     for i, x in ((1, '3'), (2, '1'), (3, '3'), (4, None))]
+        row.prefetch_codebooks(data_rows + [None], keys=('a', 'c'))
+        self.assertEqual(len(selects), 1)
+        result = []
+        for data_row in data_rows:
+            row.set_row(data_row)
+            result.append((row.display('b'), row['c'].value()))
+        self.assertEqual(result, [('THIRD', 'THIRD'), ('FIRST', 'FIRST'),
+                                  ('THIRD', 'THIRD'), ('', None)])
+        self.assertEqual(len(selects), 1)
     def test_depends(self):
         row = pp.PresentedRow(self._fields, self._data, None)
         any = ('a', 'b', 'c', 'd', 'e', 'sum', 'inc')
@@ -333,6 +395,30 @@ class PresentedRow(unittest.TestCase):
         self.assertTrue(row.depends('sum', ('inc', 'd')))
         self.assertFalse(row.depends('sum', ('a', 'b', 'c', 'e', 'sum')))
         self.assertFalse(row.depends('inc', any))
+    def test_csv_export(self):
+        import cStringIO
+        rows = [self._data_row(a=i, b=b, c=c, r=r)
+                for i, b, c, r in ((1, 10, 2, (1, 5)), (2, None, 3, None), (3, 4, 5, (2, 3)))]
+        data = pd.MemData(self._columns, data=rows)
+        fields = [f.clone(pp.Field(f.id(), label=f.id().upper())) for f in self._fields]
+        row = pp.PresentedRow(fields, data, None)
+        exporter = pp.CSVExporter(row, data, ('a', 'b', 'sum', 'r'))
+        exporter._CHUNK_SIZE = 2
+        f = cStringIO.StringIO()
+        chunks = []
+        def progress(n):
+            chunks.append(n)
+            return True
+        self.assertEqual(exporter.export(f, sort=(('a', pd.DESCENDANT),), progress=progress), 3)
+        self.assertEqual(chunks, [2, 3])
+        self.assertEqual(f.getvalue(), ('A\tB\tSUM\tR\t\n'
+                                        '3\t4\t9\t2 \xe2\x80\x94 3\t\n'
+                                        '2\t\t0\t\t\n'
+                                        '1\t10\t12\t1 \xe2\x80\x94 5\t\n'))
+        f = cStringIO.StringIO()
+        self.assertEqual(exporter.export(f, condition=pd.GT('a', self._value('a', 1)),
+                                         progress=lambda n: False), 2)
+        self.assertEqual(f.getvalue().count('\n'), 3)
         
 tests.add(PresentedRow)
 
@@ -0,0 +1,402 @@
+# -*- coding: utf-8 -*-
+
+# Copyright (C) 2002-2015 Brailcom, o.p.s.
+#
+# This program is free software; you can redistribute it and/or modify
+# it under the terms of the GNU General Public License as published by
+# the Free Software Foundation; either version 2 of the License, or
+# (at your option) any later version.
+#
+# This program is distributed in the hope that it will be useful,
+# but WITHOUT ANY WARRANTY; without even the implied warranty of
+# MERCHANTABILITY or FITNESS FOR A PARTICULAR PURPOSE.  See the
+# GNU General Public License for more details.
+#
+# You should have received a copy of the GNU General Public License
+# along with this program; if not, write to the Free Software
+# Foundation, Inc., 59 Temple Place, Suite 330, Boston, MA  02111-1307  USA
+
+"""Export of table data into files.
+
+The exporters read the rows directly from a data object select and write them
+to the target file in chunks, independently of any user interface.
+
+"""
+
+import datetime
+import re
+
+import pytis.data
+from field import PresentedRow
+
+
+class Exporter(object):
+    """Streaming export of data object rows into a file.
+
+    The rows are retrieved by 'pytis.data.Data.select_map()', i.e. through a
+    database cursor in batches for database data objects, and written to the
+    file in chunks of '_CHUNK_SIZE' rows.  So the memory consumption doesn't
+    depend on the number of exported rows (unless the file format itself
+    requires keeping the whole file in memory) and remote files get only a
+    few large writes.
+
+    The cell formatting functions are prepared for all the exported columns
+    once before the export.  Values of ordinary data columns are taken
+    directly from the data rows, only computed fields and fields with a custom
+    formatter are formatted through the 'PresentedRow' instance.
+
+    This is an abstract class, the file format is defined by subclasses.
+
+    """
+    _CHUNK_SIZE = 1000
+
+    class _Abort(Exception):
+        pass
+
+    def __init__(self, row, data, columns):
+        """Arguments:
+
+          row -- 'PresentedRow' instance of the exported fields; its current
+            data are replaced by the exported rows during the export, so the
+            row must not be used for anything else
+          data -- data object to export the rows from; its select is used
+            during the export, so it should be a data object created for this
+            purpose rather than the data object of a form
+          columns -- sequence of identifiers of the exported fields
+
+        """
+        assert isinstance(row, PresentedRow), row
+        self._row = row
+        self._data = data
+        self._columns = tuple(columns)
+        self._field_dict = dict([(f.id(), f) for f in row.fields()])
+        self._row_needed = False
+
+    def _computed(self, cid):
+        # Return true if the field value must be computed or formatted through
+        # the presented row.
+        field = self._field_dict[cid]
+        return (self._data.find_column(cid) is None or field.virtual() or
+                field.formatter() is not None or
+                isinstance(self._row.type(cid), pytis.data.Range))
+
+    def _select_columns(self):
+        if self._row_needed:
+            # Computers may need any column, only big values are avoided.
+            return [c.id() for c in self._data.columns()
+                    if not isinstance(c.type(), pytis.data.Big) or c.id() in self._columns]
+        else:
+            return list(self._columns)
+
+    def _value_function(self, cid):
+        """Return function returning the value of field 'cid' of a data row.
+
+        The function returns a 'pytis.data.Value' instance or 'None' if the
+        user is not allowed to view the field.
+
+        """
+        if not self._row.permitted(cid, pytis.data.Permission.VIEW):
+            return lambda data_row: None
+        elif self._computed(cid):
+            self._row_needed = True
+            row = self._row
+            return lambda data_row: row[cid]
+        else:
+            return lambda data_row: data_row[cid]
+
+    def _format_function(self, cid, **kwargs):
+        """Return function formatting the field 'cid' of a data row.
+
+        The function returns the same string as 'PresentedRow.format()' with
+        the 'secure' argument set to true and given 'kwargs' would return for
+        the data row.
+
+        """
+        if not self._row.permitted(cid, pytis.data.Permission.VIEW):
+            secret = self._row.type(cid).secret_export()
+            return lambda data_row: secret
+        elif self._computed(cid):
+            self._row_needed = True
+            row = self._row
+            return lambda data_row: row.format(cid, secure=True, **kwargs)
+        elif kwargs:
+            return lambda data_row: data_row[cid].export(**kwargs)
+        else:
+            return lambda data_row: data_row[cid].export()
+
+    def _label(self, field):
+        label = field.column_label()
+        if label is None:
+            label = field.label()
+        return label or ''
+
+    def _cell_function(self, cid):
+        """Return function returning the exported cell of field 'cid' of a data row."""
+        raise Exception("Volána neimplementovaná metoda")
+
+    def _start(self, file, labels):
+        """Start the export to 'file', 'labels' are the column labels."""
+        pass
+
+    def _write(self, file, rows):
+        """Write 'rows' to 'file'; a row is a list of results of cell functions."""
+        raise Exception("Volána neimplementovaná metoda")
+
+    def _finish(self, file):
+        """Finish the export to 'file'."""
+        pass
+
+    def export(self, file, condition=None, sort=(), arguments={}, transaction=None,
+               progress=None):
+        """Export the rows of the data object to 'file'.
+
+        Arguments:
+
+          file -- file like object with the 'write()' method; the file is not
+            closed by the exporter
+          condition, sort, arguments, transaction -- the same as in
+            'pytis.data.Data.select()'
+          progress -- function of one argument called after each written chunk
+            of rows with the number of rows exported so far or 'None'.  If it
+            returns false, the export is stopped.
+
+        Returns the number of exported rows.
+
+        """
+        self._row_needed = False
+        functions = [self._cell_function(cid) for cid in self._columns]
+        row = self._row
+        row_needed = self._row_needed
+        chunk = []
+        counter = [0]
+        def flush():
+            self._write(file, chunk)
+            counter[0] += len(chunk)
+            del chunk[:]
+            if progress is not None and not progress(counter[0]):
+                raise self._Abort()
+        def export_row(data_row):
+            if row_needed:
+                row.set_row(data_row)
+            chunk.append([f(data_row) for f in functions])
+            if len(chunk) >= self._CHUNK_SIZE:
+                flush()
+        self._start(file, [self._label(self._field_dict[cid]) for cid in self._columns])
+        kwargs = dict(arguments=arguments) if arguments else {}
+        try:
+            self._data.select_map(export_row, condition=condition, sort=sort,
+                                  columns=self._select_columns(), transaction=transaction,
+                                  **kwargs)
+            if chunk:
+                flush()
+        except self._Abort:
+            pass
+        self._finish(file)
+        return counter[0]
+
+
+class _CopyWriter(object):
+    # File like object receiving rows in the PostgreSQL 'COPY' text format
+    # (tab separated, backslash escapes, empty nulls) and writing them to the
+    # target file in the 'CSVExporter' format.  'COPY' output arrives row by
+    # row, so the rows are collected to chunks to keep the number of writes to
+    # (possibly remote) files low.
+
+    _ESCAPE_REGEXP = re.compile(r'\\(.)')
+    _ESCAPES = {'n': ';', 't': '\t', 'r': '\r', 'b': '\b', 'f': '\f', 'v': '\v'}
+
+    def __init__(self, file, header, encoding, chunk_size, progress):
+        self._file = file
+        self._header = header
+        self._encoding = encoding
+        self._chunk_size = chunk_size
+        self._progress = progress
+        self._lines = []
+        self._rest = ''
+        self._count = 0
+        self._stopped = False
+
+    def _unescape(self, match):
+        c = match.group(1)
+        return self._ESCAPES.get(c, c)
+
+    def write(self, data):
+        if self._stopped:
+            # There is no safe way to interrupt COPY, so the remaining rows
+            # are just ignored.
+            return
+        lines = (self._rest + data).split('\n')
+        self._rest = lines.pop()
+        for line in lines:
+            if '\\' in line:
+                line = self._ESCAPE_REGEXP.sub(self._unescape, line)
+            if self._encoding != 'utf-8':
+                line = unicode(line, 'utf-8').encode(self._encoding)
+            self._lines.append(line + '\t\n')
+            if len(self._lines) >= self._chunk_size:
+                self.flush()
+
+    def flush(self):
+        if (self._lines or self._header) and not self._stopped:
+            self._file.write(self._header + ''.join(self._lines))
+            self._header = ''
+            self._count += len(self._lines)
+            self._lines = []
+            if self._progress is not None and not self._progress(self._count):
+                self._stopped = True
+
+    def count(self):
+        return self._count
+
+
+class CSVExporter(Exporter):
+    """Export into a text file with tab separated columns.
+
+    The first line contains column labels.  Line breaks within values are
+    replaced by semicolons.
+
+    If all the exported columns are plain string or integer data columns, the
+    data object supports 'pytis.data.Data.copy_out()' and the user may view
+    all of them, the rows are exported by the data source directly, without
+    formatting values in Python.  The output is the same in both cases.
+
+    """
+    _COPY_TYPES = (pytis.data.String, pytis.data.Name, pytis.data.Integer,
+                   pytis.data.SmallInteger, pytis.data.LargeInteger, pytis.data.Serial,
+                   pytis.data.LargeSerial)
+
+    def __init__(self, row, data, columns, encoding='utf-8'):
+        """Arguments:
+
+          encoding -- encoding of the output file, name of a Python codec
+          other arguments -- the same as in the parent class
+
+        """
+        super(CSVExporter, self).__init__(row, data, columns)
+        self._encoding = encoding
+
+    def _cell_function(self, cid):
+        if isinstance(self._row.type(cid), pytis.data.Float):
+            return self._format_function(cid, locale_format=False)
+        else:
+            return self._format_function(cid)
+
+    def _encode(self, value):
+        if not isinstance(value, unicode):
+            value = unicode(value, 'utf-8')
+        return value.encode(self._encoding)
+
+    def _line(self, values):
+        return ''.join([self._encode(';'.join(v.split('\n'))) + '\t' for v in values]) + '\n'
+
+    def _header(self, labels):
+        return ''.join([self._encode(label) + '\t' for label in labels]) + '\n'
+
+    def _start(self, file, labels):
+        file.write(self._header(labels))
+
+    def _write(self, file, rows):
+        file.write(''.join([self._line(values) for values in rows]))
+
+    def _copy_possible(self):
+        for cid in self._columns:
+            if ((self._computed(cid) or
+                 not self._row.permitted(cid, pytis.data.Permission.VIEW) or
+                 type(self._row.type(cid)) not in self._COPY_TYPES)):
+                return False
+        return True
+
+    def export(self, file, condition=None, sort=(), arguments={}, transaction=None,
+               progress=None):
+        if self._copy_possible():
+            header = self._header([self._label(self._field_dict[cid]) for cid in self._columns])
+            writer = _CopyWriter(file, header, self._encoding, self._CHUNK_SIZE, progress)
+            kwargs = dict(arguments=arguments) if arguments else {}
+            try:
+                self._data.copy_out(writer, condition=condition, sort=sort,
+                                    columns=list(self._columns), format='text', null='',
+                                    transaction=transaction, **kwargs)
+            except pytis.data.Data.UnsupportedOperation:
+                pass
+            else:
+                writer.flush()
+                return writer.count()
+        return super(CSVExporter, self).export(file, condition=condition, sort=sort,
+                                               arguments=arguments, transaction=transaction,
+                                               progress=progress)
+
+
+class XLSExporter(Exporter):
+    """Export into an XLS spreadsheet using the 'pyExcelerator' library.
+
+    Numbers, dates and times are stored as typed cells with corresponding
+    formats, other values as formatted strings.  The library keeps the whole
+    workbook in memory until it is saved at the end of the export.
+
+    """
+
+    def _cell_function(self, cid):
+        ctype = self._row.type(cid)
+        value_function = self._value_function(cid)
+        if isinstance(ctype, pytis.data.Float):
+            convert = float
+        elif isinstance(ctype, pytis.data.Date):
+            convert = lambda v: datetime.date(v.year, v.month, v.day)
+        elif isinstance(ctype, pytis.data.Time):
+            convert = lambda v: datetime.time(v.hour, v.minute, int(v.second))
+        elif isinstance(ctype, pytis.data.DateTime):
+            convert = lambda v: v.strftime(pytis.data.DateTime.CZECH_FORMAT)
+        else:
+            format_function = self._format_function(cid)
+            convert = None
+        def cell(data_row):
+            value = value_function(data_row)
+            if value is None or value.value() is None:
+                return None
+            elif convert is not None:
+                return convert(value.value())
+            else:
+                return ';'.join(format_function(data_row).split('\n'))
+        return cell
+
+    def _style(self, ctype):
+        import pyExcelerator as pyxls
+        style = pyxls.XFStyle()
+        if isinstance(ctype, pytis.data.Float):
+            precision = ctype.precision()
+            if precision and precision > 0:
+                style.num_format_str = "0." + "0" * precision
+            else:
+                style.num_format_str = "general"
+        elif isinstance(ctype, pytis.data.Date):
+            style.num_format_str = "D.M.YYYY"
+        elif isinstance(ctype, pytis.data.Time):
+            style.num_format_str = "h:mm:ss"
+        elif isinstance(ctype, pytis.data.DateTime):
+            style.num_format_str = "D.M.YYYY h:mm:ss"
+        return style
+
+    def _start(self, file, labels):
+        import pyExcelerator as pyxls
+        self._workbook = workbook = pyxls.Workbook()
+        self._worksheet = worksheet = workbook.add_sheet('Export')
+        for i, label in enumerate(labels):
+            worksheet.write(0, i, unicode(label))
+        workbook.add_style(pyxls.XFStyle())
+        self._styles = [self._style(self._row.type(cid)) for cid in self._columns]
+        for style in self._styles:
+            workbook.add_style(style)
+        self._row_number = 1
+
+    def _write(self, file, rows):
+        worksheet = self._worksheet
+        styles = self._styles
+        for values in rows:
+            for j, value in enumerate(values):
+                if value is not None:
+                    worksheet.write(self._row_number, j, value, styles[j])
+            self._row_number += 1
+
+    def _finish(self, file):
+        self._workbook.save(file)
+        self._workbook = self._worksheet = None
@@ -26,15 +26,82 @@ not its concrete representation (input widget).
 import collections
 import copy
 import string
+import weakref
 
 import pytis.data
-from pytis.util import ProgramError, Resolver, \
+from pytis.util import LimitedCache, ProgramError, Resolver, \
     argument_names, positive_id, remove_duplicates, translations
 from spec import CbComputer, CodebookSpec, Computer, Editable
 from types_ import PrettyType
 
 _ = translations('pytis-data')
 
+
+class _Dependencies(object):
+    """Dependency graph of computed field properties for a given set of fields.
+
+    The graph only depends on field specifications, so it is created once for
+    a sequence of fields and shared by all 'PresentedRow' instances using the
+    same fields (see '_dependencies').
+
+    Each of the dictionaries 'dependent', 'editability_dependent',
+    'visibility_dependent', 'runtime_filter_dependent' and
+    'runtime_arguments_dependent' maps field identifiers to tuples of
+    identifiers of fields whose value (or the given property) depends on the
+    field directly or transitively.  The tuples of 'dependent' are sorted
+    topologically, so each computed field comes after all computed fields it
+    depends on.
+
+    """
+    def __init__(self, fields):
+        computers = dict([(f.id(), f.computer()) for f in fields])
+        order = []
+        visited = set()
+        def visit(key):
+            if key not in visited:
+                visited.add(key)
+                computer = computers[key]
+                if computer is not None:
+                    for dep in computer.depends():
+                        visit(dep)
+                    order.append(key)
+        for f in fields:
+            visit(f.id())
+        position = dict([(key, i) for i, key in enumerate(order)])
+        closures = {}
+        def all_deps(computer):
+            result = set()
+            for key in computer.depends():
+                result.add(key)
+                if key not in closures:
+                    dep_computer = computers[key]
+                    closures[key] = dep_computer and all_deps(dep_computer) or set()
+                result |= closures[key]
+            return result
+        def make_deps(attribute, sort=False):
+            keys = []
+            dependent = {}
+            for f in fields:
+                computer = getattr(f, attribute)()
+                if isinstance(computer, Computer):
+                    key = f.id()
+                    keys.append(key)
+                    for dep in all_deps(computer):
+                        dependent.setdefault(dep, []).append(key)
+            if sort:
+                for dependencies in dependent.values():
+                    dependencies.sort(key=lambda k: position[k])
+            return tuple(keys), dict([(k, tuple(v)) for k, v in dependent.items()])
+        self.computed, self.dependent = make_deps('computer', sort=True)
+        self.editable, self.editability_dependent = make_deps('editable')
+        self.visible, self.visibility_dependent = make_deps('visible')
+        self.runtime_filter, self.runtime_filter_dependent = make_deps('runtime_filter')
+        self.runtime_arguments, self.runtime_arguments_dependent = \
+            make_deps('runtime_arguments')
+
+_dependencies = LimitedCache(_Dependencies, limit=500)
+"""Dependency graphs of field sets keyed by tuples of 'Field' instances."""
+
 class PresentedRow(object):
     """A record of presented data.
 
@@ -110,6 +177,34 @@ class PresentedRow(object):
             self.is_range = isinstance(type, pytis.data.Range)
         def __str__(self):
             return "<_Column id='%s' type='%s' virtual='%s'>" % (self.id, self.type, self.virtual)
+
+    class _Schema(object):
+        # Field metadata shared by all rows with the same fields, data object,
+        # resolver and user's access groups.  Must not be modified after
+        # creation.
+        def __init__(self, row, fields, data, resolver):
+            self.columns = columns = tuple([row._Column(f, row._type(f), data, resolver)
+                                            for f in fields])
+            self.coldict = coldict = dict([(c.id, c) for c in columns])
+            self.completer_cache = {}
+            self.dependencies = dependencies = _dependencies[tuple(fields)]
+            def add_secret(column):
+                for key in dependencies.dependent.get(column.id, []):
+                    column = coldict[key]
+                    if not column.secret_computer:
+                        column.secret_computer = True
+                        add_secret(column)
+            restricted = isinstance(data, pytis.data.RestrictedData)
+            for column in columns:
+                if column.virtual:
+                    secret = column.secret_computer
+                else:
+                    secret = restricted and not data.permitted(column.id,
+                                                               pytis.data.Permission.VIEW)
+                if secret:
+                    add_secret(column)
+
+    _schemas = weakref.WeakKeyDictionary()
     
     def __init__(self, fields, data, row, prefill=None, singleline=False, new=False,
                  resolver=None, transaction=None):
@@ -161,14 +256,32 @@ class PresentedRow(object):
         self._validated_fields = []
         self._transaction = transaction
         self._resolver = resolver or pytis.util.resolver()
-        self._columns = columns = tuple([self._Column(f, self._type(f), data, self._resolver)
-                                         for f in fields])
-        self._coldict = dict([(c.id, c) for c in columns])
-        self._completer_cache = {}
+        self._schema = schema = self._row_schema()
+        self._columns = schema.columns
+        self._coldict = schema.coldict
+        self._completer_cache = schema.completer_cache
         self._protected = False
         self._init_dependencies()
         self._set_row(row, reset=True, prefill=prefill)
 
+    def _row_schema(self):
+        # Return the shared '_Schema' instance for this row, creating it if necessary.
+        data = self._data
+        if isinstance(data, pytis.data.RestrictedData):
+            groups = data.access_groups()
+            if groups is not None:
+                groups = tuple(groups)
+        else:
+            groups = None
+        key = (tuple(self._fields), self._resolver, groups)
+        schemas = self._schemas.get(data)
+        if schemas is None:
+            schemas = self._schemas[data] = {}
+        schema = schemas.get(key)
+        if schema is None:
+            schema = schemas[key] = self._Schema(self, self._fields, data, self._resolver)
+        return schema
+
     def _secret_column(self, column):
         if column.virtual:
             return column.secret_computer
@@ -269,71 +382,30 @@ class PresentedRow(object):
         self._resolve_dependencies()
         self._run_callback(self.CALL_CHANGE, None)
 
-    def _all_deps(self, computer):
-        all = []
-        for key in computer.depends():
-            all.append(key)
-            computer = self._coldict[key].computer
-            if computer:
-                all.extend(self._all_deps(computer))
-        return all
-        
     def _init_dependencies(self):
         # Pro každé políčko si zapamatuji seznam počítaných políček, která na
-        # něm závisí (obrácené mapování než ve specifikacích).
-        self._dependent = {}
-        self._editability_dependent = {}
-        self._visibility_dependent = {}
-        self._runtime_filter_dependent = {}
-        self._runtime_arguments_dependent = {}
+        # něm závisí (obrácené mapování než ve specifikacích).  Graf závislostí
+        # je sdílen všemi řádky se stejnými políčky.
+        dependencies = self._schema.dependencies
+        self._dependent = dependencies.dependent
+        self._editability_dependent = dependencies.editability_dependent
+        self._visibility_dependent = dependencies.visibility_dependent
+        self._runtime_filter_dependent = dependencies.runtime_filter_dependent
+        self._runtime_arguments_dependent = dependencies.runtime_arguments_dependent
         # Pro všechna počítaná políčka si pamatuji, zda potřebují přepočítat,
         # či nikoliv (po přepočítání je políčko čisté, po změně políčka na
         # kterém závisí jiná políčka nastavím závislým políčkům příznak
         # dirty).  Přepočítávání potom mohu provádět až při skutečném požadavku
         # na získání hodnoty políčka.
-        self._dirty = {}
-        self._editability_dirty = {}
-        self._editable = {}
-        self._visibility_dirty = {}
-        self._visible = {}
-        self._runtime_filter_dirty = {}
-        self._runtime_filter = {}
-        self._runtime_arguments_dirty = {}
-        self._runtime_arguments = {}
-        def make_deps(column, value_dict, dirty_dict, dependency_dict, computer):
-            key = column.id
-            if value_dict is not None:
-                value_dict[key] = None
-            dirty_dict[key] = True
-            for dep in self._all_deps(computer):
-                if dep in dependency_dict:
-                    dependency_dict[dep].append(key)
-                else:
-                    dependency_dict[dep] = [key]
-        for c in self._columns:
-            if c.computer is not None:
-                make_deps(c, None, self._dirty, self._dependent, c.computer)
-            if isinstance(c.editable, Computer):
-                make_deps(c, self._editable, self._editability_dirty, self._editability_dependent,
-                          c.editable)
-            if isinstance(c.visible, Computer):
-                make_deps(c, self._visible, self._visibility_dirty, self._visibility_dependent,
-                          c.visible)
-            if c.runtime_filter is not None:
-                make_deps(c, self._runtime_filter, self._runtime_filter_dirty,
-                          self._runtime_filter_dependent, c.runtime_filter)
-            if c.runtime_arguments is not None:
-                make_deps(c, self._runtime_arguments, self._runtime_arguments_dirty,
-                          self._runtime_arguments_dependent, c.runtime_arguments)
-        def add_secret(column):
-            for key in self._dependent.get(column.id, []):
-                column = self._coldict[key]
-                if not column.secret_computer:
-                    column.secret_computer = True
-                    add_secret(column)
-        for column in self._columns:
-            if not self.permitted(column.id, pytis.data.Permission.VIEW):
-                add_secret(column)
+        self._dirty = dict.fromkeys(dependencies.computed, True)
+        self._editability_dirty = dict.fromkeys(dependencies.editable, True)
+        self._editable = dict.fromkeys(dependencies.editable)
+        self._visibility_dirty = dict.fromkeys(dependencies.visible, True)
+        self._visible = dict.fromkeys(dependencies.visible)
+        self._runtime_filter_dirty = dict.fromkeys(dependencies.runtime_filter, True)
+        self._runtime_filter = dict.fromkeys(dependencies.runtime_filter)
+        self._runtime_arguments_dirty = dict.fromkeys(dependencies.runtime_arguments, True)
+        self._runtime_arguments = dict.fromkeys(dependencies.runtime_arguments)
 
     def __getitem__(self, key, lazy=False):
         """Vrať hodnotu políčka 'key' jako instanci třídy 'pytis.data.Value'.
@@ -435,12 +507,14 @@ class PresentedRow(object):
         for k in remove_duplicates(changed_enumerations):
             self._run_callback(self.CALL_ENUMERATION_CHANGE, k)
         if self._callbacks and key is not None and key in self._dependent:
-            # Call 'chage_callback' for all remaining dirty fields.  Some fields may already have
-            # been recomputed during the editability and runtime filter recomputations.  The
-            # callbacks for those fields have already been generated, but here we neen to handle
-            # the rest.
-            for k, dirty in self._dirty.items():
-                if dirty:
+            # Call 'chage_callback' for all remaining dirty fields depending on the changed field.
+            # Some fields may already have been recomputed during the editability and runtime
+            # filter recomputations.  The callbacks for those fields have already been generated,
+            # but here we neen to handle the rest.  The dependent fields are sorted
+            # topologically, so each field is recomputed only once, after all fields it depends
+            # on.
+            for k in self._dependent[key]:
+                if self._dirty[k]:
                     self._run_callback(self.CALL_CHANGE, k)
     
     def _recompute_editability(self, key=None):
@@ -450,14 +524,16 @@ class PresentedRow(object):
             keys = self._editability_dependent[key]
         else:
             return
-        if self._callbacks:
-            for k in keys:
-                old = self._editable[k]
+        # Only the fields with a registered callback must be recomputed
+        # immediately, the rest is recomputed on demand.
+        callbacks = self._callbacks.get(self.CALL_EDITABILITY_CHANGE, {})
+        for k in keys:
+            if k in callbacks:
+                old = None if self._editability_dirty[k] else self._editable[k]
                 new = self._compute_editability(k)
                 if old != new:
                     self._run_callback(self.CALL_EDITABILITY_CHANGE, k)
-        else:
-            for k in keys:
+            else:
                 self._editability_dirty[k] = True
 
     def _compute_editability(self, key):
@@ -474,14 +550,16 @@ class PresentedRow(object):
             keys = self._visibility_dependent[key]
         else:
             return
-        if self._callbacks:
-            for k in keys:
-                old = self._visible[k]
+        # Only the fields with a registered callback must be recomputed
+        # immediately, the rest is recomputed on demand.
+        callbacks = self._callbacks.get(self.CALL_VISIBILITY_CHANGE, {})
+        for k in keys:
+            if k in callbacks:
+                old = None if self._visibility_dirty[k] else self._visible[k]
                 new = self._compute_visibility(k)
                 if old != new:
                     self._run_callback(self.CALL_VISIBILITY_CHANGE, k)
-        else:
-            for k in keys:
+            else:
                 self._visibility_dirty[k] = True
 
     def _compute_visibility(self, key):
@@ -1048,6 +1126,73 @@ class PresentedRow(object):
         else:
             return ''
     
+    def prefetch_codebooks(self, rows, keys=None):
+        """Load codebook rows needed to display given data rows in advance.
+
+        Arguments:
+
+          rows -- sequence of data rows ('pytis.data.Row' instances) of this
+            row's data object, typically the rows of one visible page of a
+            table; 'None' items (such as newly inserted rows) are ignored.
+          keys -- sequence of field identifiers to be displayed or None for all
+            fields.
+
+        Codebook values of the fields 'keys' (including the fields used by
+        their 'CbComputer' instances) found in 'rows' are retrieved by one
+        query for each codebook and stored in the cache of the codebook's
+        'pytis.data.DataEnumerator'.  Subsequent calls of 'display()',
+        'cb_value()' and codebook computers on these rows then don't need to
+        query the database row by row.
+
+        Fields with run-time filters or arguments depending on other fields
+        are ignored as well as all fields when the row is bound to a
+        transaction (enumerator cache is not used within transactions).
+
+        """
+        if self._transaction is not None:
+            return
+        if keys is None:
+            keys = [c.id for c in self._columns]
+        field_ids = []
+        for key in keys:
+            column = self._coldict.get(key)
+            if column is None or self._secret_column(column):
+                continue
+            if isinstance(column.computer, CbComputer):
+                key = column.computer.field()
+            if key not in field_ids and key in self._coldict:
+                field_ids.append(key)
+        for key in field_ids:
+            column = self._coldict[key]
+            ctype = column.type
+            if isinstance(ctype, pytis.data.Array):
+                ctype = ctype.inner_type()
+            enumerator = ctype.enumerator()
+            if not isinstance(enumerator, pytis.data.DataEnumerator):
+                continue
+            if [c for c in (column.runtime_filter, column.runtime_arguments)
+                if c is not None and c.depends()]:
+                continue
+            values = []
+            for row in rows:
+                if row is None:
+                    continue
+                try:
+                    value = row[key]
+                except KeyError:
+                    break
+                if isinstance(column.type, pytis.data.Array):
+                    values.extend([v.value() for v in value.value() or ()])
+                else:
+                    values.append(value.value())
+            if not values:
+                continue
+            try:
+                enumerator.prefetch(values, condition=self.runtime_filter(key),
+                                    arguments=self.runtime_arguments(key))
+            except pytis.data.DataAccessException:
+                pass
+
     def enumerate(self, key):
         """Return the list of valid values of an enumeration field.
 
@@ -4917,6 +4917,18 @@ class Specification(SpecificationBase):
 
     """
 
+    snapshot = False
+    """Iff true then the whole table is cached in memory by its data objects.
+
+    Selects, row retrievals and distinct values are then served from the
+    in-memory copy without database queries and the copy is reloaded after
+    a change notification of the table arrives.  This is useful for small,
+    rarely changing codebook tables, such as languages or units, used in
+    enumerators.  See the 'snapshot' argument of
+    'pytis.data.DBDataPostgreSQL' for limitations.
+
+    """
+
     __metaclass__ = _SpecificationMetaclass
     _specifications_by_db_spec_name = {}
     _access_rights = None
@@ -5121,7 +5133,7 @@ class Specification(SpecificationBase):
         # applications, it should be removed from here too.
         for attr in ('fields', 'arguments', 'crypto_names', 'access_rights', 'condition',
                      'distinct_on', 'bindings', 'cb', 'check', 'sorting', 'profiles', 'filters',
-                     'folding', 'initial_folding', 'query_fields', 'ro_select',):
+                     'folding', 'initial_folding', 'query_fields', 'ro_select', 'snapshot',):
             if hasattr(self, attr):
                 value = getattr(self, attr)
                 if isinstance(value, collections.Callable) and len(argument_names(value)) == 0:
@@ -5135,7 +5147,8 @@ class Specification(SpecificationBase):
                               'distinct_on', 'data_cls', 'bindings', 'cb', 'prints',
                               'data_access_rights', 'crypto_names',
                               'add_specification_by_db_spec_name', 'create_from_kwargs',
-                              'ro_select', 'oid', # for backwards compatibility
+                              'ro_select', 'snapshot',
+                              'oid', # for backwards compatibility
                               ))):
                 self._view_spec_kwargs[attr] = getattr(self, attr)
         if isinstance(self.bindings, (tuple, list)):
@@ -5317,6 +5330,8 @@ class Specification(SpecificationBase):
                       condition=self.condition, distinct_on=self.distinct_on,
                       arguments=arguments, crypto_names=self.crypto_names,
                       db_spec=db_spec, ro_select=self.ro_select)
+        if self.snapshot:
+            kwargs['snapshot'] = True
         return pytis.data.DataFactory(self.data_cls, *args, **kwargs)
 
     def _create_view_spec(self, title=None, **kwargs):
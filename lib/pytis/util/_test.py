@@ -20,6 +20,7 @@
 
 import operator
 import StringIO
+import time
 import unittest
 
 import util
@@ -446,6 +447,60 @@ class Caching(unittest.TestCase):
         self.assertEqual(len(c), 2)
         self.assertEqual(c[4], 16)
         self.assertLessEqual(len(c), 2)
+    def test_lru(self):
+        calls = []
+        def squarer(key):
+            calls.append(key)
+            return key*key
+        c = caching.LimitedCache(squarer, limit=2)
+        self.assertEqual((c[2], c[3], c[2], c[4]), (4, 9, 4, 16))
+        self.assertEqual(sorted(c.keys()), [2, 4])
+        self.assertEqual(c[2], 4)
+        self.assertEqual(calls, [2, 3, 4])
+        self.assertIsNone(c.get(3))
+        self.assertEqual(c.statistics(), dict(hits=2, misses=4, evictions=1, items=2))
+        c.reset()
+        self.assertEqual(len(c), 0)
+    def test_ttl_and_weight(self):
+        c = caching.LimitedCache(lambda key: 'x' * key, ttl=0.1, weight=len, max_weight=10)
+        self.assertEqual(c[4], 'xxxx')
+        self.assertEqual(c[5], 'xxxxx')
+        self.assertEqual(c.statistics()['weight'], 9)
+        self.assertEqual(c[3], 'xxx')
+        self.assertEqual(sorted(c.keys()), [3, 5])
+        self.assertEqual(c.statistics()['weight'], 8)
+        self.assertEqual(c[20], 'x' * 20)
+        self.assertEqual(c.keys(), [20])
+        time.sleep(0.2)
+        self.assertIsNone(c.get(20))
+        self.assertEqual(len(c), 0)
+    def test_ttl_expired_items(self):
+        c = caching.LimitedCache(lambda key: key * 2, ttl=0.1)
+        self.assertEqual((c[1], c[2]), (2, 4))
+        self.assertIn(1, c)
+        self.assertEqual(sorted(c.keys()), [1, 2])
+        time.sleep(0.2)
+        self.assertEqual(c[3], 6)
+        self.assertNotIn(1, c)
+        self.assertFalse(c.has_key(2))
+        self.assertEqual(c.keys(), [3])
+        self.assertEqual(len(c), 1)
+        self.assertEqual(c.statistics()['items'], 1)
+    def test_range_cache(self):
+        data = range(0, 250, 10)
+        calls = []
+        def provider(start, size):
+            calls.append(start)
+            return data[start:start + size]
+        c = caching.RangeCache(provider, size=10, limit=1)
+        self.assertEqual(c[3], 30)
+        self.assertEqual(c[9], 90)
+        self.assertEqual(c[24], 240)
+        self.assertRaises(IndexError, lambda: c[25])
+        self.assertRaises(IndexError, lambda: c[-1])
+        self.assertEqual(c[0], 0)
+        self.assertEqual(calls, [0, 20, 0])
+        self.assertEqual(c.statistics()['evictions'], 2)
 tests.add(Caching)
 
 
@@ -25,6 +25,8 @@ Modul nabízí třídy umožňující provádět různé typy cachování.
 """
 
 import collections
+import thread
+import time
 import UserDict
 
 from pytis.util import *
@@ -50,6 +52,9 @@ class _Cache(object, UserDict.UserDict):
         assert isinstance(provider, collections.Callable)
         self._provider = provider
         self._validator = validator
+        self._hits = 0
+        self._misses = 0
+        self._evictions = 0
 
     def __getitem__(self, key):
         """Vrať hodnotu odpovídající klíči 'key'.
@@ -64,7 +69,10 @@ class _Cache(object, UserDict.UserDict):
             if self._validator is not None and not self._validator(key):
                 raise KeyError()
         except KeyError:
+            self._misses += 1
             result = self[key] = self._provider(key)
+        else:
+            self._hits += 1
         return result
 
     def __setitem__(self, key, value):
@@ -75,6 +83,20 @@ class _Cache(object, UserDict.UserDict):
         """Kompletně zruš aktuální obsah cache."""
         self.data = {}
 
+    def statistics(self):
+        """Return dictionary of the cache usage statistics.
+
+        The dictionary contains the following items: 'hits' and 'misses' --
+        the number of lookups served from the cache and the number of those
+        requiring a call of the provider since the cache creation;
+        'evictions' -- the number of items removed from the cache to respect
+        its limits; 'items' -- the number of items currently present in the
+        cache.
+
+        """
+        return dict(hits=self._hits, misses=self._misses, evictions=self._evictions,
+                    items=len(self))
+
 
 class SimpleCache(_Cache):
     """Jednoduchá cache s neomezeným počtem uložených položek."""
@@ -84,10 +106,19 @@ class LimitedCache(_Cache):
     """Cache s omezeným počtem položek.
 
     V konstruktoru je zadán maximální počet položek cache, který není nikdy
-    překročen.
+    překročen.  Při jeho dosažení jsou z cache vyřazovány nejdéle nepoužité
+    položky (LRU).  Volitelně lze omezit dobu platnosti položek a jejich
+    celkovou váhu.
+
+    Všechny operace jsou thread-safe a kromě operací nad celým obsahem cache
+    ('keys()', 'len()' apod., které vyřazují položky s prošlou platností)
+    mají konstantní časovou složitost.  Funkce 'provider' je však volána
+    mimo zámek, takže ji souběžné thready mohou pro tentýž klíč zavolat
+    vícekrát.
 
     """
-    def __init__(self, provider, limit=1000):
+    def __init__(self, provider, limit=1000, ttl=None, weight=None, max_weight=None,
+                 validator=None):
         """Inicializuj instanci.
 
         Argumenty:
@@ -95,50 +126,213 @@ class LimitedCache(_Cache):
           provider -- stejné jako v předkovi
           limit -- nezáporný integer určující maximální povolený počet položek
             cache
+          ttl -- maximální doba platnosti položky v sekundách (číslo) nebo
+            'None'; starší položky jsou považovány za neplatné
+          weight -- funkce jednoho argumentu, kterým je hodnota, vracející
+            nezáporné číslo určující váhu (například odhad velikosti) položky,
+            nebo 'None'
+          max_weight -- maximální celková váha položek cache; musí být zadána
+            právě když je zadána funkce 'weight'.  Naposledy vložená položka
+            není nikdy vyřazena, i když sama limit překračuje.
+          validator -- stejné jako v předkovi
           
         """
-        super(LimitedCache, self).__init__(provider)
-        assert type(limit) == type(0)
+        super(LimitedCache, self).__init__(provider, validator=validator)
+        assert isinstance(limit, int), limit
+        assert ttl is None or isinstance(ttl, (int, float)) and ttl > 0, ttl
+        assert weight is None or isinstance(weight, collections.Callable), weight
+        assert (weight is None) == (max_weight is None), (weight, max_weight)
         self._limit = limit
-        self._counter = Counter()
+        self._ttl = ttl
+        self._weight = weight
+        self._max_weight = max_weight
         self._lock = thread.allocate_lock()
+        self.reset()
+
+    def _remove(self, key):
+        # Must be called with the lock held.
+        del self.data[key]
+        if self._ttl is not None:
+            del self._expiration[key]
+        if self._weight is not None:
+            self._total_weight -= self._weights.pop(key)
+
+    def _lookup(self, key):
+        # Return the pair (FOUND, VALUE) and mark the item as recently used.
+        def lfunction():
+            data = self.data
+            if key not in data:
+                return False, None
+            if self._ttl is not None and self._expiration[key] <= time.time():
+                self._remove(key)
+                return False, None
+            # Move the item to the end of the LRU order.
+            value = data.pop(key)
+            data[key] = value
+            return True, value
+        return with_lock(self._lock, lfunction)
+
+    def _count(self, found):
+        def lfunction():
+            if found:
+                self._hits += 1
+            else:
+                self._misses += 1
+        with_lock(self._lock, lfunction)
+
+    def _valid_data(self):
+        # Remove expired items and return the data dictionary.
+        # Must be called with the lock held.
+        if self._ttl is not None:
+            now = time.time()
+            for key in [k for k, t in self._expiration.items() if t <= now]:
+                self._remove(key)
+        return self.data
 
     def __getitem__(self, key):
-        result = super(LimitedCache, self).__getitem__(key)
+        found, result = self._lookup(key)
+        if found and self._validator is not None and not self._validator(key):
+            found = False
+        self._count(found)
+        if not found:
+            result = self[key] = self._provider(key)
         return result
 
     def __setitem__(self, key, value):
         if self._limit > 0:
             def lfunction():
-                if self._counter.next() > self._limit:
-                    self._collect()
-                super(LimitedCache, self).__setitem__(key, value)
+                data = self.data
+                if key in data:
+                    self._remove(key)
+                data[key] = value
+                if self._ttl is not None:
+                    self._expiration[key] = time.time() + self._ttl
+                if self._weight is not None:
+                    weight = self._weights[key] = self._weight(value)
+                    self._total_weight += weight
+                while ((len(data) > self._limit or
+                        (self._max_weight is not None and
+                         self._total_weight > self._max_weight and len(data) > 1))):
+                    self._remove(next(iter(data)))
+                    self._evictions += 1
             with_lock(self._lock, lfunction)
 
+    def __delitem__(self, key):
+        with_lock(self._lock, lambda: self._remove(key))
+
+    def get(self, key, default=None):
+        """Return the cached value of 'key' or 'default' if there is none.
+
+        Unlike item access, the provider is never called.
+
+        """
+        found, result = self._lookup(key)
+        self._count(found)
+        if not found:
+            result = default
+        return result
+
+    def keys(self):
+        return with_lock(self._lock, lambda: self._valid_data().keys())
+
+    def items(self):
+        return with_lock(self._lock, lambda: self._valid_data().items())
+
+    def values(self):
+        return with_lock(self._lock, lambda: self._valid_data().values())
+
+    def has_key(self, key):
+        return key in self
+
+    def __contains__(self, key):
+        def lfunction():
+            if key not in self.data:
+                return False
+            if self._ttl is not None and self._expiration[key] <= time.time():
+                self._remove(key)
+                return False
+            return True
+        return with_lock(self._lock, lfunction)
+
+    def __len__(self):
+        return with_lock(self._lock, lambda: len(self._valid_data()))
+
     def reset(self):
-        super(LimitedCache, self).reset()
-        self._counter.reset()
-        
-    def _collect(self):
-        self.reset()
+        def lfunction():
+            self.data = collections.OrderedDict()
+            self._expiration = {}
+            self._weights = {}
+            self._total_weight = 0
+        with_lock(self._lock, lfunction)
+
+    def statistics(self):
+        """Stejné jako v předkovi.
+
+        Je-li zadána funkce 'weight', obsahuje slovník navíc položku 'weight'
+        s celkovou váhou položek cache.
+
+        """
+        result = super(LimitedCache, self).statistics()
+        if self._weight is not None:
+            result['weight'] = self._total_weight
+        return result
 
 
 class RangeCache(_Cache):
     """Cache s celočíselnými klíči ukládající souvislé úseky dat.
 
     Tyto úseky jsou dány souvislými intervaly klíčů, dané velikosti.
-    V podstatě se tedy jedná o pole cachovaných hodnot.
+    V podstatě se tedy jedná o pole cachovaných hodnot.  Úseky jsou uloženy
+    v 'LimitedCache', nejdéle nepoužité úseky jsou tedy vyřazovány.
 
     """
-    def __init__(self, provider, size=1000):
+    def __init__(self, provider, size=1000, limit=100, ttl=None):
         """Inicializuj instanci.
 
         Argumenty:
 
-          provider -- stejné jako v předkovi
-          size -- nezáporný integer, maximální velikost cachovaného úseku dat
+          provider -- funkce dvou argumentů, počátečního klíče úseku a jeho
+            velikosti, vracející sekvenci hodnot pro klíče od počátečního
+            klíče dál; sekvence může být kratší než požadovaná velikost,
+            pokud data dříve končí
+          size -- kladný integer, maximální velikost cachovaného úseku dat
+          limit -- nezáporný integer, maximální počet cachovaných úseků
+          ttl -- stejné jako v 'LimitedCache'
 
         """
-        super(RangeCache, self).__init__(self, provider)
-        assert type(size) == type(0)
+        super(RangeCache, self).__init__(provider)
+        assert isinstance(size, int) and size > 0, size
         self._size = size
+        self._segments = LimitedCache(self._get_segment, limit=limit, ttl=ttl)
+
+    def _get_segment(self, start):
+        return tuple(self._provider(start, self._size))
+
+    def __getitem__(self, key):
+        """Vrať hodnotu odpovídající klíči 'key'.
+
+        Pokud klíč leží mimo rozsah dat vrácených funkcí 'provider', vyvolej
+        výjimku 'IndexError'.
+
+        """
+        assert isinstance(key, (int, long)), key
+        if key < 0:
+            raise IndexError(key)
+        start = key - key % self._size
+        try:
+            return self._segments[start][key - start]
+        except IndexError:
+            raise IndexError(key)
+
+    def __setitem__(self, key, value):
+        raise ProgramError("Values can't be stored into a range cache")
+
+    def __len__(self):
+        return sum([len(segment) for segment in self._segments.data.values()])
+
+    def reset(self):
+        self._segments.reset()
+
+    def statistics(self):
+        """Stejné jako v předkovi, čísla se však týkají celých úseků dat."""
+        return self._segments.statistics()
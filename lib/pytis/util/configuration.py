@@ -641,6 +641,38 @@ class Configuration(object):
         u"""Flag určující, zda má být spouštěn dohlížeč změn dat."""
         _DEFAULT = True
 
+    class _Option_dbnotification_delay(NumericOption):
+        u"""Minimální odstup oznámení o změnách dat jednoho datového objektu v milisekundách.
+
+        Oznámení o změnách přijatá během této doby od posledního vyvolání
+        callbacků jsou sloučena a callbacky každého dotčeného datového objektu
+        jsou po jejím uplynutí zavolány jen jednou.
+
+        """
+        _DEFAULT = 500
+
+    class _Option_dbprepared_statements(BooleanOption):
+        u"""Flag určující, zda mají být často opakované SQL příkazy předpřipraveny.
+
+        Je-li nastaven, jsou příkazy pro načítání, vkládání, aktualizaci a
+        mazání jednotlivých řádků provedeny jako předpřipravené příkazy
+        (PREPARE), takže je databázový server v rámci jednoho spojení
+        analyzuje a plánuje pouze jednou.
+
+        """
+        _DEFAULT = True
+
+    class _Option_table_metadata_cache_file(StringOption):
+        u"""Soubor pro ukládání popisu sloupců databázových tabulek.
+
+        Je-li zadán, jsou zde uloženy informace o sloupcích všech tabulek
+        použitých schémat a při dalším spuštění aplikace jsou načteny odtud
+        místo z katalogu databáze, pokud se mezitím schéma databáze nezměnilo.
+        Je-li 'None', jsou informace vždy načítány z databáze.
+
+        """
+        _DEFAULT = None
+
     class _Option_max_pool_connections(NumericOption):
         """Maximum number of connections in database connection pool.
 
@@ -660,6 +692,35 @@ class Configuration(object):
         """
         _DEFAULT = None
 
+    class _Option_connection_wait_timeout(NumericOption):
+        """Maximum time to wait for a free database connection.
+
+        When 'connection_limit' is reached, requests for new connections wait
+        for other connections to be returned to the pool.  The value is the
+        maximum waiting time in seconds, after which the request fails.
+
+        """
+        _DEFAULT = 30
+
+    class _Option_connection_max_age(NumericOption):
+        """Maximum age of a pooled database connection in seconds.
+
+        Idle connections older than the given number of seconds are closed
+        instead of being reused.  If None then there is no limit.
+
+        """
+        _DEFAULT = None
+
+    class _Option_connection_max_idle(NumericOption):
+        """Maximum idle time of a pooled database connection in seconds.
+
+        Connections not used for longer time are closed instead of being
+        reused, since they may be already terminated by the server or network
+        components.  If None then there is no limit.
+
+        """
+        _DEFAULT = 3600
+
     # Logovací volby
 
     class _Option_log_logger(Option):
@@ -869,6 +930,53 @@ class Configuration(object):
         """
         _DEFAULT = 20000
 
+    class _Option_cache_memory_limit(NumericOption):
+        u"""Maximální velikost paměti pro cache řádků datového objektu.
+
+        Hodnota je celé číslo udávající přibližný počet bajtů, které mohou
+        řádky v cache jednoho datového objektu zabírat, nebo 'None', pokud má
+        být velikost cache omezena pouze volbou 'cache_size'.  Velikost řádků
+        je pouze odhadována.
+
+        """
+        _DEFAULT = 64 * 1024 * 1024
+
+    class _Option_enumerator_cache_size(NumericOption):
+        u"""Maximální počet řádků číselníku uchovávaných v cache enumerátoru.
+
+        Řádky číselníků načtené při validaci a zobrazování hodnot jsou
+        uchovávány až do oznámení o změně dat číselníku.  Nejsou-li změny dat
+        číselníku oznamovány (např. při vypnutém 'dblisten'), jsou uchovávány
+        nejvýše po dobu 'enumerator_cache_ttl'.  Při dosažení limitu jsou
+        vyřazovány nejdéle nepoužité řádky.  Hodnota 0 cache vypíná.
+
+        """
+        _DEFAULT = 1000
+
+    class _Option_enumerator_cache_ttl(NumericOption):
+        u"""Doba platnosti řádků v cache enumerátoru v sekundách.
+
+        Uplatní se jen u číselníků, o jejichž změnách nejsou rozesílána
+        oznámení, viz 'enumerator_cache_size'.  Hodnota 0 cache takových
+        číselníků vypíná.
+
+        """
+        _DEFAULT = 60
+
+    class _Option_row_count_cache_size(NumericOption):
+        u"""Maximální počet počtů řádků selectů uchovávaných v cache procesu.
+
+        Počty řádků selectů nad tabulkami, o jejichž změnách jsou rozesílána
+        oznámení, jsou uchovávány až do oznámení o změně dat některé z tabulek
+        a opakované selecty se stejnou podmínkou a argumenty je již nepočítají.
+        Cache se uplatní jen při zapnutém 'dblisten' a jen tehdy, když jsou
+        všechny změny dat tabulek oznamovány (aplikacemi pytis nebo triggery).
+        Při dosažení limitu jsou vyřazovány nejdéle nepoužité počty.  Hodnota 0
+        cache vypíná.
+
+        """
+        _DEFAULT = 0
+
     class _Option_initial_fetch_size(NumericOption):
         u"""Počet řádků, které se přednačtou do cache při první selectu z datového objektu."""
         _DEFAULT = 100
@@ -877,6 +985,28 @@ class Configuration(object):
         u"""Počet řádků, které se přinačítají do cache při dalších selectech z datového objektu."""
         _DEFAULT = 100
 
+    class _Option_fetch_batch_size(NumericOption):
+        u"""Počet řádků zpracovávaných najednou při převodu výsledku databázového dotazu.
+
+        Řádky výsledku jsou z databázového rozhraní odebírány a převáděny po
+        dávkách této velikosti, takže celý výsledek nemusí být nikdy uložen
+        v paměti najednou.
+
+        """
+        _DEFAULT = 1000
+
+    class _Option_row_count_estimate(BooleanOption):
+        u"""Flag určující, zda se má při asynchronním počítání řádků použít odhad.
+
+        Je-li nastaven, je při otevření formuláře bez filtrační podmínky počet
+        řádků nejprve odhadnut ze statistik databázového plánovače a tento
+        odhad je zobrazován, dokud není dokončeno skutečné počítání řádků.
+        Formuláře nad velkými tabulkami se tak otevírají okamžitě.  Odhady
+        filtrovaných selectů bývají nepřesné, proto se u nich nepoužívají.
+
+        """
+        _DEFAULT = True
+
     class _Option_sender_address(StringOption):
         u"""E-mailová adresa odesílatele použitá např. jako odchozí adresa bug-reportů apod."""
         _DEFAULT = None
@@ -1544,6 +1544,7 @@ class BrowseForm(LayoutForm):
         self._select_columns = [c.id() for c in self._row.data().columns()
                                 if not isinstance(c.type(), pytis.data.Big)]
         self._row_count = None
+        self._aggregation_values = None
 
     def _tree_level(self):
         if self._tree_order_column:
@@ -1668,10 +1669,25 @@ class BrowseForm(LayoutForm):
                            cls='row-expansion', style="display: none;")
         return result
 
+    def _aggregation_results(self):
+        # Compute all the aggregations displayed in the table footer by a
+        # single query.
+        if self._aggregation_values is None:
+            fields = [f for f in self._column_fields
+                      if not f.virtual and isinstance(f.type, pytis.data.Number)]
+            operations = [(op, f.id) for op in self._view.aggregations() for f in fields]
+            values = self._row.data().select_aggregates(operations,
+                                                        condition=self._conditions(),
+                                                        arguments=self._arguments)
+            self._aggregation_values = dict(zip(operations, values))
+        return self._aggregation_values
+
     def _export_aggregation(self, context, op):
+        results = self._aggregation_results()
         def export_aggregation_value(data, op, field):
-            if not field.virtual and isinstance(field.type, pytis.data.Number):
-                return data.select_aggregate((op, field.id), condition=self._conditions()).export()
+            value = results.get((op, field.id))
+            if value is not None:
+                return value.export()
             else:
                 return ''
         g = context.generator()
@@ -1772,8 +1788,18 @@ class BrowseForm(LayoutForm):
         # really expensive (i.e. on binary fields).
         self._row.set_row(row)
 
-    def _table_rows(self):
+    def _table_rows(self, offset=None, limit=None):
         data = self._row.data()
+        if limit is not None:
+            # Retrieve just the given page without keeping the select open.
+            rows, self._row_count = data.select_page(columns=self._select_columns,
+                                                     condition=self._conditions(),
+                                                     arguments=self._arguments,
+                                                     sort=self._data_sorting,
+                                                     offset=offset or 0, limit=limit)
+            # Retrieve all codebook displays of the page at once.
+            self._row.prefetch_codebooks(rows, keys=[f.id for f in self._column_fields])
+            return iter(rows)
         self._row_count = data.select(columns=self._select_columns,
                                       condition=self._conditions(),
                                       arguments=self._arguments,
@@ -1796,21 +1822,32 @@ class BrowseForm(LayoutForm):
         data = self._row.data()
         limit = self._limit
         exported_rows = []
-        rows = self._table_rows()
-        row_count = self._row_count
         found = False
         offset = self._offset
-        if self._search:
-            dist = data.search(self._search)
-            if dist:
-                found = True
-                offset = dist - 1
-        if limit is not None:
-            page = int(max(0, min(offset, row_count - 1)) / limit)
+        if limit is not None and not self._search:
+            page = int(max(0, offset) / limit)
+            rows = self._table_rows(offset=page * limit, limit=limit)
+            row_count = self._row_count
+            if row_count and page * limit >= row_count:
+                # The offset points beyond the last row, show the last page.
+                page = int((row_count - 1) / limit)
+                rows = self._table_rows(offset=page * limit, limit=limit)
             first_record_offset = page * limit
+            skip = 0
         else:
-            page = 0
-            first_record_offset = 0
+            rows = self._table_rows()
+            row_count = self._row_count
+            if self._search:
+                dist = data.search(self._search)
+                if dist:
+                    found = True
+                    offset = dist - 1
+            if limit is not None:
+                page = int(max(0, min(offset, row_count - 1)) / limit)
+                first_record_offset = skip = page * limit
+            else:
+                page = 0
+                first_record_offset = skip = 0
         if row_count == 0:
             pages = 0
         elif limit is None:
@@ -1822,7 +1859,8 @@ class BrowseForm(LayoutForm):
         self._last_group = None
         group_values = last_group_values = None
         current_row_number = 0
-        data.skip(first_record_offset)
+        if skip:
+            data.skip(skip)
         for row in rows:
             self._set_row(row)
             if self._grouping:
@@ -2614,8 +2652,8 @@ class EditableBrowseForm(BrowseForm):
             removed_keys = ()
         return removed_keys
             
-    def _table_rows(self):
-        rows = super(EditableBrowseForm, self)._table_rows()
+    def _table_rows(self, **kwargs):
+        rows = super(EditableBrowseForm, self)._table_rows(**kwargs)
         self._row.inserted_row_number = None
         removed_keys = self._removed_keys()
         self._removed_rows = []